@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_file, Response, send_from_directory
+from flask import Flask, request, jsonify, send_file, Response, send_from_directory, stream_with_context
 from flask_cors import CORS
 import os
 import cv2
@@ -10,8 +10,7 @@ except ImportError:
     # Fallback implementation if needed
 import time
 import base64
-from PIL import Image, ImageDraw, ImageFont
-import io
+import binascii
 import datetime
 import json
 from sqlalchemy import Column, Integer, String, Float, DateTime, JSON as SQL_JSON, Boolean
@@ -36,10 +35,28 @@ from flask_jwt_extended import JWTManager, jwt_required, create_access_token, ge
 from werkzeug.security import generate_password_hash
 
 # Import db và các model từ models.py
-from models import db, User, Camera, CameraGroup, CameraGroupAssociation, Emotion, CameraSchedule, DetectionResult
+from models import db, User, Camera, CameraGroup, CameraGroupAssociation, Emotion, CameraSchedule, DetectionResult, EmotionRollup, RetentionPolicy, EMOTION_LABELS, to_vietnam_naive, vietnam_tz
 
 # Import blueprint từ camera_handler thay vì camera_manager
 from camera_handlers import get_active_camera, start_camera, stop_camera, stop_all_cameras
+from debug_capture import create_debug_capture
+from migrations import run_migrations
+from emotion_queries import parse_emotion_filters, apply_emotion_filters, has_emotion_filters, parse_date, list_emotions
+from rollups import register_rollup_listener, query_stats, ROLLUP_GRANULARITIES
+from partitioning import ensure_partitions, drop_partitions_before, is_partitioned, add_months, month_start
+from retention import create_retention_service
+from jobs import JobManager
+from storage import processed_path_for, remove_files, remove_tree
+from query_counter import init_query_count_header
+from camera_cache import camera_cache
+from camera_state import camera_state, register_camera_state_listener
+from event_stream import broker
+from mjpeg_stream import jpeg_cache, mjpeg_streams, get_fresh_handler, normalize_width, resize_to_width, BOUNDARY as MJPEG_BOUNDARY
+from auth_cache import auth_cache, token_id
+from detection_writer import create_detection_writer
+from emotion_export import iter_csv, iter_parquet, parquet_available
+from roi import parse_roi_polygon, region_of_interest
+from db_session import configure_engine_options, init_worker_sessions, worker_session, with_worker_session, pool_metrics
 
 # Load biến môi trường từ file .env
 load_dotenv()
@@ -62,22 +79,51 @@ app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'images')
 app.config['DEBUG_FOLDER'] = os.getenv('DEBUG_FOLDER', 'debug_images')
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'your-jwt-secret-key')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+# Để web server phía trước (nginx/apache) gửi file ảnh qua X-Sendfile
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', 'false').lower() == 'true'
 
 # Tạo thư mục lưu trữ nếu chưa tồn tại
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['DEBUG_FOLDER'], exist_ok=True)
 os.makedirs('static', exist_ok=True)
 
+# Bộ ghi ảnh debug có lấy mẫu, ghi ở thread nền thay vì ghi mọi frame
+debug_capture = create_debug_capture(app.config['DEBUG_FOLDER'])
+
+# Thời gian sống của cache thông tin camera và người dùng đã xác thực (giây)
+camera_cache.ttl = float(os.getenv('CAMERA_CACHE_TTL', '30'))
+auth_cache.ttl = float(os.getenv('AUTH_CACHE_TTL', '30'))
+
+# Luồng MJPEG: chất lượng JPEG và giới hạn fps
+jpeg_cache.quality = int(os.getenv('MJPEG_JPEG_QUALITY', '80'))
+mjpeg_streams.default_fps = float(os.getenv('MJPEG_DEFAULT_FPS', '10'))
+mjpeg_streams.max_fps = float(os.getenv('MJPEG_MAX_FPS', '30'))
+
+# Tác vụ nền (xóa camera, xóa dữ liệu cảm xúc) và kích thước mỗi lô DELETE
+job_manager = JobManager(app)
+DELETE_BATCH_SIZE = int(os.getenv('DELETE_BATCH_SIZE', '5000'))
+
 # Cấu hình CORS
 CORS(app, resources={r"/*": {
     "origins": os.getenv('CORS_ALLOWED_ORIGINS', '*').split(','),
     "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     "allow_headers": ["Content-Type", "Authorization", "X-Requested-With"],
+    "expose_headers": ["X-SQL-Queries"],
 }})
 
+# Cấu hình pool kết nối (kích thước, overflow, pre-ping, recycle) từ biến môi trường
+configure_engine_options(app)
+
 # Khởi tạo database với ứng dụng Flask
 db.init_app(app)
 
+# Thread nền (camera handler, detector, scheduler) dùng worker_session() để có session riêng
+init_worker_sessions(app)
+
+# Header X-SQL-Queries với số câu lệnh SQL của mỗi request, giúp phát hiện truy vấn N+1 khi phát triển
+if os.getenv('SQL_QUERY_COUNT_HEADER', 'false').lower() == 'true':
+    init_query_count_header(app)
+
 # Hàm tạo tài khoản admin mặc định nếu chưa tồn tại
 def create_default_admin():
     with app.app_context():
@@ -100,9 +146,18 @@ def create_default_admin():
         else:
             print("Tài khoản admin đã tồn tại")
 
-# Tạo database và admin user khi khởi động ứng dụng
+# Cập nhật bảng rollup thống kê mỗi khi có bản ghi Emotion mới
+register_rollup_listener()
+
+# Cập nhật trạng thái mới nhất của camera trong bộ nhớ sau mỗi lần commit bản ghi Emotion
+register_camera_state_listener()
+
+# Tạo database, chạy migration và tạo admin user khi khởi động ứng dụng
+# (chỉ migration nhanh; index CONCURRENTLY và backfill chạy bằng `python migrations.py` khi triển khai,
+# worker nào không lấy được khóa migration thì bỏ qua thay vì chờ)
 with app.app_context():
     db.create_all()
+    run_migrations(include_offline=False, wait=False)
     create_default_admin()
     
 # JWT configuration
@@ -113,6 +168,15 @@ JWT_EXPIRATION_DELTA = timedelta(days=1)
 # Khởi tạo JWT
 jwt_manager = JWTManager(app)
 
+@jwt_manager.user_lookup_loader
+def jwt_user_lookup(_jwt_header, jwt_data):
+    """Tải người dùng cho @jwt_required() qua cùng cache với token_required"""
+    try:
+        user_id = int(jwt_data['sub'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return auth_cache.get_principal(user_id, jwt_data.get('jti'))
+
 def generate_token(user):
     payload = {
         'user_id': user.id,
@@ -133,8 +197,9 @@ def token_required(f):
         
         try:
             payload = pyjwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-            current_user = User.query.get(payload['user_id'])
-            if not current_user or not current_user.is_active:
+            # Người dùng lấy từ cache (Principal chỉ đọc), chỉ truy vấn database khi cache hết hạn
+            current_user = auth_cache.get_principal(payload['user_id'], token_id(token, payload))
+            if not current_user:
                 return jsonify({'message': 'Invalid token'}), 401
         except pyjwt.ExpiredSignatureError:
             return jsonify({'message': 'Token has expired'}), 401
@@ -171,18 +236,14 @@ emotion_bp = Blueprint('emotion', __name__, url_prefix='/api/emotions')
 @emotion_bp.route('/', methods=['GET'], endpoint='get_all_emotions')
 @token_required
 def get_emotions(current_user):
-    # Lấy danh sách cảm xúc từ database
-    emotions = Emotion.query.all()
+    # Lấy danh sách cảm xúc từ database, tên camera được JOIN trong cùng truy vấn
+    emotions = list_emotions()
     return jsonify([emotion.to_dict() for emotion in emotions])
 
 # Đăng ký các blueprint
 app.register_blueprint(emotion_bp)
 app.register_blueprint(user_bp)
 
-# Tạo bảng trong database nếu chưa tồn tại
-with app.app_context():
-    db.create_all()
-
 # Tìm ID camera lớn nhất trong cơ sở dữ liệu
 def get_max_camera_id():
     try:
@@ -236,13 +297,12 @@ with app.app_context():
 # Hàm lấy đường dẫn tới thư mục hình ảnh cho camera
 def get_camera_image_dir(camera_id):
     """Lấy đường dẫn tuyệt đối đến thư mục hình ảnh của camera"""
-    base_dir = os.path.abspath(os.getcwd())
-    return os.path.join(base_dir, "images", f"camera{camera_id}")
+    return os.path.join(os.path.abspath(app.config['UPLOAD_FOLDER']), f"camera{camera_id}")
 
-def save_image_result(image_data, camera_id, emotion_result):
+def save_image_result(image_data, camera_id, emotion_result, processed_image=None):
     """Lưu hình ảnh và kết quả phân tích vào thư mục tương ứng"""
-    # Tạo timestamp cho tên file
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    # Tạo timestamp cho tên file (có micro giây để nhiều frame trong cùng giây không ghi đè nhau)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
     
     # Lấy đường dẫn thư mục hình ảnh cho camera
     image_folder = get_camera_image_dir(camera_id)
@@ -267,8 +327,10 @@ def save_image_result(image_data, camera_id, emotion_result):
     # Lưu hình ảnh gốc
     cv2.imwrite(image_path, image_data)
     
-    # Lấy ảnh đã xử lý từ base64 string trong kết quả, nếu có
-    if 'processed_image' in emotion_result and emotion_result['processed_image']:
+    # Lưu ảnh đã xử lý trực tiếp từ mảng ảnh nếu có, nếu không thì lấy từ base64 string trong kết quả
+    if processed_image is not None:
+        cv2.imwrite(processed_path, processed_image)
+    elif 'processed_image' in emotion_result and emotion_result['processed_image']:
         try:
             # Decode base64 thành binary
             processed_data = base64.b64decode(emotion_result['processed_image'])
@@ -279,111 +341,385 @@ def save_image_result(image_data, camera_id, emotion_result):
         except Exception as e:
             print(f"Error saving processed image: {e}")
     
-    # Lưu kết quả phân tích JSON
+    # Lưu kết quả phân tích JSON (ảnh đã được lưu thành file riêng)
     with open(result_path, 'w') as f:
-        json.dump(emotion_result, f)
+        json.dump({k: v for k, v in emotion_result.items() if k != 'processed_image'}, f)
     
     return image_path, result_path, processed_path
 
+def build_emotion_entry(camera_id, image_path, result_path, processed_path, emotion_result, timestamp=None):
+    """Tạo bản ghi Emotion (chưa lưu vào database) từ kết quả phát hiện cảm xúc"""
+    # Đọc hình ảnh gốc và chuyển đổi thành base64
+    image_base64 = None
+    if os.path.exists(image_path):
+        with open(image_path, 'rb') as img_file:
+            image_data = img_file.read()
+            image_base64 = base64.b64encode(image_data).decode('utf-8')
+    
+    # Đọc hình ảnh đã xử lý và chuyển đổi thành base64
+    processed_image_base64 = None
+    if os.path.exists(processed_path):
+        with open(processed_path, 'rb') as img_file:
+            processed_data = img_file.read()
+            processed_image_base64 = base64.b64encode(processed_data).decode('utf-8')
+    elif 'processed_image' in emotion_result:
+        processed_image_base64 = emotion_result.get('processed_image')
+    
+    # Tạo bản ghi mới
+    emotion_entry = Emotion(
+        camera_id=camera_id,
+        image_path=image_path,
+        result_path=result_path,
+        dominant_emotion=emotion_result.get('dominant_emotion', 'unknown'),
+        emotion_scores=emotion_result.get('emotion', {}),
+        image_base64=image_base64,
+        processed_image_base64=processed_image_base64
+    )
+    
+    # Dùng thời điểm chụp do client gửi lên nếu có
+    if timestamp:
+        emotion_entry.timestamp = timestamp
+    
+    return emotion_entry
+
 def save_to_database(camera_id, image_path, result_path, processed_path, emotion_result):
     """Lưu kết quả phát hiện cảm xúc vào cơ sở dữ liệu PostgreSQL"""
     try:
-        # Cập nhật thời gian sử dụng cuối cùng của camera
-        camera = Camera.query.get(camera_id)
-        if camera:
-            camera.last_used = datetime.datetime.now()
-            db.session.commit()
+        emotion_entry = build_emotion_entry(camera_id, image_path, result_path, processed_path, emotion_result)
         
-        # Đọc hình ảnh gốc và chuyển đổi thành base64
-        image_base64 = None
-        if os.path.exists(image_path):
-            with open(image_path, 'rb') as img_file:
-                image_data = img_file.read()
-                image_base64 = base64.b64encode(image_data).decode('utf-8')
-        
-        # Đọc hình ảnh đã xử lý và chuyển đổi thành base64
-        processed_image_base64 = None
-        if os.path.exists(processed_path):
-            with open(processed_path, 'rb') as img_file:
-                processed_data = img_file.read()
-                processed_image_base64 = base64.b64encode(processed_data).decode('utf-8')
-        elif 'processed_image' in emotion_result:
-            processed_image_base64 = emotion_result.get('processed_image')
-        
-        # Tạo bản ghi mới
-        emotion_entry = Emotion(
-            camera_id=camera_id,
-            image_path=image_path,
-            result_path=result_path,
-            dominant_emotion=emotion_result.get('dominant_emotion', 'unknown'),
-            emotion_scores=emotion_result.get('emotion', {}),
-            image_base64=image_base64,
-            processed_image_base64=processed_image_base64
-        )
-        
-        # Lưu vào cơ sở dữ liệu
+        # Lưu vào cơ sở dữ liệu (lấy ID sau flush để không phải tải lại bản ghi sau commit)
         db.session.add(emotion_entry)
+        db.session.flush()
+        emotion_id, timestamp = emotion_entry.id, emotion_entry.timestamp
         db.session.commit()
         
-        return True, emotion_entry.id
+        # Gửi kết quả đã lưu tới client đang nghe /api/events
+        broker.publish_emotion(camera_id, emotion_id, emotion_result, timestamp)
+        
+        return True, emotion_id
     except Exception as e:
         db.session.rollback()
         print(f"Error saving to database: {e}")
         return False, None
 
+# Các chế độ trả ảnh trong response: không trả, trả URL, hoặc nhúng base64
+IMAGE_RESPONSE_MODES = ('none', 'url', 'inline')
+
+def get_image_response_mode(default='inline'):
+    """Lấy chế độ trả ảnh từ tham số `images` của request"""
+    mode = (request.args.get('images') or default).lower()
+    return mode if mode in IMAGE_RESPONSE_MODES else default
+
+def encode_file_base64(path):
+    """Đọc file và mã hóa base64, trả về None nếu file không tồn tại"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return base64.b64encode(f.read()).decode('utf-8')
+
+def build_image_fields(mode, db_id, processed_path):
+    """Tạo các trường ảnh trong response theo chế độ trả ảnh"""
+    if mode == 'inline':
+        return {'processed_image': encode_file_base64(processed_path) or ''}
+    if mode == 'url' and db_id:
+        return {
+            'image_url': f'/api/image/{db_id}',
+            'processed_image_url': f'/api/processed-image/{db_id}'
+        }
+    return {}
+
+# Các content type được nhận trực tiếp dưới dạng bytes ảnh thô
+RAW_IMAGE_MIMETYPES = ('image/jpeg', 'image/png', 'application/octet-stream')
+
+def decode_image_bytes(image_bytes):
+    """Giải mã bytes ảnh (JPEG/PNG) thành mảng BGR của OpenCV, không sao chép buffer"""
+    if not image_bytes:
+        return None
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+def read_detection_request():
+    """
+    Đọc ảnh và camera ID từ request nhận diện cảm xúc
+    
+    Hỗ trợ 3 định dạng:
+    - Body ảnh thô (image/jpeg, image/png), camera ID qua query `cameraId` hoặc header `X-Camera-Id`
+    - multipart/form-data với file `image` và trường `cameraId`
+    - JSON với ảnh base64 trong `image` và `cameraId` (tương thích ngược)
+    
+    Returns:
+        tuple: (image_array, camera_id, error)
+    """
+    if request.mimetype in RAW_IMAGE_MIMETYPES:
+        camera_id = request.args.get('cameraId') or request.headers.get('X-Camera-Id')
+        image_bytes = request.get_data(cache=False)
+    elif request.mimetype == 'multipart/form-data':
+        camera_id = request.form.get('cameraId') or request.form.get('camera_id')
+        image_file = request.files.get('image')
+        image_bytes = image_file.read() if image_file else None
+    else:
+        data = request.get_json(silent=True) or {}
+        camera_id = data.get('cameraId')
+        image_data = data.get('image')
+        if image_data is not None and not isinstance(image_data, str):
+            return None, None, 'image must be a base64 string'
+        try:
+            image_bytes = base64.b64decode(image_data.split(',')[1] if ',' in image_data else image_data) if image_data else None
+        except binascii.Error:
+            return None, None, 'Invalid base64 image data'
+    
+    if not image_bytes or camera_id is None:
+        return None, None, 'Missing image or cameraId'
+    
+    try:
+        camera_id = int(camera_id)
+    except (TypeError, ValueError):
+        return None, None, 'Invalid cameraId'
+    
+    image_array = decode_image_bytes(image_bytes)
+    if image_array is None:
+        return None, None, 'Invalid image data'
+    
+    return image_array, camera_id, None
+
 @app.route('/api/detect-emotion', methods=['POST'])
 def detect_emotion_endpoint():
     """API endpoint để nhận và xử lý hình ảnh"""
-    if 'image' not in request.json or 'cameraId' not in request.json:
-        return jsonify({'error': 'Missing image or cameraId'}), 400
+    try:
+        # Nhận dữ liệu (ảnh thô, multipart hoặc JSON base64)
+        image_array, camera_id, error = read_detection_request()
+    except ValueError as e:
+        return jsonify({'error': f'Invalid request: {e}'}), 400
     
-    # Nhận dữ liệu
-    image_data = request.json['image']  # Base64 encoded image
-    camera_id = int(request.json['cameraId'])
+    if error:
+        return jsonify({'error': error}), 400
     
-    # Kiểm tra xem camera có tồn tại trong cơ sở dữ liệu không
-    camera = Camera.query.get(camera_id)
+    # Kiểm tra xem camera có tồn tại trong cơ sở dữ liệu không (qua cache, không truy vấn mỗi frame)
+    camera = camera_cache.get(camera_id)
     if not camera and camera_id > 3:  # Cho phép 3 camera mặc định không cần đăng ký
         return jsonify({'error': f'Camera ID {camera_id} does not exist'}), 404
+    # Camera đang được xóa: bản ghi mới sẽ chặn bước xóa camera (khóa ngoại) ở tác vụ nền
+    if camera and camera.status == 'deleting':
+        return jsonify({'error': f'Camera ID {camera_id} is being deleted'}), 409
+    
+    # Chế độ trả ảnh: none | url | inline (mặc định inline để tương thích ngược)
+    images_mode = get_image_response_mode()
     
     try:
-        # Chuyển đổi Base64 thành hình ảnh
-        image_bytes = base64.b64decode(image_data.split(',')[1] if ',' in image_data else image_data)
-        image = Image.open(io.BytesIO(image_bytes))
-        image_array = np.array(image)
-        
-        # Chuyển đổi từ RGB sang BGR (OpenCV sử dụng BGR)
-        if len(image_array.shape) == 3 and image_array.shape[2] == 3:
-            image_array = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
-        
-        # Phát hiện cảm xúc
-        emotion_result, processed_image = detect_emotion(image_array)
+        # Phát hiện cảm xúc (không mã hóa base64, ảnh đã xử lý được ghi thẳng ra file)
+        emotion_result, processed_image = detect_emotion(image_array, camera_id, encode_image=False)
         
         if not emotion_result:
             return jsonify({'error': 'No face detected or error in processing'}), 400
         
         # Lưu kết quả vào thư mục
-        image_path, result_path, processed_path = save_image_result(processed_image, camera_id, emotion_result)
+        image_path, result_path, processed_path = save_image_result(image_array, camera_id, emotion_result, processed_image)
         
         # Lưu vào cơ sở dữ liệu
         db_success, db_id = save_to_database(camera_id, image_path, result_path, processed_path, emotion_result)
         
         # Trả về kết quả
-        return jsonify({
+        response = {
             'success': True,
             'emotion': emotion_result.get('emotion', {}),
             'emotion_percent': emotion_result.get('emotion_percent', {}),
             'dominant_emotion': emotion_result.get('dominant_emotion', 'unknown'),
-            'processed_image': emotion_result.get('processed_image', ''),
             'database_save': db_success,
             'db_id': db_id,
             'timestamp': datetime.datetime.now().isoformat()
-        })
+        }
+        response.update(build_image_fields(images_mode, db_id, processed_path))
+        return jsonify(response)
         
     except Exception as e:
         print(f"Error processing image: {e}")
         return jsonify({'error': str(e)}), 500
 
+# Số frame tối đa trong một request nhận diện theo lô
+DETECT_BATCH_MAX_ITEMS = int(os.getenv('DETECT_BATCH_MAX_ITEMS', '32'))
+
+def read_batch_items():
+    """
+    Đọc danh sách frame từ request nhận diện theo lô
+    
+    Hỗ trợ 2 định dạng:
+    - multipart/form-data: trường `items` là JSON [{camera_id, captured_at, image}],
+      trong đó `image` là tên trường file chứa ảnh
+    - JSON: {"items": [{camera_id, captured_at, image}]} với `image` là base64
+    
+    Ảnh thiếu hoặc không hợp lệ được trả về là None để báo lỗi riêng cho frame đó.
+    
+    Returns:
+        list: Danh sách (camera_id, captured_at, image_bytes)
+    
+    Raises:
+        ValueError: items không phải danh sách các object
+    """
+    if request.mimetype == 'multipart/form-data':
+        manifest = check_batch_manifest(json.loads(request.form.get('items', '[]')))
+        items = []
+        for item in manifest:
+            field = item.get('image')
+            image_file = request.files.get(field) if isinstance(field, str) else None
+            items.append((item.get('camera_id'), item.get('captured_at'), image_file.read() if image_file else None))
+        return items
+    
+    data = request.get_json(silent=True)
+    manifest = check_batch_manifest(data.get('items', []) if isinstance(data, dict) else [])
+    items = []
+    for item in manifest:
+        image_data = item.get('image')
+        image_bytes = None
+        if isinstance(image_data, str) and image_data:
+            try:
+                image_bytes = base64.b64decode(image_data.split(',')[1] if ',' in image_data else image_data)
+            except (binascii.Error, ValueError):
+                image_bytes = None
+        items.append((item.get('camera_id'), item.get('captured_at'), image_bytes))
+    return items
+
+def check_batch_manifest(manifest):
+    """Kiểm tra items là danh sách các object, raise ValueError nếu không"""
+    if not isinstance(manifest, list):
+        raise ValueError('items must be a list')
+    if not all(isinstance(item, dict) for item in manifest):
+        raise ValueError('each item must be an object')
+    return manifest
+
+def remove_batch_entry_files(entries):
+    """Xóa file ảnh/kết quả đã ghi cho các frame của lô khi bản ghi không được lưu"""
+    remove_files([
+        path for _, entry, processed_path, _ in entries
+        for path in (entry.image_path, entry.result_path, processed_path)
+    ])
+
+@app.route('/api/detect-emotion/batch', methods=['POST'])
+def detect_emotion_batch_endpoint():
+    """API endpoint nhận diện cảm xúc cho nhiều frame/nhiều camera trong một request"""
+    try:
+        items = read_batch_items()
+    except ValueError as e:
+        return jsonify({'error': f'Invalid request: {e}'}), 400
+    
+    if not items:
+        return jsonify({'error': 'Missing items'}), 400
+    if len(items) > DETECT_BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Too many items, maximum is {DETECT_BATCH_MAX_ITEMS}'}), 400
+    
+    # Mặc định không trả ảnh cho request theo lô
+    images_mode = get_image_response_mode(default='none')
+    
+    entries = []
+    committed = False
+    try:
+        # Kiểm tra tất cả camera bằng một truy vấn duy nhất
+        camera_ids = set()
+        for camera_id, _, _ in items:
+            try:
+                camera_ids.add(int(camera_id))
+            except (TypeError, ValueError):
+                pass
+        cameras = camera_cache.get_many(camera_ids)
+        existing_ids = {cam_id for cam_id, info in cameras.items() if info}
+        deleting_ids = {cam_id for cam_id, info in cameras.items() if info and info.status == 'deleting'}
+        
+        results = []
+        for index, (camera_id, captured_at, image_bytes) in enumerate(items):
+            item_result = {'index': index, 'camera_id': camera_id, 'success': False}
+            results.append(item_result)
+            
+            try:
+                camera_id = int(camera_id)
+            except (TypeError, ValueError):
+                item_result['error'] = 'Missing or invalid camera_id'
+                continue
+            
+            # Chỉ nhận camera có trong database: một camera không tồn tại làm hỏng (FK) cả transaction của lô
+            if camera_id not in existing_ids:
+                item_result['error'] = f'Camera ID {camera_id} does not exist'
+                continue
+            # Camera đang được xóa: bản ghi mới sẽ chặn bước xóa camera (khóa ngoại) ở tác vụ nền
+            if camera_id in deleting_ids:
+                item_result['error'] = f'Camera ID {camera_id} is being deleted'
+                continue
+            
+            timestamp = None
+            if captured_at:
+                try:
+                    if not isinstance(captured_at, str):
+                        raise ValueError('captured_at must be an ISO 8601 string')
+                    # Gửi cho PostgreSQL dạng có múi giờ (giờ Việt Nam) như get_vietnam_time của các bản ghi khác;
+                    # thời điểm không có múi giờ được coi là giờ Việt Nam
+                    timestamp = to_vietnam_naive(datetime.datetime.fromisoformat(captured_at.replace('Z', '+00:00')))
+                    timestamp = timestamp.replace(tzinfo=vietnam_tz)
+                except ValueError:
+                    item_result['error'] = 'Invalid captured_at'
+                    continue
+            
+            image_array = decode_image_bytes(image_bytes)
+            if image_array is None:
+                item_result['error'] = 'Invalid image data'
+                continue
+            
+            # Phát hiện cảm xúc và lưu file
+            emotion_result, processed_image = detect_emotion(image_array, camera_id, encode_image=False)
+            image_path, result_path, processed_path = save_image_result(image_array, camera_id, emotion_result, processed_image)
+            
+            entry = build_emotion_entry(camera_id, image_path, result_path, processed_path, emotion_result, timestamp)
+            entries.append((item_result, entry, processed_path, emotion_result))
+            
+            item_result.update({
+                'success': True,
+                'emotion': emotion_result.get('emotion', {}),
+                'emotion_percent': emotion_result.get('emotion_percent', {}),
+                'dominant_emotion': emotion_result.get('dominant_emotion', 'unknown'),
+                'captured_at': timestamp.isoformat() if timestamp else None
+            })
+        
+        # Lưu tất cả kết quả trong một transaction
+        db_success = True
+        if entries:
+            try:
+                db.session.add_all([entry for _, entry, _, _ in entries])
+                db.session.flush()
+                saved = [(entry.id, entry.camera_id, entry.timestamp) for _, entry, _, _ in entries]
+                db.session.commit()
+                committed = True
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error saving batch to database: {e}")
+                db_success = False
+                # Không để lại file ảnh/kết quả không có bản ghi nào tham chiếu
+                remove_batch_entry_files(entries)
+                for item_result, _, _, _ in entries:
+                    item_result.update(success=False, error='Database save failed')
+        
+        for position, (item_result, entry, processed_path, emotion_result) in enumerate(entries):
+            item_result['db_id'] = saved[position][0] if db_success else None
+            item_result.update(build_image_fields(images_mode, item_result['db_id'], processed_path))
+            if db_success:
+                emotion_id, camera_id, timestamp = saved[position]
+                broker.publish_emotion(camera_id, emotion_id, emotion_result, timestamp)
+        
+        return jsonify({
+            'success': True,
+            'results': results,
+            'processed': len(entries),
+            'failed': len(results) - len(entries),
+            'database_save': db_success,
+            'timestamp': datetime.datetime.now().isoformat()
+        })
+    
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error processing batch: {e}")
+        import traceback
+        traceback.print_exc()
+        # Lô thất bại giữa chừng: xóa file của các frame đã lưu (chưa có bản ghi nào được commit)
+        if not committed:
+            remove_batch_entry_files(entries)
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/cameras', methods=['GET'])
 def get_cameras():
     """Lấy danh sách tất cả camera"""
@@ -396,6 +732,42 @@ def get_cameras():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/cameras/latest-state', methods=['GET'])
+def get_cameras_latest_state():
+    """Cảm xúc gần nhất, trạng thái kết nối và thời điểm frame cuối của tất cả camera (đọc từ bộ nhớ)"""
+    try:
+        states = camera_state.snapshot()
+        return jsonify({'cameras': states, 'total': len(states)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+CAPTURE_FIELDS = ('capture_width', 'capture_height', 'capture_fps', 'capture_fourcc')
+
+def parse_capture_settings(data):
+    """
+    Đọc cấu hình thu hình (capture_width, capture_height, capture_fps, capture_fourcc) có trong request
+    
+    Giá trị rỗng/null xóa cấu hình (dùng mặc định của camera). Raises ValueError khi giá trị không hợp lệ.
+    """
+    settings = {}
+    for field in CAPTURE_FIELDS:
+        if field not in data:
+            continue
+        value = data[field]
+        if value in (None, ''):
+            settings[field] = None
+        elif field == 'capture_fourcc':
+            value = str(value)
+            if len(value) != 4:
+                raise ValueError('capture_fourcc phải gồm đúng 4 ký tự (ví dụ MJPG)')
+            settings[field] = value
+        else:
+            value = float(value) if field == 'capture_fps' else int(value)
+            if value <= 0:
+                raise ValueError(f'{field} phải lớn hơn 0')
+            settings[field] = value
+    return settings
+
 @app.route('/api/cameras', methods=['POST'])
 def create_camera():
     try:
@@ -415,12 +787,15 @@ def create_camera():
             port=int(data['port']) if data.get('port') else None,
             stream_url=data.get('stream_url'),
             user_id=1,  # Temporary: set default user_id to 1
-            connection_status='disconnected'
+            connection_status='disconnected',
+            roi_polygon=parse_roi_polygon(data.get('roi_polygon')),
+            **parse_capture_settings(data)
         )
 
         # Add to database
         db.session.add(camera)
         db.session.commit()
+        camera_cache.invalidate(camera.id)
 
         return jsonify({
             'success': True,
@@ -481,8 +856,14 @@ def update_camera(camera_id):
             camera.port = int(data['port']) if data['port'] else None
         if 'stream_url' in data:
             camera.stream_url = data['stream_url']
+        # Cấu hình thu hình có hiệu lực khi camera handler được khởi động lại
+        for field, value in parse_capture_settings(data).items():
+            setattr(camera, field, value)
+        if 'roi_polygon' in data:
+            camera.roi_polygon = parse_roi_polygon(data['roi_polygon'])
 
         db.session.commit()
+        camera_cache.invalidate(camera_id)
 
         return jsonify({
             'success': True,
@@ -506,59 +887,26 @@ def update_camera(camera_id):
 
 @app.route('/api/cameras/<int:camera_id>', methods=['DELETE'])
 def delete_camera(camera_id):
-    """Xóa một camera khỏi database"""
+    """Xóa một camera: đánh dấu đang xóa, dữ liệu và thư mục ảnh được xóa ở tác vụ nền"""
+    camera = Camera.query.get_or_404(camera_id)
     try:
-        # Tìm camera trong database
-        camera = Camera.query.get_or_404(camera_id)
+        # Dừng camera và lịch chụp để không có bản ghi mới trong lúc xóa
+        stop_camera(camera_id)
+        if str(camera_id) in rtsp_camera_jobs:
+            scheduler.remove_job(rtsp_camera_jobs.pop(str(camera_id)))
         
-        # Xóa các bản ghi liên quan
-        # 1. Xóa lịch trình
-        CameraSchedule.query.filter_by(camera_id=camera_id).delete()
-        
-        # 2. Xóa kết quả emotion
-        emotions = Emotion.query.filter_by(camera_id=camera_id).all()
-        for emotion in emotions:
-            # Xóa các file hình ảnh liên quan
-            if emotion.image_path and os.path.exists(emotion.image_path):
-                os.remove(emotion.image_path)
-            if emotion.result_path and os.path.exists(emotion.result_path):
-                os.remove(emotion.result_path)
-            # Xóa bản ghi
-            db.session.delete(emotion)
-        
-        # 3. Xóa kết quả detection
-        detections = DetectionResult.query.filter_by(camera_id=camera_id).all()
-        for detection in detections:
-            # Xóa file hình ảnh nếu có
-            if detection.image_path and os.path.exists(detection.image_path):
-                os.remove(detection.image_path)
-            # Xóa bản ghi
-            db.session.delete(detection)
-        
-        # 4. Xóa liên kết với camera group
-        CameraGroupAssociation.query.filter_by(camera_id=camera_id).delete()
-        
-        # 5. Xóa camera
-        db.session.delete(camera)
-        
-        # Commit các thay đổi vào database
+        camera.status = 'deleting'
         db.session.commit()
+        camera_cache.invalidate(camera_id)
         
-        # Xóa thư mục hình ảnh của camera
-        camera_image_dir = os.path.join(app.config['UPLOAD_FOLDER'], f'camera{camera_id}')
-        if os.path.exists(camera_image_dir):
-            try:
-                import shutil
-                shutil.rmtree(camera_image_dir)
-                print(f"Deleted camera image directory: {camera_image_dir}")
-            except Exception as e:
-                print(f"Warning: Could not delete camera image directory: {e}")
-        
+        job = job_manager.submit('delete_camera', delete_camera_job, camera_id, description=f'Xóa camera {camera.name}')
         return jsonify({
             'success': True,
-            'message': f'Camera {camera.name} đã được xóa thành công',
-            'camera_id': camera_id
-        })
+            'message': f'Camera {camera.name} đang được xóa',
+            'camera_id': camera_id,
+            'job_id': job.id,
+            'status_url': f'/api/jobs/{job.id}'
+        }), 202
         
     except Exception as e:
         db.session.rollback()
@@ -568,6 +916,104 @@ def delete_camera(camera_id):
             'message': f'Không thể xóa camera: {str(e)}'
         }), 500
 
+def camera_data_dirs(camera_id):
+    """Các thư mục chứa ảnh/kết quả của camera (từ save_image_result, camera handler và start_face_detection)"""
+    return [
+        get_camera_image_dir(camera_id),
+        os.path.join(app.config['UPLOAD_FOLDER'], f'camera_{camera_id}'),
+        os.path.join('static', 'images', str(camera_id)),
+        os.path.join('static', 'results', str(camera_id)),
+    ]
+
+def delete_in_batches(model, criteria, job, returning=None, on_batch=None):
+    """
+    Xóa các dòng thỏa điều kiện theo lô (DELETE ... WHERE id IN (SELECT id ... LIMIT n)), commit sau mỗi lô
+    để không giữ transaction và khóa lâu
+    
+    Args:
+        returning: Các cột trả về của dòng bị xóa, được truyền cho on_batch(rows) sau mỗi lô
+    
+    Returns:
+        int: Tổng số dòng đã xóa
+    """
+    total = 0
+    while True:
+        ids = db.session.query(model.id).filter(*criteria).limit(DELETE_BATCH_SIZE).scalar_subquery()
+        stmt = sqlalchemy.delete(model).where(model.id.in_(ids))
+        if returning:
+            rows = db.session.execute(stmt.returning(*returning), execution_options={'synchronize_session': False}).all()
+            count = len(rows)
+        else:
+            count = db.session.execute(stmt, execution_options={'synchronize_session': False}).rowcount
+        db.session.commit()
+        
+        if returning and on_batch:
+            on_batch(rows)
+        total += count
+        job.increment('rows_deleted', count)
+        if count < DELETE_BATCH_SIZE:
+            return total
+
+def delete_camera_job(job, camera_id):
+    """Tác vụ nền xóa dữ liệu, bản ghi và thư mục ảnh của camera"""
+    job.update(stage='rows', rows_deleted=0, files_deleted=0, bytes_reclaimed=0)
+    
+    def remove_batch_files(rows):
+        # File của từng bản ghi có thể nằm ngoài thư mục của camera (đường dẫn cũ, UPLOAD_FOLDER đã đổi)
+        paths = []
+        for row in rows:
+            paths.extend(row)
+            if len(row) > 1:
+                paths.append(processed_path_for(row[1]))
+        files, reclaimed = remove_files(dict.fromkeys(paths))
+        job.increment('files_deleted', files)
+        job.increment('bytes_reclaimed', reclaimed)
+    
+    emotions_deleted = delete_in_batches(
+        Emotion, [Emotion.camera_id == camera_id], job,
+        returning=(Emotion.image_path, Emotion.result_path), on_batch=remove_batch_files
+    )
+    detections_deleted = delete_in_batches(
+        DetectionResult, [DetectionResult.camera_id == camera_id], job,
+        returning=(DetectionResult.image_path,), on_batch=remove_batch_files
+    )
+    
+    # Xóa bằng câu lệnh SQL trực tiếp, không dùng cascade của ORM (sẽ tải toàn bộ emotions của camera)
+    for model in (CameraSchedule, CameraGroupAssociation, RetentionPolicy, EmotionRollup):
+        model.query.filter_by(camera_id=camera_id).delete(synchronize_session=False)
+    Camera.query.filter_by(id=camera_id).delete(synchronize_session=False)
+    db.session.commit()
+    camera_cache.invalidate(camera_id)
+    camera_state.forget(camera_id)
+    
+    job.update(stage='files')
+    for folder in camera_data_dirs(camera_id):
+        files, reclaimed = remove_tree(folder)
+        job.increment('files_deleted', files)
+        job.increment('bytes_reclaimed', reclaimed)
+    job.update(stage='done')
+    
+    return {
+        'camera_id': camera_id,
+        'emotions_deleted': emotions_deleted,
+        'detections_deleted': detections_deleted,
+        'files_deleted': job.progress['files_deleted'],
+        'bytes_reclaimed': job.progress['bytes_reclaimed']
+    }
+
+@app.route('/api/jobs', methods=['GET'])
+def get_jobs():
+    """Danh sách tác vụ nền (lọc theo ?kind=)"""
+    return jsonify([job.to_dict() for job in job_manager.list(request.args.get('kind'))])
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Tiến độ của một tác vụ nền"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
 @app.route('/api/status', methods=['GET'])
 def status():
     """Endpoint kiểm tra trạng thái server"""
@@ -576,69 +1022,203 @@ def status():
         'timestamp': datetime.datetime.now().isoformat()
     })
 
+@app.route('/api/metrics/auth-cache', methods=['GET'])
+def get_auth_cache_stats():
+    """Thống kê hit/miss của cache người dùng đã xác thực"""
+    return jsonify(auth_cache.stats())
+
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """
+    Server-Sent Events: kết quả nhận diện được gửi ngay sau khi lưu vào database
+    
+    Lọc theo ?camera_id=1,2 và/hoặc ?group_id=3 (không có tham số = tất cả camera).
+    Mỗi sự kiện `emotion` gồm id bản ghi, camera_id, timestamp, dominant_emotion, scores và faces [x, y, w, h].
+    """
+    try:
+        camera_ids = {int(value) for value in request.args.get('camera_id', '').split(',') if value.strip()}
+        group_ids = {int(value) for value in request.args.get('group_id', '').split(',') if value.strip()}
+    except ValueError:
+        return jsonify({'error': 'camera_id and group_id must be comma-separated integers'}), 400
+    
+    if group_ids:
+        camera_ids.update(camera_id for (camera_id,) in db.session.query(CameraGroupAssociation.camera_id)
+                          .filter(CameraGroupAssociation.group_id.in_(group_ids)))
+    subscriber = broker.subscribe(camera_ids if (camera_ids or group_ids) else None)
+    
+    return Response(broker.stream(subscriber), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Không để nginx gom buffer sự kiện
+    })
+
+@app.route('/api/cameras/<int:camera_id>/stream.mjpg', methods=['GET'])
+def stream_camera_mjpeg(camera_id):
+    """
+    Luồng MJPEG (multipart/x-mixed-replace) từ camera handler của server
+    
+    Tham số: fps (mặc định MJPEG_DEFAULT_FPS), width (thu nhỏ theo chiều rộng), overlay=true (vẽ khuôn mặt
+    và cảm xúc). Mọi người xem dùng chung một kết nối tới camera và một lần mã hóa JPEG cho mỗi frame.
+    """
+    fps = request.args.get('fps', type=float)
+    width = request.args.get('width', type=int)
+    overlay = request.args.get('overlay', 'false').lower() == 'true'
+    if width is not None and width <= 0:
+        return jsonify({'error': 'width must be a positive integer'}), 400
+    
+    try:
+        handler = mjpeg_streams.open(camera_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    
+    response = Response(
+        mjpeg_streams.frames(handler, fps, width, overlay),
+        mimetype=f'multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}',
+        headers={'Cache-Control': 'no-cache, no-store', 'X-Accel-Buffering': 'no'}
+    )
+    # Luôn được gọi khi response đóng, kể cả khi client ngắt kết nối trước frame đầu tiên
+    response.call_on_close(lambda: mjpeg_streams.close(camera_id))
+    return response
+
+@app.route('/api/metrics/mjpeg', methods=['GET'])
+def get_mjpeg_stats():
+    """Số người xem mỗi camera, số frame đã gửi và số lần mã hóa JPEG"""
+    return jsonify(mjpeg_streams.stats())
+
+@app.route('/api/metrics/events', methods=['GET'])
+def get_event_stream_stats():
+    """Số client đang nghe /api/events, số sự kiện đã gửi và bị bỏ do client đọc chậm"""
+    return jsonify(broker.stats())
+
+@app.route('/api/metrics/db-pool', methods=['GET'])
+def get_db_pool_stats():
+    """Thời gian chờ lấy kết nối và trạng thái hiện tại của pool kết nối database"""
+    return jsonify(pool_metrics.stats(db.engine.pool))
+
+@app.route('/api/metrics/camera-cache', methods=['GET'])
+def get_camera_cache_stats():
+    """Thống kê hit/miss của cache thông tin camera"""
+    return jsonify(camera_cache.stats())
+
+@app.route('/api/debug-capture', methods=['GET'])
+def get_debug_capture_stats():
+    """Lấy thống kê bộ ghi ảnh debug"""
+    return jsonify(debug_capture.stats())
+
+@app.route('/api/cameras/<int:camera_id>/debug-capture', methods=['PUT'])
+def set_camera_debug_capture(camera_id):
+    """Bật/tắt lưu ảnh debug cho một camera"""
+    data = request.get_json() or {}
+    if 'enabled' not in data:
+        return jsonify({'error': 'Missing enabled parameter'}), 400
+    
+    try:
+        debug_capture.set_camera_enabled(camera_id, data['enabled'])
+    except ValueError:
+        return jsonify({'error': 'enabled must be a boolean'}), 400
+    return jsonify({
+        'success': True,
+        'camera_id': camera_id,
+        'enabled': debug_capture.is_camera_enabled(camera_id)
+    })
+
+def encode_cursor(timestamp, emotion_id):
+    """Mã hóa vị trí (timestamp, id) thành cursor dạng chuỗi"""
+    raw = json.dumps([timestamp.isoformat(), emotion_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    """Giải mã cursor thành (timestamp, id), ném ValueError nếu cursor không hợp lệ"""
+    try:
+        timestamp, emotion_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.datetime.fromisoformat(timestamp), int(emotion_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def estimate_count(query, has_filters):
+    """
+    Ước lượng số bản ghi mà không chạy COUNT(*)
+    
+    Không có bộ lọc: lấy từ thống kê pg_class (bảng phân vùng: cộng thống kê của các phân vùng con, vì
+    reltuples của bảng cha luôn là 0 trên PostgreSQL < 14). Có bộ lọc hoặc chưa có thống kê (-1): lấy số
+    dòng ước lượng từ EXPLAIN.
+    """
+    if not has_filters:
+        estimate = db.session.execute(sqlalchemy.text(
+            "SELECT CASE WHEN c.relkind = 'p' THEN ("
+            "    SELECT CASE WHEN bool_or(child.reltuples < 0) THEN -1 ELSE sum(child.reltuples) END "
+            "    FROM pg_inherits i JOIN pg_class child ON child.oid = i.inhrelid WHERE i.inhparent = c.oid"
+            ") ELSE c.reltuples END::bigint "
+            "FROM pg_class c WHERE c.oid = to_regclass('emotions')"
+        )).scalar()
+        if estimate is not None and estimate >= 0:
+            return int(estimate)
+    
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    plan = db.session.connection().exec_driver_sql(f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
 @app.route('/api/emotions', methods=['GET'])
 def get_emotions():
     """Lấy danh sách cảm xúc đã ghi nhận"""
     try:
         # Lấy tham số truy vấn
-        camera_id = request.args.get('camera_id', default=None, type=int)
         limit = request.args.get('limit', default=10, type=int)
         offset = request.args.get('offset', default=0, type=int)
+        cursor = request.args.get('cursor', default=None)
+        count_mode = request.args.get('count', default='none')  # none | exact | estimate
         include_images = request.args.get('include_images', default=False, type=lambda v: v.lower() == 'true')
         
-        # Tham số bộ lọc mới
-        start_date = request.args.get('start_date', default=None)
-        end_date = request.args.get('end_date', default=None)
-        emotion_filter = request.args.get('emotion', default=None)
+        # Bộ lọc: camera_id, start_date, end_date, emotion, min_<cảm xúc>
+        try:
+            filters = parse_emotion_filters(request.args)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid filter: {e}'}), 400
         
-        print(f"Getting emotions with params: camera_id={camera_id}, limit={limit}, offset={offset}, include_images={include_images}")
-        print(f"Filter params: start_date={start_date}, end_date={end_date}, emotion={emotion_filter}")
+        print(f"Getting emotions with params: limit={limit}, offset={offset}, include_images={include_images}")
+        print(f"Filter params: {filters}")
         
-        # Xây dựng truy vấn
+        # Xây dựng truy vấn (cột ảnh base64 chỉ được tải khi include_images=true)
         query = Emotion.query
-        
-        # Lọc theo camera_id nếu được cung cấp
-        if camera_id is not None:
-            query = query.filter_by(camera_id=camera_id)
-        
-        # Lọc theo khoảng thời gian
-        if start_date:
+        if include_images:
+            query = query.options(db.undefer_group('images'))
+        query = apply_emotion_filters(query, filters)
+        
+        # Chỉ đếm tổng số bản ghi khi được yêu cầu
+        total = None
+        if count_mode == 'exact':
+            total = query.count()
+        elif count_mode == 'estimate':
+            total = estimate_count(query, has_emotion_filters(filters))
+        
+        # Phân trang theo cursor (timestamp, id): lấy các bản ghi cũ hơn vị trí cursor
+        if cursor:
             try:
-                start_date_obj = datetime.datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-                query = query.filter(Emotion.timestamp >= start_date_obj)
-                print(f"Filtering by start date: {start_date_obj}")
+                cursor_timestamp, cursor_id = decode_cursor(cursor)
             except ValueError as e:
-                print(f"Error parsing start_date: {e}")
-        
-        if end_date:
-            try:
-                end_date_obj = datetime.datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-                query = query.filter(Emotion.timestamp <= end_date_obj)
-                print(f"Filtering by end date: {end_date_obj}")
-            except ValueError as e:
-                print(f"Error parsing end_date: {e}")
-        
-        # Lọc theo loại cảm xúc chiếm ưu thế
-        if emotion_filter:
-            query = query.filter(Emotion.dominant_emotion == emotion_filter)
-            print(f"Filtering by emotion: {emotion_filter}")
-        
-        # Đếm tổng số bản ghi
-        total = query.count()
-        print(f"Total records: {total}")
-        
-        # Sắp xếp theo thời gian và áp dụng limit/offset
-        results = query.order_by(Emotion.timestamp.desc()).offset(offset).limit(limit).all()
+                return jsonify({'error': str(e)}), 400
+            query = query.filter(sqlalchemy.tuple_(Emotion.timestamp, Emotion.id) < sqlalchemy.tuple_(cursor_timestamp, cursor_id))
+        elif offset:
+            # Giữ tương thích ngược với phân trang offset
+            query = query.offset(offset)
+        
+        # Sắp xếp theo thời gian, lấy thêm 1 bản ghi để biết còn trang sau hay không
+        results = query.order_by(Emotion.timestamp.desc(), Emotion.id.desc()).limit(limit + 1).all()
+        has_more = len(results) > limit
+        results = results[:limit]
+        next_cursor = encode_cursor(results[-1].timestamp, results[-1].id) if has_more and results else None
         print(f"Retrieved {len(results)} records")
         
         # Chuyển đổi thành JSON
         emotion_list = []
         for emotion in results:
-            # Tạo emotion_result từ emotion_scores
+            # Tạo emotion_result từ các cột điểm số
+            scores = emotion.scores
             emotion_result = {
                 'dominant_emotion': emotion.dominant_emotion,
-                'emotion': emotion.emotion_scores,
-                'emotion_percent': {k: int(v * 100) for k, v in emotion.emotion_scores.items()} if emotion.emotion_scores else {}
+                'emotion': scores,
+                'emotion_percent': {k: int(v * 100) for k, v in scores.items()}
             }
             
             emotion_dict = {
@@ -700,6 +1280,9 @@ def get_emotions():
         return jsonify({
             'emotions': emotion_list,
             'total': total,
+            'total_is_estimate': count_mode == 'estimate',
+            'next_cursor': next_cursor,
+            'has_more': has_more,
             'offset': offset,
             'limit': limit
         })
@@ -710,29 +1293,166 @@ def get_emotions():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+# Thời gian cache ảnh phía client (giây), ảnh của một bản ghi không bao giờ thay đổi
+IMAGE_CACHE_MAX_AGE = int(os.getenv('IMAGE_CACHE_MAX_AGE', str(365 * 24 * 3600)))
+
+def image_etag(emotion_id, variant):
+    """ETag mạnh cho ảnh của bản ghi cảm xúc (ảnh gắn với ID nên không đổi)"""
+    return f'emotion-{emotion_id}-{variant}'
+
+def cache_image_response(response, etag):
+    """Gắn ETag và Cache-Control immutable cho response ảnh"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={IMAGE_CACHE_MAX_AGE}, immutable'
+    return response
+
+def send_image_file(path, etag):
+    """Trả file ảnh qua send_file (sendfile/X-Sendfile nếu server hỗ trợ) kèm ETag"""
+    response = send_file(path, mimetype='image/jpeg', etag=etag, conditional=True, max_age=IMAGE_CACHE_MAX_AGE)
+    return cache_image_response(response, etag)
+
+def abs_path(path):
+    """Chuyển thành đường dẫn tuyệt đối nếu cần"""
+    return os.path.abspath(path) if not os.path.isabs(path) else path
+
+@app.route('/api/emotions/export', methods=['GET'])
+def export_emotions():
+    """
+    Xuất lịch sử cảm xúc ra CSV hoặc Parquet (format=csv|parquet), trả về dạng chunked
+    
+    Hỗ trợ cùng bộ lọc với /api/emotions. Dữ liệu được đọc qua server-side cursor theo từng
+    khối `chunk_size` dòng nên bộ nhớ không phụ thuộc khoảng thời gian xuất.
+    """
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ('csv', 'parquet'):
+        return jsonify({'error': 'format must be csv or parquet'}), 400
+    if export_format == 'parquet' and not parquet_available():
+        return jsonify({'error': 'Parquet export requires pyarrow (pip install pyarrow)'}), 501
+    
+    try:
+        filters = parse_emotion_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid filter: {e}'}), 400
+    chunk_size = min(max(request.args.get('chunk_size', default=5000, type=int), 100), 50000)
+    
+    filename = f"emotions_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    if export_format == 'parquet':
+        body, mimetype = iter_parquet(filters, chunk_size), 'application/vnd.apache.parquet'
+    else:
+        body, mimetype = iter_csv(filters, chunk_size), 'text/csv'
+    
+    # stream_with_context giữ request/app context (và session database) trong suốt quá trình stream
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@app.route('/api/emotions/score-stats', methods=['GET'])
+def get_emotion_score_stats():
+    """
+    Thống kê điểm số cảm xúc tính trực tiếp trong PostgreSQL
+    
+    Hỗ trợ cùng bộ lọc với /api/emotions. Trả về điểm trung bình của từng cảm xúc và,
+    nếu có tham số `histogram=<cảm xúc>`, phân bố điểm số theo `bins` khoảng (mặc định 10).
+    """
+    try:
+        filters = parse_emotion_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid filter: {e}'}), 400
+    
+    histogram_label = request.args.get('histogram')
+    bins = min(max(request.args.get('bins', default=10, type=int), 1), 100)
+    
+    try:
+        # Điểm trung bình của các cảm xúc trong một truy vấn
+        columns = [db.func.count(Emotion.id)] + [db.func.avg(Emotion.score_column(label)) for label in EMOTION_LABELS]
+        row = apply_emotion_filters(db.session.query(*columns), filters).one()
+        response = {
+            'count': row[0],
+            'average': {label: float(value) if value is not None else None for label, value in zip(EMOTION_LABELS, row[1:])}
+        }
+        
+        # Phân bố điểm số của một cảm xúc bằng width_bucket
+        if histogram_label:
+            score = Emotion.score_column(histogram_label)
+            bucket = db.func.width_bucket(score, 0.0, 1.0, bins).label('bucket')
+            buckets = apply_emotion_filters(db.session.query(bucket, db.func.count()), filters) \
+                .filter(score.isnot(None)).group_by(bucket).order_by(bucket).all()
+            counts = dict(buckets)
+            response['histogram'] = {
+                'emotion': histogram_label,
+                'bins': [
+                    {'from': i / bins, 'to': (i + 1) / bins, 'count': counts.get(i + 1, 0) + (counts.get(bins + 1, 0) if i == bins - 1 else 0)}
+                    for i in range(bins)
+                ]
+            }
+        
+        return jsonify(response)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error in get_emotion_score_stats: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """
+    Thống kê phân bố cảm xúc và chuỗi thời gian từ bảng rollup
+    
+    Tham số: camera_id (một hoặc nhiều ID, phân cách bằng dấu phẩy), granularity (minute|hour|day),
+    start_date, end_date, series=false để chỉ lấy phân bố.
+    """
+    granularity = request.args.get('granularity', 'hour')
+    if granularity not in ROLLUP_GRANULARITIES:
+        return jsonify({'error': f'granularity must be one of {list(ROLLUP_GRANULARITIES)}'}), 400
+    
+    camera_param = request.args.get('camera_id', '')
+    try:
+        camera_ids = [int(c) for c in camera_param.split(',') if c.strip()] or None
+    except ValueError:
+        return jsonify({'error': 'Invalid camera_id'}), 400
+    
+    try:
+        stats = query_stats(
+            camera_ids=camera_ids,
+            granularity=granularity,
+            start_date=parse_date(request.args.get('start_date'), 'start_date'),
+            end_date=parse_date(request.args.get('end_date'), 'end_date'),
+            include_series=request.args.get('series', 'true').lower() != 'false'
+        )
+        return jsonify(stats)
+    except Exception as e:
+        print(f"Error in get_stats: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/image/<int:emotion_id>', methods=['GET'])
 def get_image(emotion_id):
     """Lấy hình ảnh gốc theo ID cảm xúc"""
     try:
-        emotion = Emotion.query.get_or_404(emotion_id)
-        
-        # Nếu có dữ liệu base64 trong database, trả về response với mime type là image/jpeg
-        if emotion.image_base64:
+        # Client đã có ảnh: trả 304 mà không cần truy vấn database
+        etag = image_etag(emotion_id, 'original')
+        if request.if_none_match.contains(etag):
+            return cache_image_response(Response(status=304), etag)
+        
+        # Chỉ lấy đường dẫn, không tải cột base64
+        row = db.session.query(Emotion.image_path).filter(Emotion.id == emotion_id).first()
+        if not row:
+            return jsonify({'error': 'Emotion not found'}), 404
+        
+        # Ưu tiên trả trực tiếp từ file
+        if row.image_path and os.path.exists(abs_path(row.image_path)):
+            return send_image_file(abs_path(row.image_path), etag)
+        
+        # Nếu không có file, dùng dữ liệu base64 trong database
+        image_base64 = db.session.query(Emotion.image_base64).filter(Emotion.id == emotion_id).scalar()
+        if image_base64:
             print(f"Returning image from database base64 data for emotion ID: {emotion_id}")
-            # Decode base64 string to binary
-            image_data = base64.b64decode(emotion.image_base64)
-            return Response(image_data, mimetype='image/jpeg')
-        
-        # Nếu không có dữ liệu base64, thử đọc từ file
-        # Chuyển thành đường dẫn tuyệt đối nếu cần
-        abs_image_path = os.path.abspath(emotion.image_path) if not os.path.isabs(emotion.image_path) else emotion.image_path
-        print(f"Attempting to read image from: {abs_image_path}")
-        
-        if not os.path.exists(abs_image_path):
-            print(f"Image file not found: {abs_image_path}")
-            return jsonify({'error': 'Image file not found'}), 404
-            
-        return send_file(abs_image_path, mimetype='image/jpeg')
+            image_data = base64.b64decode(image_base64)
+            return cache_image_response(Response(image_data, mimetype='image/jpeg'), etag)
+        
+        print(f"Image file not found: {row.image_path}")
+        return jsonify({'error': 'Image file not found'}), 404
     
     except Exception as e:
         print(f"Error in get_image: {e}")
@@ -744,39 +1464,42 @@ def get_image(emotion_id):
 def get_processed_image(emotion_id):
     """Lấy hình ảnh đã xử lý theo ID cảm xúc"""
     try:
-        emotion = Emotion.query.get_or_404(emotion_id)
-        
-        # Nếu có dữ liệu base64 trong database, trả về response với mime type là image/jpeg
-        if emotion.processed_image_base64:
+        # Client đã có ảnh: trả 304 mà không cần truy vấn database
+        etag = image_etag(emotion_id, 'processed')
+        if request.if_none_match.contains(etag):
+            return cache_image_response(Response(status=304), etag)
+        
+        # Chỉ lấy đường dẫn, không tải cột base64
+        row = db.session.query(Emotion.result_path).filter(Emotion.id == emotion_id).first()
+        if not row:
+            return jsonify({'error': 'Emotion not found'}), 404
+        
+        # Tạo đường dẫn đến file processed image từ result_path, ưu tiên trả trực tiếp từ file
+        processed_path = row.result_path.replace('_result.json', '_processed.jpg') if row.result_path else None
+        if processed_path and os.path.exists(abs_path(processed_path)):
+            return send_image_file(abs_path(processed_path), etag)
+        
+        # Nếu không có file, dùng dữ liệu base64 trong database
+        processed_base64 = db.session.query(Emotion.processed_image_base64).filter(Emotion.id == emotion_id).scalar()
+        if processed_base64:
             print(f"Returning processed image from database base64 data for emotion ID: {emotion_id}")
-            # Decode base64 string to binary
-            image_data = base64.b64decode(emotion.processed_image_base64)
-            return Response(image_data, mimetype='image/jpeg')
+            image_data = base64.b64decode(processed_base64)
+            return cache_image_response(Response(image_data, mimetype='image/jpeg'), etag)
         
-        # Nếu không có dữ liệu base64, thử đọc từ file
-        # Tạo đường dẫn đến file processed image từ result_path
-        processed_path = emotion.result_path.replace('_result.json', '_processed.jpg') if emotion.result_path else None
         if not processed_path:
             return jsonify({'error': 'Processed image path not available'}), 404
-            
-        # Chuyển thành đường dẫn tuyệt đối nếu cần
-        abs_processed_path = os.path.abspath(processed_path) if not os.path.isabs(processed_path) else processed_path
-        print(f"Attempting to read processed image from: {abs_processed_path}")
         
-        if not os.path.exists(abs_processed_path):
-            print(f"Processed image file not found: {abs_processed_path}")
-            
-            # Thử tìm trong thư mục
-            processed_dir = os.path.dirname(abs_processed_path)
-            processed_files = [f for f in os.listdir(processed_dir) if f.endswith('_processed.jpg')]
-            if processed_files:
-                print(f"Found alternative processed file: {processed_files[0]}")
-                alt_path = os.path.join(processed_dir, processed_files[0])
-                return send_file(alt_path, mimetype='image/jpeg')
-            
-            return jsonify({'error': 'Processed image file not found'}), 404
-            
-        return send_file(abs_processed_path, mimetype='image/jpeg')
+        print(f"Processed image file not found: {processed_path}")
+        
+        # Thử tìm trong thư mục (ảnh thay thế không được cache vì không phải ảnh của bản ghi này)
+        processed_dir = os.path.dirname(abs_path(processed_path))
+        processed_files = [f for f in os.listdir(processed_dir) if f.endswith('_processed.jpg')] if os.path.isdir(processed_dir) else []
+        if processed_files:
+            print(f"Found alternative processed file: {processed_files[0]}")
+            alt_path = os.path.join(processed_dir, processed_files[0])
+            return send_file(alt_path, mimetype='image/jpeg', max_age=0)
+        
+        return jsonify({'error': 'Processed image file not found'}), 404
     
     except Exception as e:
         print(f"Error in get_processed_image: {e}")
@@ -786,52 +1509,53 @@ def get_processed_image(emotion_id):
 
 @app.route('/api/emotions/clear', methods=['DELETE'])
 def clear_emotions():
-    """Xóa dữ liệu từ bảng emotions"""
-    try:
-        camera_id = request.args.get('camera_id', type=int)
-        confirm = request.args.get('confirm', 'false').lower() == 'true'
-        
-        if not confirm:
-            return jsonify({
-                'error': 'Hành động này sẽ xóa dữ liệu. Vui lòng xác nhận bằng tham số confirm=true'
-            }), 400
-        
-        query = Emotion.query
-        
-        # Lọc theo camera_id nếu được cung cấp
-        if camera_id:
-            query = query.filter_by(camera_id=camera_id)
-            
-        # Lấy danh sách các đường dẫn tệp cần xóa
-        emotions = query.all()
-        image_paths = [emotion.image_path for emotion in emotions]
-        result_paths = [emotion.result_path for emotion in emotions]
-        
-        # Xóa dữ liệu từ bảng emotions
-        rows_deleted = query.delete()
-        db.session.commit()
-        
-        # Tùy chọn: Xóa các tệp hình ảnh và kết quả từ hệ thống tệp
-        files_deleted = 0
-        if request.args.get('delete_files', 'false').lower() == 'true':
-            for path in image_paths + result_paths:
-                try:
-                    if os.path.exists(path):
-                        os.remove(path)
-                        files_deleted += 1
-                except Exception as e:
-                    print(f"Error deleting file {path}: {e}")
-        
+    """Xóa dữ liệu từ bảng emotions ở tác vụ nền"""
+    camera_id = request.args.get('camera_id', type=int)
+    confirm = request.args.get('confirm', 'false').lower() == 'true'
+    delete_files = request.args.get('delete_files', 'false').lower() == 'true'
+    
+    if not confirm:
         return jsonify({
-            'success': True,
-            'rows_deleted': rows_deleted,
-            'files_deleted': files_deleted,
-            'message': f'Đã xóa {rows_deleted} bản ghi cảm xúc' + 
-                      (f' và {files_deleted} tệp' if files_deleted > 0 else '')
-        })
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+            'error': 'Hành động này sẽ xóa dữ liệu. Vui lòng xác nhận bằng tham số confirm=true'
+        }), 400
+    
+    description = f'Xóa dữ liệu cảm xúc của camera {camera_id}' if camera_id else 'Xóa toàn bộ dữ liệu cảm xúc'
+    job = job_manager.submit('clear_emotions', clear_emotions_job, camera_id, delete_files, description=description)
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': f'/api/jobs/{job.id}',
+        'message': f'{description} đang được thực hiện'
+    }), 202
+
+def clear_emotions_job(job, camera_id, delete_files):
+    """Tác vụ nền xóa bản ghi cảm xúc (và file nếu được yêu cầu)"""
+    job.update(rows_deleted=0, files_deleted=0, bytes_reclaimed=0)
+    
+    def remove_batch_files(rows):
+        paths = []
+        for image_path, result_path in rows:
+            paths.extend([image_path, result_path, processed_path_for(result_path)])
+        files, reclaimed = remove_files(dict.fromkeys(paths))
+        job.increment('files_deleted', files)
+        job.increment('bytes_reclaimed', reclaimed)
+    
+    # Bảng phân vùng: xóa toàn bộ bằng TRUNCATE thay vì DELETE từng dòng. Khi cần xóa file thì vẫn xóa theo lô
+    # để biết chính xác file của các bản ghi emotions (thư mục của camera còn chứa file của detection_results)
+    if not camera_id and not delete_files and is_partitioned(db.session.connection(), Emotion.__tablename__):
+        db.session.execute(sqlalchemy.text(f'TRUNCATE {Emotion.__tablename__}'))
+        db.session.commit()
+        job.update(truncated=True)
+    else:
+        criteria = [Emotion.camera_id == camera_id] if camera_id else []
+        delete_in_batches(
+            Emotion, criteria, job,
+            returning=(Emotion.image_path, Emotion.result_path) if delete_files else None,
+            on_batch=remove_batch_files
+        )
+    camera_state.forget(camera_id or None, emotions_only=True)
+    
+    return dict(job.progress)
 
 @app.route('/api/process-image', methods=['POST'])
 def process_image():
@@ -845,12 +1569,14 @@ def process_image():
         # Lấy thông tin camera
         camera_id = request.form.get('camera_id', default=1, type=int)
         print(f"Processing image for camera ID: {camera_id}")
+        camera = camera_cache.get(camera_id)
+        if camera and camera.status == 'deleting':
+            return jsonify({'error': f'Camera ID {camera_id} is being deleted'}), 409
         
         # Đọc file hình ảnh
         image_file = request.files['image']
         image_data = image_file.read()
-        nparr = np.frombuffer(image_data, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        image = decode_image_bytes(image_data)
         
         if image is None:
             print("Failed to decode image")
@@ -858,13 +1584,17 @@ def process_image():
             
         print(f"Successfully decoded image, shape: {image.shape}")
         
+        # Chế độ trả ảnh: none | url | inline (mặc định inline để tương thích ngược)
+        images_mode = get_image_response_mode()
+        
         # Phát hiện cảm xúc
-        result, processed_image = detect_emotion(image)
+        result, processed_image = detect_emotion(image, camera_id, encode_image=False)
         
         # Lưu kết quả vào thư mục
-        image_path, result_path, processed_path = save_image_result(image, camera_id, result)
+        image_path, result_path, processed_path = save_image_result(image, camera_id, result, processed_image)
         
         # Thêm vào database
+        db_id = None
         try:
             db_success, db_id = save_to_database(camera_id, image_path, result_path, processed_path, result)
             print(f"Saved emotion record with ID: {db_id}")
@@ -877,10 +1607,10 @@ def process_image():
             import traceback
             traceback.print_exc()
         
-        # Thêm hình ảnh đã xử lý vào kết quả dưới dạng base64
-        result['original_image'] = base64.b64encode(image_data).decode('utf-8')
-        
-        # Hình ảnh đã xử lý đã được thêm vào kết quả trong hàm detect_emotion
+        # Thêm hình ảnh vào kết quả theo chế độ trả ảnh
+        result.update(build_image_fields(images_mode, db_id, processed_path))
+        if images_mode == 'inline':
+            result['original_image'] = base64.b64encode(image_data).decode('utf-8')
         
         return jsonify(result)
         
@@ -918,8 +1648,18 @@ emotion_labels_vi = {
     'neutral': 'Binh thuong'
 }
 
-def detect_emotion(image_array):
-    """Phát hiện cảm xúc từ mảng hình ảnh sử dụng OpenCV và DeepFace"""
+# Cascade classifier phát hiện khuôn mặt, chỉ nạp một lần thay vì mỗi lần gọi detect_emotion
+face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+def detect_emotion(image_array, camera_id=None, encode_image=True):
+    """
+    Phát hiện cảm xúc từ mảng hình ảnh sử dụng OpenCV và DeepFace
+    
+    Args:
+        image_array: Ảnh BGR cần nhận diện
+        camera_id (int): ID của camera (dùng cho ảnh debug)
+        encode_image (bool): Có nhúng ảnh đã xử lý dạng base64 vào kết quả hay không
+    """
     try:
         # In ra kích thước và kiểu dữ liệu của hình ảnh để debug
         print(f"Input image shape: {image_array.shape}, dtype: {image_array.dtype}")
@@ -929,16 +1669,13 @@ def detect_emotion(image_array):
         h, w = image_array.shape[:2]
         print(f"Image dimensions: {w}x{h}")
         
-        # Lưu hình ảnh đầu vào để debug
-        debug_folder = "debug_images"
-        os.makedirs(debug_folder, exist_ok=True)
-        debug_timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        debug_input_path = os.path.join(debug_folder, f"{debug_timestamp}_input.jpg")
-        cv2.imwrite(debug_input_path, image_array)
+        # Chỉ nhận diện trong hình chữ nhật bao quanh vùng quan tâm (ROI) của camera nếu có cấu hình
+        camera = camera_cache.get(camera_id) if camera_id is not None else None
+        roi = region_of_interest(camera.roi_polygon if camera else None, image_array)
+        analysis_image = roi.crop(image_array) if roi else image_array
         
         # Sử dụng OpenCV để phát hiện khuôn mặt
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        gray = cv2.cvtColor(image_array, cv2.COLOR_BGR2GRAY)
+        gray = cv2.cvtColor(analysis_image, cv2.COLOR_BGR2GRAY)
         faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
         
         print(f"OpenCV detected {len(faces)} faces")
@@ -949,6 +1686,11 @@ def detect_emotion(image_array):
             faces = face_cascade.detectMultiScale(gray, scaleFactor=1.05, minNeighbors=3, minSize=(20, 20))
             print(f"OpenCV detected {len(faces)} faces with alternative parameters")
         
+        if roi:
+            # Đổi về tọa độ ảnh gốc, bỏ khuôn mặt nằm ngoài đa giác ROI
+            faces = roi.to_frame_boxes(faces)
+            print(f"{len(faces)} faces inside ROI")
+        
         # Lấy timestamp hiện tại để hiển thị
         timestamp = datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S")
         
@@ -956,11 +1698,18 @@ def detect_emotion(image_array):
             # Thử phân tích cảm xúc bằng DeepFace
             try:
                 print("Analyzing emotions with DeepFace...")
+                if roi:
+                    # Chỉ phân tích khuôn mặt lớn nhất trong ROI: bộ dò của DeepFace trên cả vùng bao có thể chọn
+                    # khuôn mặt nằm ngoài đa giác
+                    x, y, fw, fh = max(faces, key=lambda box: box[2] * box[3])
+                    deepface_image, deepface_backend = image_array[y:y + fh, x:x + fw], 'skip'
+                else:
+                    deepface_image, deepface_backend = analysis_image, 'opencv'
                 result = DeepFace.analyze(
-                    image_array, 
+                    deepface_image, 
                     actions=['emotion'], 
                     enforce_detection=False,
-                    detector_backend='opencv'
+                    detector_backend=deepface_backend
                 )
                 
                 # Kiểm tra kết quả để đảm bảo tương thích với cả phiên bản cũ và mới
@@ -1061,6 +1810,9 @@ def detect_emotion(image_array):
                 'neutral': (128, 128, 128) # Xám
             }
             
+            # Khung khuôn mặt [x, y, w, h] (gửi kèm sự kiện kết quả tới client)
+            result['faces'] = [[int(x), int(y), int(w), int(h)] for (x, y, w, h) in faces]
+            
             # Vẽ khung cho mỗi khuôn mặt phát hiện được
             for (x, y, w, h) in faces:
                 dominant = result['dominant_emotion']
@@ -1112,12 +1864,12 @@ def detect_emotion(image_array):
             draw_text(result_image, timestamp, (20, 70), font_scale=0.7, color=(255, 255, 255), thickness=1)
         
         # Lưu thông tin hình ảnh đã xử lý vào kết quả
-        _, buffer = cv2.imencode('.jpg', result_image)
-        result['processed_image'] = base64.b64encode(buffer).decode('utf-8')
+        if encode_image:
+            _, buffer = cv2.imencode('.jpg', result_image)
+            result['processed_image'] = base64.b64encode(buffer).decode('utf-8')
         
-        # Lưu ảnh kết quả để debug
-        debug_result_path = os.path.join(debug_folder, f"{debug_timestamp}_result.jpg")
-        cv2.imwrite(debug_result_path, result_image)
+        # Lưu ảnh đầu vào và ảnh kết quả để debug (theo tỷ lệ lấy mẫu)
+        debug_capture.capture({'input': image_array, 'result': result_image}, camera_id)
         
         return result, result_image
         
@@ -1145,8 +1897,12 @@ def detect_emotion(image_array):
         draw_text(result_image, timestamp, (20, 70), font_scale=0.7, color=(255, 255, 255), thickness=1)
         
         # Lưu hình ảnh đã xử lý
-        _, buffer = cv2.imencode('.jpg', result_image)
-        result['processed_image'] = base64.b64encode(buffer).decode('utf-8')
+        if encode_image:
+            _, buffer = cv2.imencode('.jpg', result_image)
+            result['processed_image'] = base64.b64encode(buffer).decode('utf-8')
+        
+        # Luôn lưu ảnh debug khi xử lý lỗi
+        debug_capture.capture({'input': image_array, 'result': result_image}, camera_id, is_error=True)
         
         return result, result_image
 
@@ -1256,18 +2012,24 @@ def get_profile(current_user):
 def update_profile(current_user):
     data = request.get_json()
     
-    if 'email' in data and data['email'] != current_user.email:
+    # current_user là thông tin chỉ đọc từ cache, cần tải bản ghi User để cập nhật
+    user = db.session.get(User, current_user.id)
+    if not user:
+        return jsonify({'message': 'Invalid token'}), 401
+    
+    if 'email' in data and data['email'] != user.email:
         if User.query.filter_by(email=data['email']).first():
             return jsonify({'message': 'Email already exists'}), 400
-        current_user.email = data['email']
+        user.email = data['email']
     
     if 'full_name' in data:
-        current_user.full_name = data['full_name']
+        user.full_name = data['full_name']
     
     if 'password' in data:
-        current_user.set_password(data['password'])
+        user.set_password(data['password'])
     
     db.session.commit()
+    auth_cache.invalidate_user(user.id)
     return jsonify({'message': 'Profile updated successfully'})
 
 @app.route('/api/auth/verify', methods=['GET'])
@@ -1286,11 +2048,17 @@ def verify_token(current_user):
         }
     })
 
+# Khoảng thời gian tối thiểu giữa hai lần ghi last_connected khi chụp ảnh liên tục
+CONNECTION_STATUS_REFRESH_SECONDS = 60
+
+# Frame của camera handler đang chạy mới hơn số giây này được dùng thay cho việc mở kết nối mới
+SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv('SNAPSHOT_MAX_AGE_SECONDS', '2'))
+
 def capture_image_from_rtsp(camera_id):
     """Lấy hình ảnh từ camera RTSP và nhận diện cảm xúc"""
     try:
-        # Lấy thông tin camera từ cơ sở dữ liệu
-        camera = Camera.query.get(camera_id)
+        # Lấy thông tin camera từ cache
+        camera = camera_cache.get(camera_id)
         if not camera:
             print(f"Không tìm thấy camera ID {camera_id}")
             return None, f"Không tìm thấy camera ID {camera_id}"
@@ -1300,6 +2068,13 @@ def capture_image_from_rtsp(camera_id):
             print(f"Camera ID {camera_id} không phải là loại hỗ trợ streaming (type: {camera.camera_type})")
             return None, f"Loại camera không hỗ trợ (type: {camera.camera_type})"
 
+        # Camera handler đang chạy: dùng frame mới nhất, không mở thêm kết nối RTSP
+        handler = get_fresh_handler(camera_id, SNAPSHOT_MAX_AGE_SECONDS)
+        if handler is not None:
+            frame, _, _ = handler.get_frame_with_seq()
+            # Sao chép vì handler vẫn tiếp tục ghi frame mới
+            return frame.copy(), None
+
         # Lấy URL stream
         stream_url = camera.stream_url
         if not stream_url:
@@ -1312,8 +2087,9 @@ def capture_image_from_rtsp(camera_id):
                 stream_url = f"rtsp://{camera.ip_address}:{camera.port}/h264_ulaw.sdp"
             
             # Cập nhật URL vào cơ sở dữ liệu
-            camera.stream_url = stream_url
+            Camera.query.filter_by(id=camera_id).update({Camera.stream_url: stream_url})
             db.session.commit()
+            camera_cache.invalidate(camera_id)
 
         print(f"Kết nối đến camera {camera.name} tại URL: {stream_url}")
         
@@ -1331,10 +2107,13 @@ def capture_image_from_rtsp(camera_id):
             print("Không thể đọc hình ảnh từ camera")
             return None, "Không thể đọc hình ảnh từ camera"
 
-        # Cập nhật trạng thái kết nối
-        camera.connection_status = 'connected'
-        camera.last_connected = datetime.datetime.now()
-        db.session.commit()
+        # Cập nhật trạng thái kết nối khi trạng thái thay đổi hoặc last_connected đã cũ, không ghi mỗi lần chụp
+        now = datetime.datetime.now()
+        if camera.connection_status != 'connected' or not camera.last_connected or \
+                (now - camera.last_connected.replace(tzinfo=None)).total_seconds() > CONNECTION_STATUS_REFRESH_SECONDS:
+            Camera.query.filter_by(id=camera_id).update({Camera.connection_status: 'connected', Camera.last_connected: now})
+            db.session.commit()
+            camera_cache.invalidate(camera_id)
 
         print(f"Đã chụp ảnh thành công từ {camera.name}")
         return frame, None
@@ -1345,6 +2124,47 @@ def capture_image_from_rtsp(camera_id):
         traceback.print_exc()
         return None, str(e)
 
+@app.route('/api/cameras/<int:camera_id>/snapshot', methods=['GET'])
+def camera_snapshot(camera_id):
+    """
+    Ảnh JPEG hiện tại của camera (không nhận diện cảm xúc)
+    
+    Khi camera handler đang chạy và có frame mới hơn SNAPSHOT_MAX_AGE_SECONDS, ảnh được lấy từ cache JPEG
+    dùng chung với luồng MJPEG (mã hóa một lần cho mỗi frame); nếu không thì chụp một lần qua kết nối mới.
+    Tham số: width (thu nhỏ theo chiều rộng).
+    """
+    width = request.args.get('width', type=int)
+    if width is not None and width <= 0:
+        return jsonify({'error': 'width must be a positive integer'}), 400
+    
+    try:
+        handler = get_fresh_handler(camera_id, SNAPSHOT_MAX_AGE_SECONDS)
+        if handler is not None:
+            seq, jpeg, frame_time = jpeg_cache.get(handler, width)
+            if jpeg is not None:
+                return Response(jpeg, mimetype='image/jpeg', headers={
+                    'Cache-Control': 'no-cache',
+                    'X-Frame-Source': 'handler',
+                    'X-Frame-Seq': str(seq),
+                    'X-Frame-Time': frame_time.isoformat()
+                })
+        
+        frame, error = capture_image_from_rtsp(camera_id)
+        if error or frame is None:
+            return jsonify({'error': error or 'Không thể chụp ảnh từ camera'}), 400
+        
+        ok, buffer = cv2.imencode('.jpg', resize_to_width(frame, normalize_width(width, frame.shape[1])), [cv2.IMWRITE_JPEG_QUALITY, jpeg_cache.quality])
+        if not ok:
+            return jsonify({'error': 'Không thể mã hóa ảnh'}), 500
+        return Response(buffer.tobytes(), mimetype='image/jpeg', headers={
+            'Cache-Control': 'no-cache',
+            'X-Frame-Source': 'capture'
+        })
+    
+    except Exception as e:
+        print(f"Lỗi khi chụp ảnh nhanh camera {camera_id}: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/cameras/rtsp-capture', methods=['POST'])
 def rtsp_capture_endpoint():
     """API endpoint để chụp ảnh từ camera RTSP và nhận diện cảm xúc"""
@@ -1353,6 +2173,9 @@ def rtsp_capture_endpoint():
     
     camera_id = request.json['camera_id']
     
+    # Chế độ trả ảnh: none | url | inline (mặc định inline để tương thích ngược)
+    images_mode = get_image_response_mode()
+    
     try:
         # Chụp ảnh từ camera RTSP
         frame, error = capture_image_from_rtsp(camera_id)
@@ -1363,37 +2186,30 @@ def rtsp_capture_endpoint():
         if frame is None:
             return jsonify({'error': 'Không thể chụp ảnh từ camera'}), 400
         
-        # Chuyển đổi frame thành định dạng có thể gửi qua API
-        success, buffer = cv2.imencode('.jpg', frame)
-        if not success:
-            return jsonify({'error': 'Không thể mã hóa hình ảnh'}), 500
-        
-        # Chuyển buffer thành base64
-        image_base64 = base64.b64encode(buffer).decode('utf-8')
-        
         # Phát hiện cảm xúc
-        emotion_result, processed_image = detect_emotion(frame)
+        emotion_result, processed_image = detect_emotion(frame, camera_id, encode_image=False)
         
         if not emotion_result:
             return jsonify({'error': 'Không tìm thấy khuôn mặt hoặc lỗi xử lý'}), 400
         
         # Lưu kết quả vào thư mục
-        image_path, result_path, processed_path = save_image_result(frame, camera_id, emotion_result)
+        image_path, result_path, processed_path = save_image_result(frame, camera_id, emotion_result, processed_image)
         
         # Lưu vào cơ sở dữ liệu
         db_success, db_id = save_to_database(camera_id, image_path, result_path, processed_path, emotion_result)
         
         # Trả về kết quả
-        return jsonify({
+        response = {
             'success': True,
             'emotion': emotion_result.get('emotion', {}),
             'emotion_percent': emotion_result.get('emotion_percent', {}),
             'dominant_emotion': emotion_result.get('dominant_emotion', 'unknown'),
-            'processed_image': emotion_result.get('processed_image', ''),
             'database_save': db_success,
             'db_id': db_id,
             'timestamp': datetime.datetime.now().isoformat()
-        })
+        }
+        response.update(build_image_fields(images_mode, db_id, processed_path))
+        return jsonify(response)
         
     except Exception as e:
         print(f"Lỗi xử lý hình ảnh RTSP: {e}")
@@ -1406,6 +2222,89 @@ scheduler = BackgroundScheduler(daemon=True)
 scheduler.start()
 rtsp_camera_jobs = {}  # Dictionary để lưu trữ các job đã lên lịch
 
+# Bảo trì phân vùng theo tháng (chỉ có tác dụng khi đã chạy: python partitioning.py enable)
+PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', '3'))
+PARTITION_RETENTION_MONTHS = int(os.getenv('PARTITION_RETENTION_MONTHS', '0'))  # 0 = giữ toàn bộ
+
+def partition_maintenance():
+    """Tạo trước phân vùng các tháng tới và xóa phân vùng hết hạn lưu trữ"""
+    with worker_session():
+        try:
+            ensure_partitions(months_ahead=PARTITION_MONTHS_AHEAD)
+            if PARTITION_RETENTION_MONTHS > 0:
+                cutoff = add_months(month_start(datetime.datetime.now()), -PARTITION_RETENTION_MONTHS)
+                report = drop_partitions_before(cutoff)
+                if report['partitions']:
+                    print(f"Đã xóa phân vùng hết hạn: {report}")
+        except Exception as e:
+            print(f"Lỗi khi bảo trì phân vùng: {e}")
+
+# Dịch vụ dọn dẹp ảnh và lịch sử cũ theo chính sách lưu trữ của từng camera
+retention_service = create_retention_service(app)
+RETENTION_INTERVAL_MINUTES = int(os.getenv('RETENTION_INTERVAL_MINUTES', '60'))
+
+scheduler.add_job(
+    retention_service.run,
+    trigger=IntervalTrigger(minutes=RETENTION_INTERVAL_MINUTES),
+    id='retention',
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True
+)
+
+scheduler.add_job(
+    partition_maintenance,
+    trigger=CronTrigger(hour=3, minute=0),
+    id='partition_maintenance',
+    replace_existing=True,
+    next_run_time=datetime.datetime.now()
+)
+
+@app.route('/api/retention/status', methods=['GET'])
+def get_retention_status():
+    """Trạng thái dịch vụ lưu trữ và báo cáo lần dọn dẹp gần nhất"""
+    status = retention_service.status()
+    status['policies'] = [policy.to_dict() for policy in RetentionPolicy.query.all()]
+    return jsonify(status)
+
+@app.route('/api/retention/run', methods=['POST'])
+def run_retention():
+    """Chạy dọn dẹp ngay ở thread nền (không chờ kết quả)"""
+    started = retention_service.run_in_background()
+    return jsonify({
+        'started': started,
+        'message': 'Đã bắt đầu dọn dẹp' if started else 'Đang có lần dọn dẹp khác chạy'
+    }), 202 if started else 409
+
+@app.route('/api/cameras/<int:camera_id>/retention', methods=['GET', 'PUT'])
+def camera_retention_policy(camera_id):
+    """Xem hoặc cập nhật chính sách lưu trữ của camera (null = dùng mặc định, 0 = giữ mãi)"""
+    Camera.query.get_or_404(camera_id)
+    try:
+        policy = db.session.get(RetentionPolicy, camera_id)
+        
+        if request.method == 'PUT':
+            data = request.get_json() or {}
+            if policy is None:
+                policy = RetentionPolicy(camera_id=camera_id)
+                db.session.add(policy)
+            for key in ('image_days', 'processed_days', 'row_days'):
+                if key in data:
+                    value = data[key]
+                    if value is not None and (not isinstance(value, int) or value < 0):
+                        return jsonify({'error': f'{key} must be a non-negative integer or null'}), 400
+                    setattr(policy, key, value)
+            db.session.commit()
+        
+        return jsonify({
+            'camera_id': camera_id,
+            'policy': policy.to_dict() if policy else None,
+            'effective': retention_service.policy_for(camera_id, policy)
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/cameras/schedule', methods=['POST'])
 def schedule_camera_capture():
     """Lên lịch chụp ảnh định kỳ từ camera RTSP"""
@@ -1432,7 +2331,8 @@ def schedule_camera_capture():
         scheduler.remove_job(rtsp_camera_jobs[str(camera_id)])
         del rtsp_camera_jobs[str(camera_id)]
     
-    # Hàm xử lý chụp ảnh và nhận diện
+    # Hàm xử lý chụp ảnh và nhận diện (chạy trong thread của scheduler, cần session riêng)
+    @with_worker_session
     def capture_and_process():
         print(f"Đang chụp ảnh theo lịch từ camera {camera_id}")
         frame, error = capture_image_from_rtsp(camera_id)
@@ -1443,14 +2343,14 @@ def schedule_camera_capture():
         
         try:
             # Phát hiện cảm xúc
-            emotion_result, processed_image = detect_emotion(frame)
+            emotion_result, processed_image = detect_emotion(frame, camera_id, encode_image=False)
             
             if not emotion_result:
                 print(f"Không tìm thấy khuôn mặt hoặc lỗi xử lý trong ảnh từ camera {camera_id}")
                 return
             
             # Lưu kết quả vào thư mục
-            image_path, result_path, processed_path = save_image_result(frame, camera_id, emotion_result)
+            image_path, result_path, processed_path = save_image_result(frame, camera_id, emotion_result, processed_image)
             
             # Lưu vào cơ sở dữ liệu
             db_success, db_id = save_to_database(camera_id, image_path, result_path, processed_path, emotion_result)
@@ -1722,8 +2622,9 @@ def init_default_data():
 def setup_database():
     """Thiết lập database và tạo dữ liệu mặc định"""
     with app.app_context():
-        # Tạo bảng
+        # Tạo bảng và chạy migration (migration offline chạy bằng `python migrations.py`)
         db.create_all()
+        run_migrations(include_offline=False, wait=False)
         
         # Khởi tạo dữ liệu mặc định
         init_default_data()
@@ -1736,8 +2637,48 @@ def setup_database():
 # Thêm biến toàn cục để lưu trạng thái nhận diện
 face_detection_threads = {}
 
+def detect_faces(frame):
+    """
+    Phát hiện khuôn mặt trong frame
+
+    Returns:
+        list: Mỗi khuôn mặt là dict {'location': {'x', 'y', 'w', 'h'}}
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+    return [
+        {'location': {'x': int(x), 'y': int(y), 'w': int(w), 'h': int(h)}}
+        for (x, y, w, h) in faces
+    ]
+
+def detect_emotions(frame, faces):
+    """
+    Nhận diện cảm xúc cho từng khuôn mặt đã phát hiện
+
+    Returns:
+        list: Mỗi phần tử là dict {'emotion', 'confidence'} theo thứ tự của faces
+    """
+    emotions = []
+    for face in faces:
+        location = face['location']
+        face_image = frame[location['y']:location['y'] + location['h'], location['x']:location['x'] + location['w']]
+        try:
+            # Ảnh đã được cắt theo khuôn mặt nên bỏ qua bước phát hiện của DeepFace
+            result = DeepFace.analyze(face_image, actions=['emotion'], enforce_detection=False, detector_backend='skip')
+            if isinstance(result, list):
+                result = result[0]
+            dominant = result['dominant_emotion']
+            emotions.append({'emotion': dominant, 'confidence': result['emotion'][dominant] / 100.0})
+        except Exception as e:
+            print(f"Lỗi khi nhận diện cảm xúc khuôn mặt: {e}")
+            emotions.append({'emotion': 'neutral', 'confidence': 0.0})
+    return emotions
+
 def start_face_detection(camera_id, stream_url, capture_interval, enable_emotion):
     """Hàm xử lý nhận diện khuôn mặt trong thread riêng"""
+    cap = None
+    # Kết quả của mỗi frame được gom lại và ghi theo lô thay vì commit từng khuôn mặt
+    writer = create_detection_writer(app)
     try:
         # Mở stream video
         cap = cv2.VideoCapture(stream_url)
@@ -1745,17 +2686,18 @@ def start_face_detection(camera_id, stream_url, capture_interval, enable_emotion
             raise Exception("Không thể mở stream video")
 
         # Tạo thư mục lưu ảnh nếu chưa tồn tại
-        save_dir = os.path.join('images', f'camera_{camera_id}')
+        save_dir = os.path.join(app.config['UPLOAD_FOLDER'], f'camera_{camera_id}')
         os.makedirs(save_dir, exist_ok=True)
 
         while face_detection_threads.get(camera_id, {}).get('running', False):
             # Chụp frame
             ret, frame = cap.read()
             if not ret:
+                writer.flush_if_due()
                 continue
 
             # Lưu ảnh với timestamp
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
             image_path = os.path.join(save_dir, f'{timestamp}.jpg')
             cv2.imwrite(image_path, frame)
 
@@ -1763,10 +2705,9 @@ def start_face_detection(camera_id, stream_url, capture_interval, enable_emotion
             faces = detect_faces(frame)
             if faces and enable_emotion:
                 emotions = detect_emotions(frame, faces)
-                
-                # Lưu kết quả vào database
-                for face, emotion in zip(faces, emotions):
-                    save_detection_result(camera_id, image_path, face, emotion)
+                writer.add_frame(camera_id, image_path, list(zip(faces, emotions)))
+            else:
+                writer.flush_if_due()
 
             # Đợi theo khoảng thời gian đã cài đặt
             time.sleep(capture_interval)
@@ -1774,6 +2715,7 @@ def start_face_detection(camera_id, stream_url, capture_interval, enable_emotion
     except Exception as e:
         print(f"Lỗi trong quá trình nhận diện: {str(e)}")
     finally:
+        writer.close()
         if cap:
             cap.release()
         face_detection_threads[camera_id] = {'running': False}
@@ -1831,23 +2773,6 @@ def stop_face_detection_endpoint(camera_id):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
-def save_detection_result(camera_id, image_path, face, emotion):
-    """Lưu kết quả nhận diện vào database"""
-    try:
-        result = DetectionResult(
-            camera_id=camera_id,
-            image_path=image_path,
-            face_location=face['location'],
-            emotion=emotion['emotion'],
-            confidence=emotion['confidence'],
-            timestamp=datetime.now()
-        )
-        db.session.add(result)
-        db.session.commit()
-    except Exception as e:
-        print(f"Lỗi khi lưu kết quả: {str(e)}")
-        db.session.rollback()
-
 @app.route('/api/cameras/<int:camera_id>/test-connection', methods=['POST'])
 def test_camera_connection(camera_id):
     try:
@@ -1879,8 +2804,9 @@ def test_camera_connection(camera_id):
 
         # Update camera status
         camera.connection_status = 'connected' if success else 'disconnected'
-        camera.last_connected = datetime.now() if success else None
+        camera.last_connected = datetime.datetime.now() if success else None
         db.session.commit()
+        camera_cache.invalidate(camera_id)
 
         return jsonify({
             'success': success,
@@ -1927,6 +2853,9 @@ def start_camera_endpoint(camera_id):
         
         camera.status = 'active'
         db.session.commit()
+        camera_cache.invalidate(camera_id)
+        # Camera được người dùng bật: luồng MJPEG không được đóng handler khi người xem cuối cùng rời đi
+        mjpeg_streams.release(camera_id)
         
         return jsonify({
             'success': True,
@@ -1950,6 +2879,7 @@ def stop_camera_endpoint(camera_id):
         camera.status = 'inactive'
         camera.connection_status = 'disconnected'
         db.session.commit()
+        camera_cache.invalidate(camera_id)
         
         return jsonify({
             'success': True,
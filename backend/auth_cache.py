@@ -0,0 +1,123 @@
+import hashlib
+import os
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import event
+
+from models import db, User
+
+# Thông tin người dùng đã xác thực, chỉ đọc (không gắn với session, không dùng để cập nhật)
+Principal = namedtuple('Principal', ['id', 'username', 'full_name', 'email', 'role', 'is_active', 'last_login'])
+
+
+def token_id(token, payload=None):
+    """ID của token: jti nếu có (flask_jwt_extended), ngược lại là hash SHA-256 của token (pyjwt)"""
+    if payload and payload.get('jti'):
+        return payload['jti']
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()[:32]
+
+
+class AuthCache:
+    """
+    Cache ngắn hạn người dùng đã xác thực theo (user_id, token_id)
+
+    Chữ ký và hạn của token vẫn được kiểm tra mỗi request, cache chỉ thay cho truy vấn bảng users.
+    Bản ghi User bị cập nhật (qua ORM) sẽ bị xóa khỏi cache ngay; TTL giới hạn dữ liệu cũ giữa các tiến trình.
+    """
+
+    def __init__(self, ttl=30.0, max_entries=10000):
+        """
+        Args:
+            ttl (float): Thời gian sống của mỗi mục (giây), 0 = không cache
+            max_entries (int): Số mục tối đa, vượt quá sẽ dọn các mục hết hạn hoặc xóa toàn bộ
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_principal(self, user_id, token_key):
+        """
+        Lấy người dùng đang hoạt động của token
+
+        Returns:
+            Principal: Người dùng, None nếu không tồn tại hoặc đã bị vô hiệu hóa
+        """
+        key = (user_id, token_key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > now:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+
+        principal = self._load(user_id)
+        if principal is None or not principal.is_active:
+            return None
+
+        if self.ttl > 0:
+            with self._lock:
+                if generation == self._generation:
+                    if len(self._entries) >= self.max_entries:
+                        self._prune(now)
+                    self._entries[key] = (principal, now + self.ttl)
+        return principal
+
+    def _load(self, user_id):
+        """Tải các cột cần thiết của người dùng từ database"""
+        row = db.session.query(*[getattr(User, field) for field in Principal._fields]) \
+            .filter(User.id == user_id).first()
+        return Principal(*row) if row else None
+
+    def _prune(self, now):
+        expired = [key for key, (_, expires) in self._entries.items() if expires <= now]
+        for key in expired:
+            del self._entries[key]
+        if len(self._entries) >= self.max_entries:
+            self._entries.clear()
+
+    def invalidate_user(self, user_id):
+        """Xóa mọi token của người dùng khỏi cache (khi cập nhật hồ sơ, đổi mật khẩu, vô hiệu hóa)"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == user_id]:
+                del self._entries[key]
+            self._generation += 1
+            self.invalidations += 1
+
+    def clear(self):
+        """Xóa toàn bộ cache"""
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        """Thống kê hit/miss của cache"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'ttl': self.ttl,
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else None,
+                'invalidations': self.invalidations
+            }
+
+
+# Cache dùng chung cho token_required (pyjwt) và flask_jwt_extended (TTL được cấu hình lại trong app.py)
+auth_cache = AuthCache(ttl=float(os.getenv('AUTH_CACHE_TTL', '30')))
+
+
+@event.listens_for(User, 'after_update')
+def _invalidate_updated_user(mapper, connection, target):
+    # Mọi cập nhật User qua ORM (hồ sơ, mật khẩu, is_active, role) đều làm mới cache của người dùng đó
+    auth_cache.invalidate_user(target.id)
@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+from models import Camera
+from db_session import worker_session
+
+_CameraInfoBase = namedtuple('CameraInfo', [
+    'id', 'name', 'camera_type', 'status', 'ip_address', 'port', 'stream_url', 'user_id',
+    'connection_status', 'last_connected', 'capture_width', 'capture_height', 'capture_fps', 'capture_fourcc',
+    'roi_polygon'
+])
+
+
+class CameraInfo(_CameraInfoBase):
+    """Thông tin camera chỉ đọc, an toàn khi dùng chung giữa các thread (không gắn với session)"""
+    __slots__ = ()
+
+    def get_stream_url(self):
+        """Tạo URL stream dựa trên loại camera (giống Camera.get_stream_url)"""
+        if self.camera_type == 'webcam':
+            return 'webcam'
+        elif self.camera_type == 'droidcam' and self.ip_address and self.port:
+            return f'http://{self.ip_address}:{self.port}/video'
+        elif self.camera_type == 'ipcam' and self.stream_url:
+            return self.stream_url
+        return None
+
+
+class CameraCache:
+    """
+    Cache thông tin camera theo ID trong bộ nhớ tiến trình
+
+    Các endpoint thay đổi camera gọi invalidate() ngay sau khi commit; TTL là giới hạn dữ liệu cũ
+    khi chạy nhiều tiến trình (mỗi tiến trình có cache riêng).
+    """
+
+    def __init__(self, ttl=30.0):
+        """
+        Args:
+            ttl (float): Thời gian sống của mỗi mục (giây), 0 = không cache
+        """
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Tăng mỗi lần invalidate để không lưu kết quả đã tải trước khi camera bị thay đổi
+        self._generation = 0
+
+    def get(self, camera_id):
+        """
+        Lấy thông tin camera, truy vấn database khi chưa có trong cache hoặc đã hết hạn
+
+        Returns:
+            CameraInfo: Thông tin camera, None nếu camera không tồn tại (kết quả này cũng được cache)
+        """
+        if camera_id is None:
+            return None
+        return self.get_many([camera_id]).get(camera_id)
+
+    def get_many(self, camera_ids):
+        """
+        Lấy thông tin nhiều camera, các camera chưa có trong cache được tải bằng một truy vấn IN
+
+        Returns:
+            dict: camera_id -> CameraInfo hoặc None
+        """
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._lock:
+            generation = self._generation
+            for camera_id in set(camera_ids):
+                entry = self._entries.get(camera_id)
+                if entry and entry[1] > now:
+                    found[camera_id] = entry[0]
+                    self.hits += 1
+                else:
+                    missing.append(camera_id)
+                    self.misses += 1
+
+        if missing:
+            loaded = self._load(missing)
+            expires = now + self.ttl
+            with self._lock:
+                for camera_id in missing:
+                    info = loaded.get(camera_id)
+                    found[camera_id] = info
+                    if self.ttl > 0 and generation == self._generation:
+                        self._entries[camera_id] = (info, expires)
+
+        return found
+
+    def _load(self, camera_ids):
+        """Tải thông tin camera (chỉ các cột cần thiết) từ database, gọi được từ thread của camera handler"""
+        with worker_session(commit=False) as session:
+            rows = session.query(*[getattr(Camera, field) for field in CameraInfo._fields]) \
+                .filter(Camera.id.in_(camera_ids)).all()
+        return {row.id: CameraInfo(*row) for row in rows}
+
+    def invalidate(self, camera_id=None):
+        """Xóa thông tin camera khỏi cache (None = xóa toàn bộ)"""
+        with self._lock:
+            if camera_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(camera_id, None)
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        """Thống kê hit/miss của cache"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'ttl': self.ttl,
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else None,
+                'invalidations': self.invalidations
+            }
+
+
+# Cache dùng chung cho app và camera handler (TTL được cấu hình lại trong app.py sau khi nạp .env)
+camera_cache = CameraCache(ttl=float(os.getenv('CAMERA_CACHE_TTL', '30')))
@@ -5,7 +5,28 @@ import time
 import os
 import base64
 from datetime import datetime
-from models import db, Camera, Emotion
+from models import Camera, Emotion
+from camera_cache import camera_cache
+from camera_state import camera_state
+from db_session import worker_session
+
+# Fps mặc định khi camera chưa cấu hình capture_fps
+DEFAULT_CAPTURE_FPS = float(os.getenv('CAMERA_DEFAULT_FPS', '30'))
+
+
+def fit_frame(frame, max_width=None, max_height=None):
+    """Thu nhỏ frame (giữ tỷ lệ) để nằm trong max_width x max_height, không phóng to"""
+    height, width = frame.shape[:2]
+    scale = 1.0
+    if max_width and width > max_width:
+        scale = max_width / width
+    if max_height and height * scale > max_height:
+        scale = max_height / height
+    if scale >= 1.0:
+        return frame
+    size = (max(int(width * scale), 1), max(int(height * scale), 1))
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
 
 class CameraHandler:
     """Lớp cơ sở để xử lý camera, các loại camera cụ thể sẽ kế thừa từ lớp này"""
@@ -24,17 +45,28 @@ class CameraHandler:
         self.thread = None
         self.frame = None
         self.last_frame_time = None
+        # Số thứ tự frame, tăng mỗi khi có frame mới (dùng để mã hóa JPEG một lần cho mỗi frame)
+        self.frame_seq = 0
+        self._frame_lock = threading.Lock()
+        # Kết quả nhận diện gần nhất (khung khuôn mặt, cảm xúc) để vẽ lên luồng MJPEG
+        self.last_detection = None
         self.load_camera_from_db()
     
     def load_camera_from_db(self):
-        """Tải thông tin camera từ database"""
-        self.camera = Camera.query.get(self.camera_id)
+        """Tải thông tin camera (qua cache, chỉ đọc) từ database"""
+        self.camera = camera_cache.get(self.camera_id)
         if not self.camera:
             raise ValueError(f"Không tìm thấy camera với ID: {self.camera_id}")
         
         # Cập nhật trạng thái camera trong DB
-        self.camera.connection_status = 'connecting'
-        db.session.commit()
+        self.update_status(connection_status='connecting')
+    
+    def update_status(self, **values):
+        """Cập nhật trạng thái camera trong DB và làm mới cache thông tin camera (gọi được từ thread của handler)"""
+        # Session riêng: trạng thái được lưu ngay cả khi handler được mở trong một request không commit
+        with worker_session(separate=True) as session:
+            session.query(Camera).filter_by(id=self.camera_id).update(values)
+        camera_cache.invalidate(self.camera_id)
     
     def start(self):
         """Bắt đầu luồng xử lý camera"""
@@ -47,9 +79,7 @@ class CameraHandler:
         self.thread.start()
         
         # Cập nhật trạng thái camera trong DB
-        self.camera.connection_status = 'connected'
-        self.camera.last_connected = datetime.now()
-        db.session.commit()
+        self.update_status(connection_status='connected', last_connected=datetime.now())
         
         return True
     
@@ -68,17 +98,94 @@ class CameraHandler:
         self.stream = None
         
         # Cập nhật trạng thái camera trong DB
-        self.camera.connection_status = 'disconnected'
-        db.session.commit()
+        self.update_status(connection_status='disconnected')
     
     def get_frame(self):
         """Lấy frame hiện tại từ camera"""
         return self.frame
     
+    def get_frame_with_seq(self):
+        """Lấy frame hiện tại cùng số thứ tự và thời điểm nhận frame"""
+        with self._frame_lock:
+            return self.frame, self.frame_seq, self.last_frame_time
+    
+    def _set_frame(self, frame):
+        """Lưu frame mới đọc được từ camera"""
+        with self._frame_lock:
+            self.frame = frame
+            self.last_frame_time = datetime.now()
+            self.frame_seq += 1
+        camera_state.record_frame(self.camera_id, self.last_frame_time)
+    
     def _update_frame(self):
         """Cập nhật frame liên tục (được override trong các lớp con)"""
         raise NotImplementedError("Phương thức này cần được triển khai trong lớp con")
     
+    def _open_capture(self, source):
+        """
+        Mở VideoCapture và yêu cầu độ phân giải, fps, codec theo cấu hình camera
+        
+        Không phải backend/driver nào cũng hỗ trợ các thuộc tính này (nhất là luồng mạng); phần không
+        được áp dụng sẽ được bù bằng cách thu nhỏ frame ngay sau khi giải mã và bỏ bớt frame theo nhịp.
+        """
+        stream = cv2.VideoCapture(source)
+        if not stream.isOpened():
+            return stream
+        
+        camera = self.camera
+        # FOURCC phải được đặt trước kích thước (V4L2 chọn độ phân giải theo định dạng)
+        if camera.capture_fourcc:
+            stream.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*camera.capture_fourcc))
+        if camera.capture_width:
+            stream.set(cv2.CAP_PROP_FRAME_WIDTH, camera.capture_width)
+        if camera.capture_height:
+            stream.set(cv2.CAP_PROP_FRAME_HEIGHT, camera.capture_height)
+        if camera.capture_fps:
+            stream.set(cv2.CAP_PROP_FPS, camera.capture_fps)
+        return stream
+    
+    def _capture_loop(self, source, reconnect=True):
+        """
+        Đọc frame liên tục, giữ nhịp theo thời hạn (deadline) của capture_fps
+        
+        Frame đến sớm hơn nhịp chỉ được grab() (không giải mã) để bộ đệm của luồng không bị dồn,
+        frame đến đúng nhịp mới được retrieve(), thu nhỏ về kích thước cấu hình rồi lưu lại.
+        
+        Args:
+            source: Chỉ số thiết bị hoặc URL stream
+            reconnect (bool): Mở lại kết nối khi không đọc được frame (camera mạng)
+        """
+        self.stream = self._open_capture(source)
+        if not self.stream.isOpened():
+            self.is_running = False
+            self.update_status(connection_status='disconnected')
+            return
+        
+        interval = 1.0 / (self.camera.capture_fps or DEFAULT_CAPTURE_FPS)
+        deadline = time.monotonic()
+        while self.is_running:
+            if not self.stream.grab():
+                # Nếu không đọc được frame, thử kết nối lại
+                time.sleep(1)
+                if reconnect:
+                    self.stream.release()
+                    self.stream = self._open_capture(source)
+                deadline = time.monotonic()
+                continue
+            
+            now = time.monotonic()
+            if now < deadline:
+                continue
+            # Chậm hơn một nhịp thì bắt đầu lại nhịp thay vì đọc dồn
+            deadline = max(deadline + interval, now)
+            
+            success, frame = self.stream.retrieve()
+            if not success or frame is None:
+                continue
+            self._set_frame(fit_frame(frame, self.camera.capture_width, self.camera.capture_height))
+        
+        self.stream.release()
+    
     def save_frame(self, frame, emotion_data=None):
         """
         Lưu frame với thông tin cảm xúc
@@ -121,7 +228,7 @@ class CameraHandler:
             _, buffer_result = cv2.imencode('.jpg', processed_frame)
             processed_image_base64 = base64.b64encode(buffer_result).decode('utf-8')
             
-            # Lưu vào database
+            # Lưu vào database (thread của detector không có sẵn application context)
             emotion = Emotion(
                 camera_id=self.camera_id,
                 image_path=image_path,
@@ -133,8 +240,13 @@ class CameraHandler:
                 user_id=self.camera.user_id
             )
             
-            db.session.add(emotion)
-            db.session.commit()
+            with worker_session() as session:
+                session.add(emotion)
+                session.flush()
+                # ID bản ghi cho các callback của detector (ví dụ gửi sự kiện tới client)
+                emotion_data['emotion_id'] = emotion.id
+                emotion_data['timestamp'] = emotion.timestamp
+            self.last_detection = (datetime.now(), emotion_data)
             
             return result_path
         
@@ -153,27 +265,7 @@ class WebcamHandler(CameraHandler):
         # Nếu self.camera.stream_url là 'webcam', sử dụng camera trong thiết bị local
         device_id = 0  # Mặc định là camera đầu tiên
         
-        # Khởi tạo luồng video
-        self.stream = cv2.VideoCapture(device_id)
-        
-        if not self.stream.isOpened():
-            self.is_running = False
-            self.camera.connection_status = 'disconnected'
-            db.session.commit()
-            return
-        
-        while self.is_running:
-            success, frame = self.stream.read()
-            if not success:
-                # Nếu không đọc được frame, thử kết nối lại
-                time.sleep(1)
-                continue
-                
-            self.frame = frame
-            self.last_frame_time = datetime.now()
-            time.sleep(0.03)  # 30 FPS
-            
-        self.stream.release()
+        self._capture_loop(device_id, reconnect=False)
 
 
 class IPCameraHandler(CameraHandler):
@@ -189,32 +281,10 @@ class IPCameraHandler(CameraHandler):
         
         if not stream_url:
             self.is_running = False
-            self.camera.connection_status = 'disconnected'
-            db.session.commit()
+            self.update_status(connection_status='disconnected')
             return
         
-        # Khởi tạo luồng video
-        self.stream = cv2.VideoCapture(stream_url)
-        
-        if not self.stream.isOpened():
-            self.is_running = False
-            self.camera.connection_status = 'disconnected'
-            db.session.commit()
-            return
-        
-        while self.is_running:
-            success, frame = self.stream.read()
-            if not success:
-                # Nếu không đọc được frame, thử kết nối lại
-                time.sleep(1)
-                self.stream = cv2.VideoCapture(stream_url)
-                continue
-                
-            self.frame = frame
-            self.last_frame_time = datetime.now()
-            time.sleep(0.03)  # 30 FPS
-            
-        self.stream.release()
+        self._capture_loop(stream_url)
 
 
 class DroidCamHandler(CameraHandler):
@@ -230,32 +300,10 @@ class DroidCamHandler(CameraHandler):
         
         if not stream_url:
             self.is_running = False
-            self.camera.connection_status = 'disconnected'
-            db.session.commit()
-            return
-        
-        # Khởi tạo luồng video
-        self.stream = cv2.VideoCapture(stream_url)
-        
-        if not self.stream.isOpened():
-            self.is_running = False
-            self.camera.connection_status = 'disconnected'
-            db.session.commit()
+            self.update_status(connection_status='disconnected')
             return
         
-        while self.is_running:
-            success, frame = self.stream.read()
-            if not success:
-                # Nếu không đọc được frame, thử kết nối lại
-                time.sleep(1)
-                self.stream = cv2.VideoCapture(stream_url)
-                continue
-                
-            self.frame = frame
-            self.last_frame_time = datetime.now()
-            time.sleep(0.03)  # 30 FPS
-            
-        self.stream.release()
+        self._capture_loop(stream_url)
 
 
 def get_camera_handler(camera_id):
@@ -268,7 +316,7 @@ def get_camera_handler(camera_id):
     Returns:
         CameraHandler: Handler phù hợp cho loại camera
     """
-    camera = Camera.query.get(camera_id)
+    camera = camera_cache.get(camera_id)
     if not camera:
         raise ValueError(f"Không tìm thấy camera với ID: {camera_id}")
     
@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from models import db, Camera, Emotion
+
+_listener_registered = False
+
+
+class CameraStateStore:
+    """
+    Trạng thái mới nhất của từng camera trong bộ nhớ tiến trình
+
+    Gồm cảm xúc chiếm ưu thế gần nhất và thời điểm nhận frame cuối, được cập nhật bởi pipeline nhận
+    diện (sau khi commit bản ghi Emotion) và camera handler. Trạng thái kết nối được đọc cùng danh sách
+    camera trong một truy vấn vì các endpoint và handler đều ghi vào cột đó. Khi tiến trình vừa khởi
+    động hoặc sau mỗi resync_interval giây, cảm xúc gần nhất của mọi camera được nạp lại bằng một
+    truy vấn DISTINCT ON (camera_id) để đồng bộ với bản ghi do tiến trình khác ghi.
+    """
+
+    def __init__(self, resync_interval=60.0):
+        """
+        Args:
+            resync_interval (float): Chu kỳ nạp lại từ database (giây), 0 = chỉ nạp khi khởi động
+        """
+        self.resync_interval = resync_interval
+        self._states = {}
+        self._lock = threading.Lock()
+        self._synced_at = None
+
+    def _state(self, camera_id):
+        return self._states.setdefault(camera_id, {
+            'emotion_id': None,
+            'dominant_emotion': None,
+            'emotion_timestamp': None,
+            'last_frame_time': None
+        })
+
+    def record_emotion(self, camera_id, emotion_id, dominant_emotion, timestamp):
+        """Ghi nhận bản ghi cảm xúc mới, bỏ qua nếu cũ hơn bản ghi đang giữ"""
+        if timestamp is not None:
+            # Cột timestamp không lưu múi giờ nên chỉ bỏ tzinfo, không chuyển đổi giờ
+            timestamp = timestamp.replace(tzinfo=None)
+        with self._lock:
+            state = self._state(camera_id)
+            current = state['emotion_timestamp']
+            if current is not None and timestamp is not None and timestamp < current:
+                return
+            state.update(emotion_id=emotion_id, dominant_emotion=dominant_emotion, emotion_timestamp=timestamp)
+
+    def record_frame(self, camera_id, frame_time):
+        """Ghi nhận thời điểm camera handler nhận được frame mới"""
+        with self._lock:
+            self._state(camera_id)['last_frame_time'] = frame_time
+
+    def forget(self, camera_id=None, emotions_only=False):
+        """
+        Xóa trạng thái của camera (None = tất cả camera)
+
+        Args:
+            emotions_only (bool): Chỉ xóa thông tin cảm xúc (khi xóa lịch sử), giữ thời điểm frame cuối
+        """
+        with self._lock:
+            camera_ids = list(self._states) if camera_id is None else [camera_id]
+            for key in camera_ids:
+                if key not in self._states:
+                    continue
+                if emotions_only:
+                    self._states[key].update(emotion_id=None, dominant_emotion=None, emotion_timestamp=None)
+                else:
+                    del self._states[key]
+
+    def needs_sync(self):
+        if self._synced_at is None:
+            return True
+        return self.resync_interval > 0 and time.monotonic() - self._synced_at >= self.resync_interval
+
+    def sync_from_database(self):
+        """Nạp cảm xúc gần nhất của mọi camera bằng một truy vấn (cần application context)"""
+        if db.engine.dialect.name == 'postgresql':
+            # Dùng index ix_emotions_camera_id_timestamp_id, mỗi camera đọc đúng một dòng
+            rows = db.session.query(Emotion.camera_id, Emotion.id, Emotion.dominant_emotion, Emotion.timestamp) \
+                .distinct(Emotion.camera_id) \
+                .order_by(Emotion.camera_id, Emotion.timestamp.desc(), Emotion.id.desc()) \
+                .all()
+        else:
+            latest = db.session.query(Emotion.camera_id, func.max(Emotion.id).label('id')) \
+                .group_by(Emotion.camera_id).subquery()
+            rows = db.session.query(Emotion.camera_id, Emotion.id, Emotion.dominant_emotion, Emotion.timestamp) \
+                .join(latest, Emotion.id == latest.c.id).all()
+
+        for camera_id, emotion_id, dominant_emotion, timestamp in rows:
+            self.record_emotion(camera_id, emotion_id, dominant_emotion, timestamp)
+        self._synced_at = time.monotonic()
+        return len(rows)
+
+    def snapshot(self):
+        """
+        Trạng thái mới nhất của tất cả camera (một truy vấn danh sách camera, không truy vấn theo từng camera)
+
+        Returns:
+            list: Mỗi camera một dictionary
+        """
+        if self.needs_sync():
+            self.sync_from_database()
+
+        cameras = db.session.query(
+            Camera.id, Camera.name, Camera.status, Camera.connection_status, Camera.last_connected
+        ).order_by(Camera.id).all()
+
+        with self._lock:
+            states = {camera_id: dict(state) for camera_id, state in self._states.items()}
+
+        result = []
+        for camera in cameras:
+            state = states.get(camera.id, {})
+            emotion_timestamp = state.get('emotion_timestamp')
+            last_frame_time = state.get('last_frame_time')
+            result.append({
+                'camera_id': camera.id,
+                'name': camera.name,
+                'status': camera.status,
+                'connection_status': camera.connection_status,
+                'last_connected': camera.last_connected.isoformat() if camera.last_connected else None,
+                'last_frame_time': last_frame_time.isoformat() if last_frame_time else None,
+                'emotion_id': state.get('emotion_id'),
+                'dominant_emotion': state.get('dominant_emotion'),
+                'emotion_timestamp': emotion_timestamp.isoformat() if emotion_timestamp else None
+            })
+        return result
+
+
+# Trạng thái dùng chung cho app, camera handler và detector
+camera_state = CameraStateStore(resync_interval=float(os.getenv('CAMERA_STATE_RESYNC_SECONDS', '60')))
+
+
+def _collect_new_emotions(session, flush_context):
+    """Giữ lại các bản ghi Emotion vừa được insert, chỉ công bố sau khi transaction commit"""
+    new_emotions = [
+        (obj.camera_id, obj.id, obj.dominant_emotion, obj.timestamp)
+        for obj in session.new if isinstance(obj, Emotion)
+    ]
+    if new_emotions:
+        session.info.setdefault('camera_state_emotions', []).extend(new_emotions)
+
+
+def _publish_after_commit(session):
+    for camera_id, emotion_id, dominant_emotion, timestamp in session.info.pop('camera_state_emotions', []):
+        camera_state.record_emotion(camera_id, emotion_id, dominant_emotion, timestamp)
+
+
+def _discard_after_rollback(session):
+    session.info.pop('camera_state_emotions', None)
+
+
+def register_camera_state_listener():
+    """Đăng ký cập nhật camera_state mỗi khi bản ghi Emotion mới được commit (mọi đường ghi qua ORM)"""
+    global _listener_registered
+    if _listener_registered:
+        return
+    event.listen(Session, 'after_flush', _collect_new_emotions)
+    event.listen(Session, 'after_commit', _publish_after_commit)
+    event.listen(Session, 'after_rollback', _discard_after_rollback)
+    _listener_registered = True
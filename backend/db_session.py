@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, has_app_context
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+from models import db
+
+# Flask app dùng cho các thread nền không có sẵn application context (đăng ký bằng init_worker_sessions)
+_worker_app = None
+
+
+class PoolMetrics:
+    """Thống kê thời gian chờ lấy kết nối từ pool"""
+
+    def __init__(self, slow_wait=0.1):
+        """
+        Args:
+            slow_wait (float): Lần chờ lâu hơn ngưỡng này (giây) được tính là chờ chậm
+        """
+        self.slow_wait = slow_wait
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.total_wait = 0.0
+            self.max_wait = 0.0
+            self.slow_checkouts = 0
+            self.timeouts = 0
+
+    def record(self, wait, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if wait >= self.slow_wait:
+                self.slow_checkouts += 1
+
+    def stats(self, pool=None):
+        """Thống kê thời gian chờ, kèm trạng thái hiện tại của pool nếu có"""
+        with self._lock:
+            result = {
+                'checkouts': self.checkouts,
+                'avg_wait_ms': self.total_wait / self.checkouts * 1000 if self.checkouts else None,
+                'max_wait_ms': self.max_wait * 1000,
+                'slow_checkouts': self.slow_checkouts,
+                'slow_wait_ms': self.slow_wait * 1000,
+                'timeouts': self.timeouts
+            }
+        if isinstance(pool, QueuePool):
+            result.update({
+                'pool_size': pool.size(),
+                'checked_in': pool.checkedin(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow()
+            })
+        return result
+
+
+pool_metrics = PoolMetrics()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool ghi lại thời gian mỗi lần lấy kết nối (gồm cả thời gian chờ khi pool đã hết)"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.record(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_metrics.record(time.perf_counter() - start)
+        return connection
+
+
+def configure_engine_options(app):
+    """
+    Cấu hình pool kết nối từ biến môi trường (gọi trước db.init_app)
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (giây), DB_POOL_RECYCLE (giây, -1 = không tái tạo),
+    DB_POOL_PRE_PING (kiểm tra kết nối trước khi dùng, tránh lỗi "connection already closed").
+    """
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        return
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    options.update({
+        'poolclass': TimedQueuePool,
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '20')),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', '30')),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true',
+    })
+    pool_metrics.slow_wait = float(os.getenv('DB_POOL_SLOW_WAIT_MS', '100')) / 1000
+
+
+def init_worker_sessions(app):
+    """Đăng ký Flask app cho worker_session() ở các module không giữ tham chiếu tới app"""
+    global _worker_app
+    _worker_app = app
+
+
+@contextmanager
+def worker_session(app=None, commit=True, separate=False):
+    """
+    Session database cho thread nền (camera handler, detector, scheduler, thread nhận diện)
+
+    Tạo application context riêng cho thread, commit khi khối with kết thúc, rollback khi có lỗi
+    và trả kết nối về pool ngay sau đó. Khi đã ở trong application context (request hoặc
+    worker_session bên ngoài) thì dùng lại session hiện tại trong một SAVEPOINT (begin_nested): khối
+    with không commit transaction bên ngoài, lỗi chỉ rollback phần việc của khối đó.
+
+    Ví dụ:
+        with worker_session() as session:
+            session.query(Camera).filter_by(id=camera_id).update({'connection_status': 'connected'})
+
+    Args:
+        app: Flask app, mặc định là app đã đăng ký bằng init_worker_sessions
+        commit (bool): False cho khối chỉ đọc: không commit, không đụng tới transaction của request
+        separate (bool): Luôn tạo application context và session riêng, commit độc lập với transaction
+            bên ngoài (cho thay đổi phải được lưu dù request gọi tới có commit hay không)
+    """
+    if has_app_context() and not separate:
+        if not commit:
+            yield db.session
+            return
+        # Transaction bên ngoài (của request) do người gọi commit
+        with db.session.begin_nested():
+            yield db.session
+        return
+
+    app = app or _worker_app or (current_app._get_current_object() if has_app_context() else None)
+    if app is None:
+        raise RuntimeError("Chưa gọi init_worker_sessions(app)")
+
+    with app.app_context():
+        try:
+            yield db.session
+            if commit:
+                db.session.commit()
+            else:
+                db.session.rollback()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+
+
+def with_worker_session(func):
+    """Decorator chạy hàm (job của scheduler, callback) bên trong worker_session()"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with worker_session():
+            return func(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,224 @@
+import os
+import queue
+import random
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import cv2
+
+
+def parse_bool(value):
+    """Đọc giá trị boolean chặt chẽ (bool("false") là True nên không dùng bool()), raises ValueError"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in ('true', '1'):
+        return True
+    if isinstance(value, str) and value.strip().lower() in ('false', '0'):
+        return False
+    raise ValueError(f'Giá trị boolean không hợp lệ: {value!r}')
+
+
+class DebugCapture:
+    """Ghi ảnh debug có lấy mẫu, giới hạn dung lượng và chạy ở thread nền"""
+
+    def __init__(self, folder, sample_rate=0.0, on_error_only=False, max_bytes=0, max_files=0,
+                 enabled_cameras=None, queue_size=64):
+        """
+        Khởi tạo bộ ghi ảnh debug
+
+        Args:
+            folder (str): Thư mục lưu ảnh debug
+            sample_rate (float): Tỷ lệ frame bình thường được lưu (0.0 - 1.0)
+            on_error_only (bool): Chỉ lưu ảnh khi xử lý bị lỗi
+            max_bytes (int): Tổng dung lượng tối đa của thư mục (0 = không giới hạn)
+            max_files (int): Số file tối đa trong thư mục (0 = không giới hạn)
+            enabled_cameras (set): Danh sách camera được bật, None = tất cả camera
+            queue_size (int): Số lượt ghi tối đa đang chờ, vượt quá sẽ bị bỏ qua
+        """
+        self.folder = folder
+        self.sample_rate = sample_rate
+        self.on_error_only = on_error_only
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.enabled_cameras = enabled_cameras
+        self.camera_overrides = {}
+
+        # Chỉ mục các file đã ghi theo thứ tự cũ -> mới để xóa file cũ nhất trong O(1)
+        self._index = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+
+        self.written = 0
+        self.dropped = 0
+        self.evicted = 0
+
+        os.makedirs(self.folder, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        """Nạp các file debug có sẵn vào chỉ mục để giới hạn áp dụng cho cả file cũ"""
+        entries = []
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if os.path.isfile(path):
+                entries.append((stat.st_mtime, path, stat.st_size))
+
+        for _, path, size in sorted(entries):
+            self._index[path] = size
+            self._total_bytes += size
+
+        self._evict()
+
+    def start(self):
+        """Bắt đầu thread ghi ảnh"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='debug-capture')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def set_camera_enabled(self, camera_id, enabled):
+        """
+        Bật/tắt lưu ảnh debug cho một camera
+
+        Args:
+            enabled: True/False, hoặc chuỗi/số 'true'/'false', '1'/'0' (từ JSON hoặc query string)
+
+        Raises:
+            ValueError: Giá trị không phải boolean
+        """
+        enabled = parse_bool(enabled)
+        with self._lock:
+            self.camera_overrides[camera_id] = enabled
+
+    def is_camera_enabled(self, camera_id):
+        """Kiểm tra camera có được lưu ảnh debug không"""
+        with self._lock:
+            if camera_id in self.camera_overrides:
+                return self.camera_overrides[camera_id]
+        return self.enabled_cameras is None or camera_id in self.enabled_cameras
+
+    def should_capture(self, camera_id=None, is_error=False):
+        """Quyết định có lưu ảnh debug cho lần xử lý này hay không"""
+        if not self.is_camera_enabled(camera_id):
+            return False
+        if is_error:
+            return True
+        if self.on_error_only:
+            return False
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def capture(self, images, camera_id=None, is_error=False):
+        """
+        Đưa ảnh vào hàng đợi ghi nếu lần xử lý này được lấy mẫu
+
+        Args:
+            images (dict): Hậu tố tên file -> mảng ảnh, ví dụ {'input': frame}
+            camera_id (int): ID của camera
+            is_error (bool): Ảnh thuộc lần xử lý bị lỗi
+
+        Returns:
+            bool: True nếu ảnh được đưa vào hàng đợi
+        """
+        if not self.should_capture(camera_id, is_error):
+            return False
+
+        self.start()
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        prefix = f"{timestamp}_cam{camera_id}" if camera_id is not None else timestamp
+        if is_error:
+            prefix += "_error"
+
+        try:
+            self._queue.put_nowait((prefix, images))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        """Vòng lặp ghi ảnh ở thread nền"""
+        while True:
+            prefix, images = self._queue.get()
+            try:
+                for suffix, image in images.items():
+                    if image is None:
+                        continue
+                    success, buffer = cv2.imencode('.jpg', image)
+                    if not success:
+                        continue
+                    path = os.path.join(self.folder, f"{prefix}_{suffix}.jpg")
+                    with open(path, 'wb') as f:
+                        f.write(buffer.tobytes())
+                    self._add(path, len(buffer))
+            except Exception as e:
+                print(f"Lỗi khi ghi ảnh debug: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _add(self, path, size):
+        """Thêm file mới vào chỉ mục và xóa file cũ nếu vượt giới hạn"""
+        with self._lock:
+            self._index[path] = size
+            self._total_bytes += size
+            self.written += 1
+        self._evict()
+
+    def _evict(self):
+        """Xóa file cũ nhất cho tới khi nằm trong giới hạn dung lượng/số file"""
+        while True:
+            with self._lock:
+                over_bytes = self.max_bytes and self._total_bytes > self.max_bytes
+                over_files = self.max_files and len(self._index) > self.max_files
+                if not self._index or not (over_bytes or over_files):
+                    return
+                path, size = self._index.popitem(last=False)
+                self._total_bytes -= size
+                self.evicted += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        """Thống kê trạng thái bộ ghi ảnh debug"""
+        with self._lock:
+            return {
+                'folder': self.folder,
+                'sample_rate': self.sample_rate,
+                'on_error_only': self.on_error_only,
+                'max_bytes': self.max_bytes,
+                'max_files': self.max_files,
+                'enabled_cameras': sorted(self.enabled_cameras) if self.enabled_cameras is not None else None,
+                'camera_overrides': {str(k): v for k, v in self.camera_overrides.items()},
+                'files': len(self._index),
+                'total_bytes': self._total_bytes,
+                'written': self.written,
+                'dropped': self.dropped,
+                'evicted': self.evicted,
+                'pending': self._queue.qsize()
+            }
+
+
+def create_debug_capture(folder):
+    """Tạo bộ ghi ảnh debug từ biến môi trường"""
+    cameras = os.getenv('DEBUG_CAPTURE_CAMERAS', '').strip()
+    enabled_cameras = {int(c) for c in cameras.split(',') if c.strip()} if cameras else None
+
+    return DebugCapture(
+        folder,
+        sample_rate=float(os.getenv('DEBUG_CAPTURE_SAMPLE_RATE', '0')),
+        on_error_only=os.getenv('DEBUG_CAPTURE_ON_ERROR_ONLY', 'false').lower() == 'true',
+        max_bytes=int(os.getenv('DEBUG_CAPTURE_MAX_BYTES', str(200 * 1024 * 1024))),
+        max_files=int(os.getenv('DEBUG_CAPTURE_MAX_FILES', '1000')),
+        enabled_cameras=enabled_cameras
+    )
@@ -0,0 +1,161 @@
+import csv
+import io
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import insert
+
+from models import db, get_vietnam_time, DetectionResult
+from db_session import worker_session
+
+# Các cột được ghi, theo đúng thứ tự dùng cho COPY
+DETECTION_COLUMNS = ('camera_id', 'image_path', 'face_location', 'emotion', 'confidence', 'timestamp')
+
+
+class DetectionWriter:
+    """
+    Gom kết quả nhận diện khuôn mặt và ghi xuống database theo lô
+
+    Thay vì add + commit cho từng khuôn mặt, các dòng được giữ trong bộ đệm và ghi bằng một câu
+    INSERT nhiều dòng (hoặc COPY với PostgreSQL) khi đủ số dòng hoặc hết khoảng thời gian,
+    mỗi lần ghi là một transaction trong worker_session() riêng của thread nền.
+    """
+
+    def __init__(self, app, flush_rows=500, flush_interval=2.0, mode='insert'):
+        """
+        Args:
+            app: Flask app (để tạo application context trong thread nền)
+            flush_rows (int): Ghi ngay khi bộ đệm đạt số dòng này
+            flush_interval (float): Thời gian tối đa giữ dòng trong bộ đệm (giây), 0 = ghi sau mỗi frame
+            mode (str): 'insert' (INSERT nhiều dòng) hoặc 'copy' (COPY FROM STDIN, chỉ PostgreSQL)
+        """
+        if mode not in ('insert', 'copy'):
+            raise ValueError(f"Chế độ ghi không hợp lệ: {mode}")
+        self.app = app
+        self.flush_rows = max(1, flush_rows)
+        self.flush_interval = flush_interval
+        self.mode = mode
+        self._rows = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self.rows_written = 0
+        self.flushes = 0
+        self.errors = 0
+
+    def add_frame(self, camera_id, image_path, detections, timestamp=None):
+        """
+        Thêm kết quả của một frame vào bộ đệm, tự ghi khi tới ngưỡng
+
+        Args:
+            camera_id (int): ID camera
+            image_path (str): Ảnh của frame
+            detections (list): Danh sách (face, emotion) với face['location'], emotion['emotion'], emotion['confidence']
+            timestamp (datetime): Thời điểm chụp, mặc định là giờ Việt Nam hiện tại
+        """
+        # Cột timestamp không lưu múi giờ nên chỉ bỏ tzinfo, không chuyển đổi giờ
+        timestamp = (timestamp or get_vietnam_time()).replace(tzinfo=None)
+        rows = [{
+            'camera_id': camera_id,
+            'image_path': image_path,
+            'face_location': face['location'],
+            'emotion': emotion['emotion'],
+            'confidence': float(emotion['confidence']),
+            'timestamp': timestamp
+        } for face, emotion in detections]
+
+        with self._lock:
+            self._rows.extend(rows)
+        return self.flush_if_due()
+
+    def flush_if_due(self):
+        """Ghi bộ đệm nếu đủ số dòng hoặc đã quá flush_interval kể từ lần ghi trước"""
+        with self._lock:
+            pending = len(self._rows)
+            due = pending >= self.flush_rows or \
+                (pending and time.monotonic() - self._last_flush >= self.flush_interval)
+        return self.flush() if due else 0
+
+    def flush(self):
+        """
+        Ghi toàn bộ bộ đệm trong một transaction
+
+        Returns:
+            int: Số dòng đã ghi (0 nếu bộ đệm trống hoặc ghi lỗi, các dòng lỗi bị bỏ)
+        """
+        with self._lock:
+            rows, self._rows = self._rows, []
+            self._last_flush = time.monotonic()
+        if not rows:
+            return 0
+
+        try:
+            with worker_session(self.app) as session:
+                if self.mode == 'copy' and db.engine.dialect.name == 'postgresql':
+                    self._copy(rows)
+                else:
+                    session.execute(insert(DetectionResult), rows)
+        except Exception as e:
+            self.errors += 1
+            print(f"Lỗi khi lưu {len(rows)} kết quả nhận diện: {e}")
+            return 0
+
+        self.rows_written += len(rows)
+        self.flushes += 1
+        return len(rows)
+
+    def _copy(self, rows):
+        """COPY FROM STDIN dạng CSV, nhanh nhất khi mỗi lần ghi có hàng nghìn dòng"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([
+                row['camera_id'],
+                row['image_path'],
+                json.dumps(row['face_location']),
+                row['emotion'],
+                row['confidence'],
+                row['timestamp'].isoformat()
+            ])
+        buffer.seek(0)
+
+        connection = db.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY {DetectionResult.__tablename__} ({', '.join(DETECTION_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                    buffer
+                )
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+    def close(self):
+        """Ghi nốt các dòng còn lại (gọi khi thread nhận diện dừng)"""
+        return self.flush()
+
+    def stats(self):
+        """Thống kê số dòng và số lần ghi"""
+        with self._lock:
+            pending = len(self._rows)
+        return {
+            'mode': self.mode,
+            'pending': pending,
+            'rows_written': self.rows_written,
+            'flushes': self.flushes,
+            'errors': self.errors
+        }
+
+
+def create_detection_writer(app):
+    """Tạo bộ ghi kết quả nhận diện từ biến môi trường"""
+    return DetectionWriter(
+        app,
+        flush_rows=int(os.getenv('DETECTION_FLUSH_ROWS', '500')),
+        flush_interval=float(os.getenv('DETECTION_FLUSH_INTERVAL', '2')),
+        mode=os.getenv('DETECTION_WRITE_MODE', 'insert').lower()
+    )
@@ -6,6 +6,10 @@ from datetime import datetime
 import os
 import json
 from deepface import DeepFace
+from db_session import worker_session
+from camera_cache import camera_cache
+from event_stream import detection_callback
+from roi import region_of_interest
 
 # Khai báo cascade classifier cho face detection
 face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
@@ -74,15 +78,17 @@ class EmotionDetector:
                     try:
                         emotion_data = self._detect_emotion(frame)
                         if emotion_data:
-                            # Lưu frame và thông tin cảm xúc
-                            result_path = self.camera_handler.save_frame(frame, emotion_data)
-                            
-                            # Gọi các callback
-                            for callback in self.callbacks:
-                                try:
-                                    callback(frame, emotion_data, result_path)
-                                except Exception as e:
-                                    print(f"Lỗi khi gọi callback: {e}")
+                            # Lưu frame và gọi callback trong cùng một session của thread nền
+                            with worker_session():
+                                # Lưu frame và thông tin cảm xúc
+                                result_path = self.camera_handler.save_frame(frame, emotion_data)
+                                
+                                # Gọi các callback
+                                for callback in self.callbacks:
+                                    try:
+                                        callback(frame, emotion_data, result_path)
+                                    except Exception as e:
+                                        print(f"Lỗi khi gọi callback: {e}")
                     except Exception as e:
                         print(f"Lỗi khi xử lý frame: {e}")
                 
@@ -101,11 +107,20 @@ class EmotionDetector:
         Returns:
             dict: Thông tin về các khuôn mặt và cảm xúc phát hiện được
         """
+        # Chỉ nhận diện trong hình chữ nhật bao quanh vùng quan tâm (ROI) của camera nếu có cấu hình.
+        # Đọc ROI từ camera_cache mỗi frame (không dùng bản chụp của handler) để PUT /api/cameras/<id> có hiệu lực ngay
+        camera = camera_cache.get(self.camera_handler.camera_id)
+        roi = region_of_interest(camera.roi_polygon if camera else None, frame)
+        analysis_image = roi.crop(frame) if roi else frame
+        
         # Chuyển đổi frame sang grayscale cho face detection
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        gray = cv2.cvtColor(analysis_image, cv2.COLOR_BGR2GRAY)
         
         # Phát hiện khuôn mặt
         faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+        if roi:
+            # Đổi về tọa độ frame gốc, bỏ khuôn mặt nằm ngoài đa giác ROI
+            faces = roi.to_frame_boxes(faces)
         
         if len(faces) == 0:
             return None  # Không phát hiện khuôn mặt nào
@@ -120,12 +135,12 @@ class EmotionDetector:
             face_dict = {'box': (x, y, w, h)}
             
             try:
-                # Sử dụng DeepFace để nhận diện cảm xúc
+                # Phân tích đúng khuôn mặt này (đã lọc theo ROI), DeepFace không tự dò lại khuôn mặt trên cả ảnh
                 emotion_analysis = DeepFace.analyze(
-                    frame, 
+                    frame[y:y + h, x:x + w], 
                     actions=['emotion'],
                     enforce_detection=False,
-                    detector_backend='opencv'
+                    detector_backend='skip'
                 )
                 
                 if isinstance(emotion_analysis, list):
@@ -187,8 +202,9 @@ def start_emotion_detection(camera_id, interval_seconds=1, callback=None):
     if not camera_handler:
         return None
     
-    # Tạo detector mới
+    # Tạo detector mới, kết quả đã lưu luôn được gửi tới client đang nghe /api/events
     detector = EmotionDetector(camera_handler, interval_seconds)
+    detector.add_callback(detection_callback(camera_id))
     if callback:
         detector.add_callback(callback)
     
@@ -0,0 +1,218 @@
+import csv
+import io
+import json
+
+from models import db, Camera, Emotion, EMOTION_LABELS
+from emotion_queries import apply_emotion_filters
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # Xuất Parquet là tùy chọn: pip install pyarrow
+    pa = None
+    pq = None
+
+# Các cột của file xuất, điểm số mỗi cảm xúc là một cột riêng
+EXPORT_COLUMNS = ('id', 'timestamp', 'camera_id', 'camera_name', 'dominant_emotion') + \
+    tuple(f'score_{label}' for label in EMOTION_LABELS) + ('user_id',)
+
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def parquet_available():
+    """Kiểm tra pyarrow đã được cài đặt hay chưa"""
+    return pa is not None
+
+
+def iter_export_rows(filters, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Duyệt lịch sử cảm xúc theo bộ lọc của /api/emotions, mỗi dòng là tuple theo EXPORT_COLUMNS
+
+    Chỉ truy vấn các cột cần thiết (không tạo object ORM, không tải ảnh base64) và dùng
+    yield_per để PostgreSQL trả kết quả qua server-side cursor, bộ nhớ không phụ thuộc số dòng.
+    Cần application context trong suốt quá trình duyệt.
+    """
+    score_columns = [Emotion.score_column(label) for label in EMOTION_LABELS]
+    query = db.session.query(
+        Emotion.id, Emotion.timestamp, Emotion.camera_id, Camera.name, Emotion.dominant_emotion,
+        *score_columns, Emotion.user_id, Emotion.emotion_scores
+    ).outerjoin(Camera, Camera.id == Emotion.camera_id)
+    query = apply_emotion_filters(query, filters) \
+        .order_by(Emotion.timestamp, Emotion.id) \
+        .execution_options(yield_per=chunk_size)
+
+    for row in query:
+        scores = tuple(row[5:5 + len(EMOTION_LABELS)])
+        if all(value is None for value in scores) and row.emotion_scores:
+            # Bản ghi cũ chưa được chuyển sang các cột score_*
+            legacy = json.loads(row.emotion_scores)
+            scores = tuple(legacy.get(label) for label in EMOTION_LABELS)
+        yield tuple(row[:5]) + scores + (row.user_id,)
+
+
+def iter_chunks(rows, chunk_size):
+    """Gom các dòng thành từng danh sách chunk_size phần tử"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_csv(filters, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Sinh nội dung CSV theo từng khối (dòng tiêu đề, sau đó mỗi khối chunk_size dòng)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+
+    for chunk in iter_chunks(iter_export_rows(filters, chunk_size), chunk_size):
+        buffer.seek(0)
+        buffer.truncate()
+        for row in chunk:
+            writer.writerow([value.isoformat() if hasattr(value, 'isoformat') else value for value in row])
+        yield buffer.getvalue()
+
+
+def parquet_schema():
+    """Schema Parquet tương ứng EXPORT_COLUMNS"""
+    return pa.schema(
+        [
+            ('id', pa.int64()),
+            ('timestamp', pa.timestamp('us')),
+            ('camera_id', pa.int64()),
+            ('camera_name', pa.string()),
+            ('dominant_emotion', pa.string()),
+        ]
+        + [(f'score_{label}', pa.float32()) for label in EMOTION_LABELS]
+        + [('user_id', pa.int64())]
+    )
+
+
+class _ChunkSink(io.RawIOBase):
+    """File chỉ ghi, giữ các byte đã ghi cho tới khi được lấy ra bằng take()"""
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def iter_row_groups(filters, sink, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Ghi lịch sử cảm xúc ra Parquet, mỗi khối chunk_size dòng là một row group
+
+    Args:
+        sink: Đường dẫn file hoặc file-like object đang mở để ghi nhị phân
+
+    Yields:
+        int: Số dòng của mỗi row group vừa ghi (footer được ghi khi generator kết thúc)
+    """
+    if pa is None:
+        raise RuntimeError('Xuất Parquet cần cài đặt pyarrow')
+
+    schema = parquet_schema()
+    with pq.ParquetWriter(sink, schema, compression='snappy') as writer:
+        for chunk in iter_chunks(iter_export_rows(filters, chunk_size), chunk_size):
+            columns = list(zip(*chunk))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema
+            ))
+            yield len(chunk)
+
+
+def write_parquet(filters, sink, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Ghi lịch sử cảm xúc ra file Parquet, trả về số dòng đã ghi"""
+    return sum(iter_row_groups(filters, sink, chunk_size))
+
+
+def iter_parquet(filters, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Sinh nội dung Parquet theo từng row group để trả về qua HTTP chunked
+
+    Footer của Parquet chỉ được ghi khi đóng file nên khối cuối cùng chứa phần metadata.
+    """
+    sink = _ChunkSink()
+    for _ in iter_row_groups(filters, sink, chunk_size):
+        data = sink.take()
+        if data:
+            yield data
+    data = sink.take()
+    if data:
+        yield data
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import sys
+    from flask import Flask
+    from dotenv import load_dotenv
+    from emotion_queries import parse_emotion_filters
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Xuất lịch sử cảm xúc ra CSV hoặc Parquet')
+    parser.add_argument('output', help='File kết quả, "-" để ghi CSV ra stdout')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default=None, help='Mặc định theo phần mở rộng của file')
+    parser.add_argument('--camera-id', default=None)
+    parser.add_argument('--start-date', default=None, help='Ngày bắt đầu (ISO 8601)')
+    parser.add_argument('--end-date', default=None, help='Ngày kết thúc (ISO 8601)')
+    parser.add_argument('--emotion', default=None)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    export_format = args.format or ('parquet' if args.output.endswith('.parquet') else 'csv')
+    filters = parse_emotion_filters({
+        'camera_id': args.camera_id,
+        'start_date': args.start_date,
+        'end_date': args.end_date,
+        'emotion': args.emotion
+    })
+
+    app = Flask(__name__)
+
+    db_user = os.getenv('DB_USER', 'postgres')
+    db_password = os.getenv('DB_PASSWORD', '123456')
+    db_host = os.getenv('DB_HOST', 'localhost')
+    db_port = os.getenv('DB_PORT', '5432')
+    db_name = os.getenv('DB_NAME', 'emotion_detection1.3')
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    with app.app_context():
+        if export_format == 'parquet':
+            count = write_parquet(filters, args.output, args.chunk_size)
+            print(f"Đã xuất {count} dòng ra {args.output}", file=sys.stderr)
+        else:
+            output = sys.stdout if args.output == '-' else open(args.output, 'w', newline='', encoding='utf-8')
+            try:
+                for part in iter_csv(filters, args.chunk_size):
+                    output.write(part)
+            finally:
+                if output is not sys.stdout:
+                    output.close()
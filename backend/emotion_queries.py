@@ -0,0 +1,68 @@
+import datetime
+from models import db, Camera, Emotion, EMOTION_LABELS
+
+
+def parse_date(value, name):
+    """Chuyển chuỗi ISO 8601 thành datetime, trả về None nếu không hợp lệ"""
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError as e:
+        print(f"Error parsing {name}: {e}")
+        return None
+
+
+def parse_emotion_filters(args):
+    """
+    Đọc các bộ lọc lịch sử cảm xúc từ tham số request (hoặc dictionary)
+
+    Các bộ lọc: camera_id, start_date, end_date, emotion và ngưỡng điểm số min_<cảm xúc>
+    (ví dụ min_happy=0.6)
+
+    Returns:
+        dict: Bộ lọc đã được chuẩn hóa
+    """
+    camera_id = args.get('camera_id')
+    min_scores = {}
+    for label in EMOTION_LABELS:
+        value = args.get(f'min_{label}')
+        if value not in (None, ''):
+            min_scores[label] = float(value)
+
+    return {
+        'camera_id': int(camera_id) if camera_id not in (None, '') else None,
+        'start_date': parse_date(args.get('start_date'), 'start_date'),
+        'end_date': parse_date(args.get('end_date'), 'end_date'),
+        'emotion': args.get('emotion') or None,
+        'min_scores': min_scores
+    }
+
+
+def has_emotion_filters(filters):
+    """Kiểm tra có bộ lọc nào được áp dụng hay không"""
+    return any(filters[key] is not None for key in ('camera_id', 'start_date', 'end_date', 'emotion')) or bool(filters['min_scores'])
+
+
+def apply_emotion_filters(query, filters):
+    """Áp dụng bộ lọc lên truy vấn trên bảng emotions"""
+    if filters['camera_id'] is not None:
+        query = query.filter(Emotion.camera_id == filters['camera_id'])
+    if filters['start_date']:
+        query = query.filter(Emotion.timestamp >= filters['start_date'])
+    if filters['end_date']:
+        query = query.filter(Emotion.timestamp <= filters['end_date'])
+    if filters['emotion']:
+        query = query.filter(Emotion.dominant_emotion == filters['emotion'])
+    for label, threshold in filters['min_scores'].items():
+        query = query.filter(Emotion.score_column(label) >= threshold)
+    return query
+
+
+def list_emotions():
+    """
+    Truy vấn toàn bộ bản ghi cảm xúc cho GET /api/emotions/
+
+    Tên camera được JOIN trong cùng truy vấn (to_dict đọc emotion.camera.name), không truy vấn thêm mỗi bản ghi
+    """
+    return Emotion.query.options(db.joinedload(Emotion.camera).load_only(Camera.name)).all()
@@ -0,0 +1,149 @@
+import itertools
+import json
+import os
+import threading
+from collections import deque
+
+
+class Subscriber:
+    """
+    Một client đang nghe sự kiện, có hàng đợi giới hạn riêng
+
+    Khi client đọc chậm và hàng đợi đầy, sự kiện cũ nhất bị bỏ (client chỉ cần kết quả mới nhất),
+    số sự kiện bị bỏ được đếm để theo dõi.
+    """
+
+    def __init__(self, camera_ids=None, max_queue=100):
+        """
+        Args:
+            camera_ids (set): Các camera được theo dõi, None = tất cả camera
+            max_queue (int): Số sự kiện tối đa chờ gửi
+        """
+        self.camera_ids = set(camera_ids) if camera_ids is not None else None
+        self.max_queue = max_queue
+        self.dropped = 0
+        self.delivered = 0
+        self._queue = deque()
+        self._condition = threading.Condition()
+
+    def wants(self, camera_id):
+        return self.camera_ids is None or camera_id in self.camera_ids
+
+    def put(self, event):
+        with self._condition:
+            if len(self._queue) >= self.max_queue:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append(event)
+            self._condition.notify()
+
+    def get(self, timeout):
+        """Lấy toàn bộ sự kiện đang chờ, đợi tối đa timeout giây nếu hàng đợi trống"""
+        with self._condition:
+            if not self._queue:
+                self._condition.wait(timeout)
+            events = list(self._queue)
+            self._queue.clear()
+            self.delivered += len(events)
+            return events
+
+
+class EventBroker:
+    """Phân phối sự kiện kết quả nhận diện tới các client Server-Sent Events"""
+
+    def __init__(self, max_queue=100, heartbeat=15.0):
+        """
+        Args:
+            max_queue (int): Kích thước hàng đợi của mỗi client
+            heartbeat (float): Gửi comment giữ kết nối sau mỗi khoảng thời gian không có sự kiện (giây)
+        """
+        self.max_queue = max_queue
+        self.heartbeat = heartbeat
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.published = 0
+        self.delivered_total = 0
+        self.dropped_total = 0
+
+    def subscribe(self, camera_ids=None):
+        subscriber = Subscriber(camera_ids, self.max_queue)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            self.delivered_total += subscriber.delivered
+            self.dropped_total += subscriber.dropped
+
+    def publish(self, event_type, camera_id, data):
+        """Gửi sự kiện tới các client theo dõi camera, không chặn khi client đọc chậm"""
+        event = (next(self._ids), event_type, data)
+        with self._lock:
+            subscribers = [s for s in self._subscribers if s.wants(camera_id)]
+            self.published += 1
+        for subscriber in subscribers:
+            subscriber.put(event)
+        return len(subscribers)
+
+    def publish_emotion(self, camera_id, emotion_id, emotion_result, timestamp=None):
+        """Gửi kết quả nhận diện đã được lưu (điểm số, khung khuôn mặt, ID bản ghi)"""
+        scores = emotion_result.get('emotion') or emotion_result.get('scores') or {}
+        data = {
+            'id': emotion_id,
+            'camera_id': camera_id,
+            'timestamp': timestamp.isoformat() if timestamp else None,
+            'dominant_emotion': emotion_result.get('dominant_emotion'),
+            'scores': {label: round(float(value), 4) for label, value in scores.items()},
+            'faces': [
+                [int(value) for value in (face.get('box') if isinstance(face, dict) else face)]
+                for face in emotion_result.get('faces', [])
+            ]
+        }
+        return self.publish('emotion', camera_id, data)
+
+    def stream(self, subscriber):
+        """Generator sinh dữ liệu text/event-stream cho một client, hủy đăng ký khi client ngắt kết nối"""
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                events = subscriber.get(self.heartbeat)
+                if not events:
+                    yield ': keepalive\n\n'
+                    continue
+                yield ''.join(format_sse(*event) for event in events)
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            return {
+                'subscribers': len(subscribers),
+                'published': self.published,
+                'delivered': self.delivered_total + sum(s.delivered for s in subscribers),
+                'dropped': self.dropped_total + sum(s.dropped for s in subscribers),
+                'max_queue': self.max_queue
+            }
+
+
+def format_sse(event_id, event_type, data):
+    """Định dạng một sự kiện theo chuẩn Server-Sent Events"""
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def detection_callback(camera_id):
+    """Callback cho EmotionDetector.add_callback: gửi kết quả sau khi save_frame đã lưu bản ghi"""
+    def publish(frame, emotion_data, result_path):
+        if emotion_data.get('emotion_id'):
+            broker.publish_emotion(camera_id, emotion_data['emotion_id'], emotion_data, emotion_data.get('timestamp'))
+    return publish
+
+
+# Broker dùng chung cho endpoint /api/events, các endpoint nhận diện và emotion detector
+broker = EventBroker(
+    max_queue=int(os.getenv('EVENT_STREAM_MAX_QUEUE', '100')),
+    heartbeat=float(os.getenv('EVENT_STREAM_HEARTBEAT', '15'))
+)
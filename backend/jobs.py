@@ -0,0 +1,119 @@
+import datetime
+import threading
+import traceback
+import uuid
+from collections import OrderedDict
+
+
+class Job:
+    """Một tác vụ chạy nền, lưu tiến độ để client kiểm tra qua API"""
+
+    def __init__(self, kind, description=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.description = description
+        self.status = 'pending'  # pending, running, completed, failed
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = datetime.datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def update(self, **progress):
+        """Cập nhật tiến độ, ví dụ job.update(rows_deleted=1000, rows_total=5000)"""
+        with self._lock:
+            self.progress.update(progress)
+
+    def increment(self, key, amount=1):
+        """Cộng dồn một giá trị tiến độ"""
+        with self._lock:
+            self.progress[key] = self.progress.get(key, 0) + amount
+
+    def to_dict(self):
+        """Chuyển đổi object thành dictionary"""
+        with self._lock:
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'description': self.description,
+                'status': self.status,
+                'progress': dict(self.progress),
+                'result': self.result,
+                'error': self.error,
+                'created_at': self.created_at.isoformat(),
+                'started_at': self.started_at.isoformat() if self.started_at else None,
+                'finished_at': self.finished_at.isoformat() if self.finished_at else None
+            }
+
+
+class JobManager:
+    """Danh sách tác vụ nền trong bộ nhớ, mỗi tác vụ chạy ở một thread riêng"""
+
+    def __init__(self, app=None, max_jobs=200):
+        """
+        Args:
+            app: Flask app, nếu có thì tác vụ chạy trong application context
+            max_jobs (int): Số tác vụ đã kết thúc được giữ lại để tra cứu
+        """
+        self.app = app
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, func, *args, description=None, **kwargs):
+        """
+        Tạo và chạy tác vụ nền
+
+        Args:
+            kind (str): Loại tác vụ, ví dụ 'delete_camera'
+            func: Hàm thực thi, nhận job làm tham số đầu tiên và trả về kết quả (dictionary)
+
+        Returns:
+            Job: Tác vụ vừa tạo
+        """
+        job = Job(kind, description)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+
+        thread = threading.Thread(target=self._run, args=(job, func, args, kwargs), name=f'job-{kind}')
+        thread.daemon = True
+        thread.start()
+        return job
+
+    def _run(self, job, func, args, kwargs):
+        job.status = 'running'
+        job.started_at = datetime.datetime.now()
+        try:
+            if self.app is not None:
+                with self.app.app_context():
+                    job.result = func(job, *args, **kwargs)
+            else:
+                job.result = func(job, *args, **kwargs)
+            job.status = 'completed'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+            print(f"Tác vụ {job.kind} ({job.id}) bị lỗi: {e}")
+            traceback.print_exc()
+        finally:
+            job.finished_at = datetime.datetime.now()
+
+    def _prune(self):
+        """Xóa các tác vụ đã kết thúc cũ nhất khi vượt quá giới hạn"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in ('completed', 'failed')]
+        for job_id in finished[:max(0, len(self._jobs) - self.max_jobs)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """Lấy tác vụ theo ID, None nếu không có"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, kind=None):
+        """Danh sách tác vụ, mới nhất trước"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job for job in reversed(jobs) if kind is None or job.kind == kind]
@@ -0,0 +1,371 @@
+import datetime
+import re
+import time
+from sqlalchemy import text
+from models import db
+
+# Khóa advisory để nhiều tiến trình (gunicorn worker) không chạy migration cùng lúc
+MIGRATION_LOCK_KEY = 7301520
+
+# Tên index được tạo bằng CREATE INDEX CONCURRENTLY, cần kiểm tra pg_index.indisvalid sau khi chạy
+CONCURRENT_INDEX_PATTERN = re.compile(r'CREATE\s+INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)', re.IGNORECASE)
+
+# Điều kiện cho câu lệnh migration dạng (điều kiện, câu lệnh): chỉ chạy khi truy vấn điều kiện trả về true
+PARTITIONED_EMOTIONS = "SELECT relkind = 'p' FROM pg_class WHERE oid = 'emotions'::regclass"
+NOT_PARTITIONED_EMOTIONS = "SELECT relkind <> 'p' FROM pg_class WHERE oid = 'emotions'::regclass"
+
+# Danh sách migration theo phiên bản, chỉ được thêm mới vào cuối, không sửa migration đã phát hành
+# (ngoại lệ: sửa lỗi khiến migration không thể chạy xong, ví dụ vòng lặp vô hạn của phiên bản 3).
+# Migration có 'transactional': False chạy ở chế độ AUTOCOMMIT (cần cho CREATE INDEX CONCURRENTLY).
+# Migration có 'offline': True (tạo index CONCURRENTLY, backfill dữ liệu) chạy lâu nên không chạy khi
+# ứng dụng khởi động, chỉ chạy bằng `python migrations.py` ở bước triển khai.
+MIGRATIONS = [
+    {
+        'version': 1,
+        'description': 'Composite index cho truy vấn lịch sử trên emotions và detection_results',
+        'transactional': False,
+        'offline': True,
+        'statements': [
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_emotions_camera_id_timestamp '
+            'ON emotions (camera_id, "timestamp" DESC)',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_emotions_dominant_emotion_timestamp '
+            'ON emotions (dominant_emotion, "timestamp")',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_emotions_timestamp '
+            'ON emotions ("timestamp" DESC)',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_detection_results_camera_id_timestamp '
+            'ON detection_results (camera_id, "timestamp" DESC)',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_detection_results_emotion_timestamp '
+            'ON detection_results (emotion, "timestamp")',
+        ]
+    },
+    {
+        'version': 2,
+        'description': 'Cột điểm số REAL cho từng cảm xúc thay cho JSON trong emotion_scores',
+        'statements': [
+            'ALTER TABLE emotions ADD COLUMN IF NOT EXISTS score_angry REAL',
+            'ALTER TABLE emotions ADD COLUMN IF NOT EXISTS score_disgust REAL',
+            'ALTER TABLE emotions ADD COLUMN IF NOT EXISTS score_fear REAL',
+            'ALTER TABLE emotions ADD COLUMN IF NOT EXISTS score_happy REAL',
+            'ALTER TABLE emotions ADD COLUMN IF NOT EXISTS score_sad REAL',
+            'ALTER TABLE emotions ADD COLUMN IF NOT EXISTS score_surprise REAL',
+            'ALTER TABLE emotions ADD COLUMN IF NOT EXISTS score_neutral REAL',
+        ]
+    },
+    {
+        'version': 3,
+        'description': 'Chuyển điểm số từ emotion_scores (JSON) sang các cột score_* theo từng lô',
+        'transactional': False,
+        'offline': True,
+        'statements': [
+            # Hàm tạm trong session: emotion_scores không phải JSON hợp lệ, không phải object hoặc điểm số
+            # không phải số (hay vượt giới hạn REAL) cho ra NULL thay vì làm lỗi cả migration
+            """
+            CREATE OR REPLACE FUNCTION pg_temp.migration_score(scores TEXT, label TEXT) RETURNS REAL AS $f$
+            DECLARE
+                parsed JSONB;
+            BEGIN
+                parsed := scores::jsonb;
+                IF jsonb_typeof(parsed) <> 'object' OR jsonb_typeof(parsed -> label) <> 'number' THEN
+                    RETURN NULL;
+                END IF;
+                RETURN (parsed ->> label)::real;
+            EXCEPTION WHEN others THEN
+                RETURN NULL;
+            END
+            $f$ LANGUAGE plpgsql IMMUTABLE
+            """,
+            # Duyệt bảng theo keyset id (mỗi dòng được xét đúng một lần) và commit sau mỗi lô 10000 dòng để
+            # không khóa cả bảng. Không chọn lại theo "mọi score_* IS NULL": dòng không có điểm hợp lệ sẽ
+            # vẫn NULL sau khi cập nhật và bị chọn lại mãi, vòng lặp không bao giờ kết thúc.
+            """
+            DO $$
+            DECLARE
+                last_id INTEGER := 0;
+                batch_end INTEGER;
+            BEGIN
+                LOOP
+                    SELECT max(id) INTO batch_end FROM (
+                        SELECT id FROM emotions WHERE id > last_id ORDER BY id LIMIT 10000
+                    ) batch;
+                    EXIT WHEN batch_end IS NULL;
+
+                    UPDATE emotions SET
+                        score_angry = pg_temp.migration_score(emotion_scores::text, 'angry'),
+                        score_disgust = pg_temp.migration_score(emotion_scores::text, 'disgust'),
+                        score_fear = pg_temp.migration_score(emotion_scores::text, 'fear'),
+                        score_happy = pg_temp.migration_score(emotion_scores::text, 'happy'),
+                        score_sad = pg_temp.migration_score(emotion_scores::text, 'sad'),
+                        score_surprise = pg_temp.migration_score(emotion_scores::text, 'surprise'),
+                        score_neutral = pg_temp.migration_score(emotion_scores::text, 'neutral')
+                    WHERE id > last_id AND id <= batch_end
+                      AND emotion_scores IS NOT NULL
+                      AND score_angry IS NULL AND score_disgust IS NULL AND score_fear IS NULL
+                      AND score_happy IS NULL AND score_sad IS NULL AND score_surprise IS NULL
+                      AND score_neutral IS NULL;
+
+                    last_id := batch_end;
+                    COMMIT;
+                END LOOP;
+            END $$
+            """,
+        ]
+    },
+    {
+        'version': 4,
+        'description': 'Cột đánh dấu ảnh đã bị xóa theo chính sách lưu trữ',
+        'statements': [
+            'ALTER TABLE emotions ADD COLUMN IF NOT EXISTS image_purged_at TIMESTAMP',
+            'ALTER TABLE emotions ADD COLUMN IF NOT EXISTS processed_purged_at TIMESTAMP',
+        ]
+    },
+    {
+        'version': 5,
+        'description': 'Partial index cho các bản ghi còn ảnh cần xét xóa theo chính sách lưu trữ',
+        'transactional': False,
+        'offline': True,
+        'statements': [
+            # Bảng đã phân vùng (partitioning.py) không hỗ trợ CONCURRENTLY, khi đó tạo index trên bảng cha
+            (NOT_PARTITIONED_EMOTIONS, 'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_emotions_image_retention '
+             'ON emotions (camera_id, "timestamp") WHERE image_purged_at IS NULL'),
+            (NOT_PARTITIONED_EMOTIONS, 'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_emotions_processed_retention '
+             'ON emotions (camera_id, "timestamp") WHERE processed_purged_at IS NULL'),
+            (PARTITIONED_EMOTIONS, 'CREATE INDEX IF NOT EXISTS ix_emotions_image_retention '
+             'ON emotions (camera_id, "timestamp") WHERE image_purged_at IS NULL'),
+            (PARTITIONED_EMOTIONS, 'CREATE INDEX IF NOT EXISTS ix_emotions_processed_retention '
+             'ON emotions (camera_id, "timestamp") WHERE processed_purged_at IS NULL'),
+        ]
+    },
+    {
+        'version': 6,
+        'description': 'Cấu hình độ phân giải, fps và codec thu hình của từng camera',
+        'statements': [
+            'ALTER TABLE cameras ADD COLUMN IF NOT EXISTS capture_width INTEGER',
+            'ALTER TABLE cameras ADD COLUMN IF NOT EXISTS capture_height INTEGER',
+            'ALTER TABLE cameras ADD COLUMN IF NOT EXISTS capture_fps DOUBLE PRECISION',
+            'ALTER TABLE cameras ADD COLUMN IF NOT EXISTS capture_fourcc VARCHAR(4)',
+        ]
+    },
+    {
+        'version': 7,
+        'description': 'Vùng quan tâm (đa giác) giới hạn vùng nhận diện của từng camera',
+        'statements': [
+            'ALTER TABLE cameras ADD COLUMN IF NOT EXISTS roi_polygon JSON',
+        ]
+    },
+    {
+        'version': 8,
+        'description': 'Thêm id vào cuối các index lịch sử emotions để keyset (timestamp, id) dùng được index',
+        'transactional': False,
+        'offline': True,
+        'statements': [
+            (NOT_PARTITIONED_EMOTIONS, 'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_emotions_camera_id_timestamp_id '
+             'ON emotions (camera_id, "timestamp" DESC, id DESC)'),
+            (NOT_PARTITIONED_EMOTIONS, 'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_emotions_dominant_emotion_timestamp_id '
+             'ON emotions (dominant_emotion, "timestamp" DESC, id DESC)'),
+            (NOT_PARTITIONED_EMOTIONS, 'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_emotions_timestamp_id '
+             'ON emotions ("timestamp" DESC, id DESC)'),
+            (PARTITIONED_EMOTIONS, 'CREATE INDEX IF NOT EXISTS ix_emotions_camera_id_timestamp_id '
+             'ON emotions (camera_id, "timestamp" DESC, id DESC)'),
+            (PARTITIONED_EMOTIONS, 'CREATE INDEX IF NOT EXISTS ix_emotions_dominant_emotion_timestamp_id '
+             'ON emotions (dominant_emotion, "timestamp" DESC, id DESC)'),
+            (PARTITIONED_EMOTIONS, 'CREATE INDEX IF NOT EXISTS ix_emotions_timestamp_id '
+             'ON emotions ("timestamp" DESC, id DESC)'),
+            # Index cũ là tiền tố của index mới nên không còn cần thiết
+            (NOT_PARTITIONED_EMOTIONS, 'DROP INDEX CONCURRENTLY IF EXISTS ix_emotions_camera_id_timestamp'),
+            (NOT_PARTITIONED_EMOTIONS, 'DROP INDEX CONCURRENTLY IF EXISTS ix_emotions_dominant_emotion_timestamp'),
+            (NOT_PARTITIONED_EMOTIONS, 'DROP INDEX CONCURRENTLY IF EXISTS ix_emotions_timestamp'),
+            (PARTITIONED_EMOTIONS, 'DROP INDEX IF EXISTS ix_emotions_camera_id_timestamp'),
+            (PARTITIONED_EMOTIONS, 'DROP INDEX IF EXISTS ix_emotions_dominant_emotion_timestamp'),
+            (PARTITIONED_EMOTIONS, 'DROP INDEX IF EXISTS ix_emotions_timestamp'),
+        ]
+    },
+]
+
+
+def ensure_migrations_table(conn):
+    """Tạo bảng lưu các phiên bản migration đã chạy"""
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version INTEGER PRIMARY KEY, '
+        'description VARCHAR(255), '
+        'applied_at TIMESTAMP NOT NULL)'
+    ))
+
+
+def get_applied_versions(conn):
+    """Lấy danh sách phiên bản migration đã chạy"""
+    return {row[0] for row in conn.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def execute_statement(conn, statement):
+    """Chạy một câu lệnh migration, bỏ qua nếu điều kiện đi kèm không thỏa"""
+    if isinstance(statement, tuple):
+        condition, statement = statement
+        if not conn.execute(text(condition)).scalar():
+            return
+    conn.execute(text(statement))
+
+
+def concurrent_index_names(migration):
+    """Tên các index mà migration tạo bằng CREATE INDEX CONCURRENTLY"""
+    names = []
+    for statement in migration['statements']:
+        sql = statement[1] if isinstance(statement, tuple) else statement
+        names.extend(CONCURRENT_INDEX_PATTERN.findall(sql))
+    return names
+
+
+def invalid_indexes(conn, names):
+    """Các index trong danh sách đang INVALID (CREATE INDEX CONCURRENTLY bị gián đoạn hoặc lỗi)"""
+    if not names:
+        return []
+    rows = conn.execute(text(
+        'SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+        'WHERE c.relname = ANY(:names) AND pg_table_is_visible(c.oid) AND NOT i.indisvalid'
+    ), {'names': names})
+    return [row[0] for row in rows]
+
+
+def acquire_migration_lock(conn, wait=True, poll_interval=1.0):
+    """
+    Lấy khóa advisory của migration bằng pg_try_advisory_lock
+
+    Không dùng pg_advisory_lock: tiến trình đang chờ trong câu lệnh đó giữ một snapshot, còn CREATE INDEX
+    CONCURRENTLY ở tiến trình giữ khóa phải chờ mọi snapshot cũ kết thúc, hai bên chờ nhau mà PostgreSQL
+    không phát hiện được deadlock. Giữa các lần thử kết nối ở trạng thái idle nên không giữ snapshot.
+
+    Args:
+        wait (bool): Thử lại sau mỗi poll_interval giây cho tới khi lấy được khóa
+
+    Returns:
+        bool: False nếu wait=False và tiến trình khác đang giữ khóa
+    """
+    waiting = False
+    while True:
+        if conn.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': MIGRATION_LOCK_KEY}).scalar():
+            return True
+        if not wait:
+            return False
+        if not waiting:
+            print("Tiến trình khác đang chạy migration, đang chờ...")
+            waiting = True
+        time.sleep(poll_interval)
+
+
+def apply_migration(engine, migration):
+    """Chạy một migration và ghi lại phiên bản"""
+    record = text('INSERT INTO schema_migrations (version, description, applied_at) VALUES (:version, :description, :applied_at)')
+    params = {
+        'version': migration['version'],
+        'description': migration['description'],
+        'applied_at': datetime.datetime.now()
+    }
+
+    if migration.get('transactional', True):
+        with engine.begin() as conn:
+            for statement in migration['statements']:
+                execute_statement(conn, statement)
+            conn.execute(record, params)
+    else:
+        index_names = concurrent_index_names(migration)
+        with engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            # Index INVALID còn lại từ lần chạy bị gián đoạn bị IF NOT EXISTS bỏ qua nên phải xóa để tạo lại
+            for name in invalid_indexes(conn, index_names):
+                print(f"Xóa index INVALID {name} để tạo lại")
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
+            for statement in migration['statements']:
+                execute_statement(conn, statement)
+            invalid = invalid_indexes(conn, index_names)
+            if invalid:
+                raise RuntimeError(f"Migration {migration['version']}: index {invalid} chưa hợp lệ, không ghi nhận phiên bản")
+            conn.execute(record, params)
+
+
+def run_migrations(engine=None, include_offline=True, wait=True):
+    """
+    Chạy các migration chưa được áp dụng theo thứ tự phiên bản
+
+    Args:
+        engine: SQLAlchemy engine, mặc định là db.engine (cần application context)
+        include_offline (bool): False khi ứng dụng khởi động: bỏ qua migration 'offline' (chạy bằng CLI)
+        wait (bool): Chờ khi tiến trình khác đang chạy migration, False = bỏ qua (worker khác đã lo)
+
+    Returns:
+        list: Các phiên bản vừa được áp dụng
+    """
+    engine = engine or db.engine
+    applied_now = []
+    skipped = []
+
+    with engine.connect() as lock_conn:
+        lock_conn = lock_conn.execution_options(isolation_level='AUTOCOMMIT')
+        if not acquire_migration_lock(lock_conn, wait=wait):
+            print("Tiến trình khác đang chạy migration, bỏ qua")
+            return applied_now
+        try:
+            ensure_migrations_table(lock_conn)
+            applied = get_applied_versions(lock_conn)
+
+            for migration in sorted(MIGRATIONS, key=lambda m: m['version']):
+                if migration['version'] in applied:
+                    continue
+                if migration.get('offline') and not include_offline:
+                    skipped.append(migration['version'])
+                    continue
+                print(f"Đang chạy migration {migration['version']}: {migration['description']}")
+                apply_migration(engine, migration)
+                applied_now.append(migration['version'])
+        finally:
+            lock_conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_KEY})
+
+    if skipped:
+        print(f"Migration {skipped} cần chạy ở bước triển khai: python migrations.py")
+    return applied_now
+
+
+def migration_status(engine=None):
+    """Trả về danh sách migration kèm trạng thái đã chạy hay chưa"""
+    engine = engine or db.engine
+    with engine.begin() as conn:
+        ensure_migrations_table(conn)
+        applied = get_applied_versions(conn)
+    return [
+        {
+            'version': m['version'],
+            'description': m['description'],
+            'applied': m['version'] in applied
+        }
+        for m in sorted(MIGRATIONS, key=lambda m: m['version'])
+    ]
+
+
+# Chạy migration trực tiếp: python migrations.py [status]
+if __name__ == "__main__":
+    import os
+    import sys
+    from flask import Flask
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    app = Flask(__name__)
+
+    db_user = os.getenv('DB_USER', 'postgres')
+    db_password = os.getenv('DB_PASSWORD', '123456')
+    db_host = os.getenv('DB_HOST', 'localhost')
+    db_port = os.getenv('DB_PORT', '5432')
+    db_name = os.getenv('DB_NAME', 'emotion_detection1.3')
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    with app.app_context():
+        if len(sys.argv) > 1 and sys.argv[1] == 'status':
+            for m in migration_status():
+                print(f"{m['version']:>4}  {'x' if m['applied'] else ' '}  {m['description']}")
+        else:
+            db.create_all()
+            versions = run_migrations()
+            print(f"Đã chạy {len(versions)} migration: {versions}" if versions else "Database đã ở phiên bản mới nhất")
@@ -0,0 +1,251 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+import cv2
+
+from camera_handlers import get_active_camera, start_camera, stop_camera
+
+# Ranh giới giữa các phần của multipart/x-mixed-replace
+BOUNDARY = 'frame'
+
+# Kết quả nhận diện cũ hơn số giây này không được vẽ lên frame
+OVERLAY_MAX_AGE = 3.0
+
+# Chiều rộng yêu cầu được làm tròn xuống bội số này để số ảnh trong cache không tăng theo tham số của client
+WIDTH_STEP = 32
+
+
+class JpegCache:
+    """
+    Ảnh JPEG của frame mới nhất mỗi camera, mã hóa một lần cho mỗi số thứ tự frame
+
+    Mỗi tổ hợp (camera, chiều rộng, có vẽ kết quả hay không) giữ một ảnh đã mã hóa; mọi người xem
+    và các lần chụp nhanh cùng tổ hợp dùng chung ảnh đó cho tới khi camera có frame mới. Chiều rộng
+    được chuẩn hóa bằng normalize_width nên mỗi camera có tối đa frame_width / WIDTH_STEP tổ hợp.
+    """
+
+    def __init__(self, quality=80):
+        """
+        Args:
+            quality (int): Chất lượng JPEG (0-100)
+        """
+        self.quality = quality
+        self._entries = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.encodes = 0
+        self.hits = 0
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, handler, width=None, overlay=False):
+        """
+        Lấy ảnh JPEG của frame hiện tại của camera handler
+
+        Returns:
+            tuple: (số thứ tự frame, bytes JPEG, thời điểm nhận frame), (0, None, None) nếu chưa có frame
+        """
+        frame, _, _ = handler.get_frame_with_seq()
+        if frame is None:
+            return 0, None, None
+        width = normalize_width(width, frame.shape[1])
+
+        key = (handler.camera_id, width, overlay)
+        # Chỉ một thread mã hóa mỗi tổ hợp, các thread khác chờ rồi dùng lại kết quả
+        with self._key_lock(key):
+            frame, seq, frame_time = handler.get_frame_with_seq()
+            if frame is None:
+                return 0, None, None
+
+            entry = self._entries.get(key)
+            if entry and entry[0] == seq and entry[2] is handler:
+                self.hits += 1
+                return seq, entry[1], frame_time
+
+            image = resize_to_width(frame, width)
+            if overlay:
+                image = draw_detection(image, handler.last_detection, frame.shape[1])
+            ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            if not ok:
+                return 0, None, None
+            jpeg = buffer.tobytes()
+            self._entries[key] = (seq, jpeg, handler)
+            self.encodes += 1
+            return seq, jpeg, frame_time
+
+    def invalidate(self, camera_id):
+        """Xóa ảnh đã mã hóa và khóa của camera (khi handler dừng)"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == camera_id]:
+                del self._entries[key]
+            for key in [key for key in self._locks if key[0] == camera_id]:
+                del self._locks[key]
+
+    def stats(self):
+        return {'quality': self.quality, 'entries': len(self._entries), 'encodes': self.encodes, 'hits': self.hits}
+
+
+def normalize_width(width, frame_width):
+    """
+    Chuẩn hóa chiều rộng yêu cầu: None nếu không cần thu nhỏ, ngược lại làm tròn xuống bội số của WIDTH_STEP
+    """
+    if not width or width >= frame_width:
+        return None
+    return max(WIDTH_STEP, width // WIDTH_STEP * WIDTH_STEP)
+
+
+def resize_to_width(frame, width):
+    """Thu nhỏ frame về chiều rộng cho trước, giữ tỷ lệ (không phóng to)"""
+    if not width or frame.shape[1] <= width:
+        return frame
+    height = int(frame.shape[0] * width / frame.shape[1])
+    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def draw_detection(image, detection, source_width):
+    """Vẽ khung khuôn mặt và cảm xúc của lần nhận diện gần nhất (tọa độ theo frame gốc)"""
+    if not detection:
+        return image
+    detected_at, emotion_data = detection
+    if (datetime.now() - detected_at).total_seconds() > OVERLAY_MAX_AGE:
+        return image
+
+    image = image.copy()
+    scale = image.shape[1] / source_width
+    label = emotion_data.get('dominant_emotion') or ''
+    for face in emotion_data.get('faces', []):
+        x, y, w, h = [int(value * scale) for value in face['box']]
+        cv2.rectangle(image, (x, y), (x + w, y + h), (0, 255, 0), 2)
+        cv2.putText(image, label, (x, max(y - 10, 0)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+    return image
+
+
+def get_fresh_handler(camera_id, max_age):
+    """
+    Camera handler đang chạy có frame nhận trong vòng max_age giây, None nếu không có
+
+    Dùng cho chụp ảnh nhanh: lấy frame mới nhất của handler thay vì mở thêm một kết nối tới camera.
+    """
+    handler = get_active_camera(camera_id)
+    if handler is None or not handler.is_running:
+        return None
+    frame, _, frame_time = handler.get_frame_with_seq()
+    if frame is None or frame_time is None:
+        return None
+    if (datetime.now() - frame_time).total_seconds() > max_age:
+        return None
+    return handler
+
+
+class MjpegStreams:
+    """
+    Quản lý người xem luồng MJPEG của các camera
+
+    Camera handler chỉ được mở một lần dù có bao nhiêu người xem. Handler do luồng MJPEG tự mở sẽ
+    được đóng khi người xem cuối cùng ngắt kết nối, trừ khi đang có emotion detector dùng chung hoặc
+    camera đã được bật qua /api/cameras/<id>/start (release).
+    """
+
+    def __init__(self, jpeg_cache, default_fps=10, max_fps=30):
+        self.jpeg_cache = jpeg_cache
+        self.default_fps = default_fps
+        self.max_fps = max_fps
+        self._viewers = {}
+        self._owned = set()
+        self._lock = threading.Lock()
+        self.frames_sent = 0
+
+    def open(self, camera_id):
+        """
+        Đăng ký một người xem, mở camera handler nếu chưa chạy
+
+        Raises:
+            ValueError: Camera không tồn tại hoặc không mở được
+        """
+        with self._lock:
+            handler = get_active_camera(camera_id)
+            if handler is None:
+                handler = start_camera(camera_id)
+                if handler is None:
+                    raise ValueError(f"Không thể mở camera ID {camera_id}")
+                self._owned.add(camera_id)
+            self._viewers[camera_id] = self._viewers.get(camera_id, 0) + 1
+            return handler
+
+    def close(self, camera_id):
+        """Hủy đăng ký người xem, đóng handler do luồng MJPEG mở khi không còn ai xem"""
+        with self._lock:
+            self._viewers[camera_id] = self._viewers.get(camera_id, 1) - 1
+            if self._viewers[camera_id] > 0:
+                return
+            del self._viewers[camera_id]
+            if camera_id not in self._owned:
+                return
+            self._owned.discard(camera_id)
+            if self._used_by_detector(camera_id):
+                return
+            stop_camera(camera_id)
+            self.jpeg_cache.invalidate(camera_id)
+
+    def release(self, camera_id):
+        """Bỏ quyền sở hữu handler (camera được bật ở nơi khác): không đóng handler khi hết người xem"""
+        with self._lock:
+            self._owned.discard(camera_id)
+
+    @staticmethod
+    def _used_by_detector(camera_id):
+        try:
+            from emotion_detector import active_detectors
+        except ImportError:
+            return False
+        return camera_id in active_detectors
+
+    def frames(self, handler, fps=None, width=None, overlay=False):
+        """
+        Generator sinh luồng multipart/x-mixed-replace, chỉ gửi khi có frame mới
+
+        Nhịp gửi được giữ theo thời hạn (deadline) nên fps không bị trôi theo thời gian mã hóa.
+        Người gọi phải gọi close(camera_id) khi response kết thúc (Response.call_on_close).
+        """
+        fps = min(max(fps or self.default_fps, 1), self.max_fps)
+        interval = 1.0 / fps
+        last_seq = None
+        deadline = time.monotonic()
+        while handler.is_running:
+            seq, jpeg, _ = self.jpeg_cache.get(handler, width, overlay)
+            if jpeg is not None and seq != last_seq:
+                last_seq = seq
+                self.frames_sent += 1
+                yield (
+                    f'--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\n\r\n'.encode('ascii')
+                    + jpeg + b'\r\n'
+                )
+            deadline += interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Bị chậm hơn một nhịp: bắt đầu lại nhịp thay vì gửi dồn
+                deadline = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            viewers = dict(self._viewers)
+        return {
+            'viewers': viewers,
+            'frames_sent': self.frames_sent,
+            'jpeg': self.jpeg_cache.stats()
+        }
+
+
+# Cache JPEG và quản lý luồng dùng chung (cấu hình lại trong app.py sau khi nạp .env)
+jpeg_cache = JpegCache(quality=int(os.getenv('MJPEG_JPEG_QUALITY', '80')))
+mjpeg_streams = MjpegStreams(
+    jpeg_cache,
+    default_fps=float(os.getenv('MJPEG_DEFAULT_FPS', '10')),
+    max_fps=float(os.getenv('MJPEG_MAX_FPS', '30'))
+)
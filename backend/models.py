@@ -15,6 +15,20 @@ def get_vietnam_time():
     """Lấy thời gian hiện tại theo múi giờ Việt Nam"""
     return datetime.datetime.now(vietnam_tz)
 
+def to_vietnam_naive(value):
+    """
+    Đổi datetime về giờ Việt Nam không kèm múi giờ, dạng được lưu trong các cột DateTime
+    
+    datetime có múi giờ được chuyển sang UTC+7 trước khi bỏ tzinfo; datetime không có múi giờ
+    được coi là đã ở giờ Việt Nam.
+    """
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(vietnam_tz).replace(tzinfo=None)
+    return value
+
+# Các loại cảm xúc, mỗi loại có một cột điểm số riêng trong bảng emotions
+EMOTION_LABELS = ('angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral')
+
 # Định nghĩa các model
 class User(db.Model):
     __tablename__ = 'users'
@@ -91,13 +105,21 @@ class Camera(db.Model):
     updated_at = db.Column(db.DateTime, default=get_vietnam_time, onupdate=get_vietnam_time)
     last_connected = db.Column(db.DateTime)
     connection_status = db.Column(db.String(20), default='disconnected')  # connected, disconnected
+    # Cấu hình thu hình tại nguồn (None = mặc định của driver/camera)
+    capture_width = db.Column(db.Integer)
+    capture_height = db.Column(db.Integer)
+    capture_fps = db.Column(db.Float)
+    capture_fourcc = db.Column(db.String(4))  # ví dụ MJPG, YUYV, H264
+    # Vùng quan tâm: đa giác [[x, y], ...] theo tỷ lệ 0-1 của frame, None = toàn bộ frame
+    roi_polygon = db.Column(db.JSON)
     
     # Định nghĩa relationships
     emotions = db.relationship('Emotion', backref='camera', lazy=True, cascade="all, delete-orphan")
     schedules = db.relationship('CameraSchedule', backref=db.backref('camera_ref', lazy=True), lazy=True, cascade="all, delete-orphan")
     camera_groups = db.relationship('CameraGroupAssociation', back_populates='camera')
     
-    def __init__(self, name, location=None, camera_type='webcam', status='active', ip_address=None, port=None, stream_url=None, user_id=None, connection_status='disconnected'):
+    def __init__(self, name, location=None, camera_type='webcam', status='active', ip_address=None, port=None, stream_url=None, user_id=None, connection_status='disconnected',
+                 capture_width=None, capture_height=None, capture_fps=None, capture_fourcc=None, roi_polygon=None):
         self.name = name
         self.location = location
         self.camera_type = camera_type
@@ -109,6 +131,11 @@ class Camera(db.Model):
         self.created_at = get_vietnam_time()
         self.updated_at = get_vietnam_time()
         self.connection_status = connection_status
+        self.capture_width = capture_width
+        self.capture_height = capture_height
+        self.capture_fps = capture_fps
+        self.capture_fourcc = capture_fourcc
+        self.roi_polygon = roi_polygon
     
     def to_dict(self):
         """Chuyển đổi object thành dictionary"""
@@ -125,7 +152,12 @@ class Camera(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'last_connected': self.last_connected.isoformat() if self.last_connected else None,
-            'connection_status': self.connection_status
+            'connection_status': self.connection_status,
+            'capture_width': self.capture_width,
+            'capture_height': self.capture_height,
+            'capture_fps': self.capture_fps,
+            'capture_fourcc': self.capture_fourcc,
+            'roi_polygon': self.roi_polygon
         }
     
     def get_stream_url(self):
@@ -201,6 +233,26 @@ class CameraSchedule(db.Model):
 
     # Bỏ định nghĩa relationship ở đây vì đã được định nghĩa trong class Camera
 
+class RetentionPolicy(db.Model):
+    """Chính sách lưu trữ riêng của camera, giá trị None dùng mặc định từ biến môi trường"""
+    __tablename__ = 'retention_policies'
+
+    camera_id = db.Column(db.Integer, db.ForeignKey('cameras.id'), primary_key=True)
+    image_days = db.Column(db.Integer)  # Số ngày giữ ảnh gốc, 0 = giữ mãi
+    processed_days = db.Column(db.Integer)  # Số ngày giữ ảnh đã xử lý (có khung khuôn mặt), 0 = giữ mãi
+    row_days = db.Column(db.Integer)  # Số ngày giữ bản ghi emotions/detection_results, 0 = giữ mãi
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+    def to_dict(self):
+        """Chuyển đổi object thành dictionary"""
+        return {
+            'camera_id': self.camera_id,
+            'image_days': self.image_days,
+            'processed_days': self.processed_days,
+            'row_days': self.row_days,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
 class Emotion(db.Model):
     __tablename__ = 'emotions'
     
@@ -210,10 +262,31 @@ class Emotion(db.Model):
     image_path = db.Column(db.String(255), nullable=False)
     result_path = db.Column(db.String(255), nullable=False)
     dominant_emotion = db.Column(db.String(50))  # happy, sad, angry, etc.
-    emotion_scores = db.Column(db.Text)  # JSON string with emotion scores
-    image_base64 = db.Column(db.Text)  # Base64 encoded image
-    processed_image_base64 = db.Column(db.Text)  # Base64 encoded processed image
+    emotion_scores = db.Column(db.Text)  # JSON string with emotion scores (dữ liệu cũ, bản ghi mới dùng các cột score_*)
+    score_angry = db.Column(db.REAL)
+    score_disgust = db.Column(db.REAL)
+    score_fear = db.Column(db.REAL)
+    score_happy = db.Column(db.REAL)
+    score_sad = db.Column(db.REAL)
+    score_surprise = db.Column(db.REAL)
+    score_neutral = db.Column(db.REAL)
+    # Cột ảnh base64 rất lớn nên chỉ tải khi cần: query.options(db.undefer_group('images'))
+    image_base64 = db.deferred(db.Column(db.Text), group='images')  # Base64 encoded image
+    processed_image_base64 = db.deferred(db.Column(db.Text), group='images')  # Base64 encoded processed image
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    # Thời điểm dịch vụ lưu trữ (retention.py) đã xóa ảnh gốc / ảnh đã xử lý của bản ghi
+    image_purged_at = db.Column(db.DateTime)
+    processed_purged_at = db.Column(db.DateTime)
+    
+    # Index cho truy vấn lịch sử (được tạo cho database cũ bằng migration trong migrations.py)
+    __table_args__ = (
+        # id ở cuối để thứ tự keyset (timestamp, id) DESC và điều kiện seek dùng trọn index
+        db.Index('ix_emotions_camera_id_timestamp_id', camera_id, timestamp.desc(), id.desc()),
+        db.Index('ix_emotions_dominant_emotion_timestamp_id', dominant_emotion, timestamp.desc(), id.desc()),
+        db.Index('ix_emotions_timestamp_id', timestamp.desc(), id.desc()),
+        db.Index('ix_emotions_image_retention', camera_id, timestamp, postgresql_where=image_purged_at.is_(None)),
+        db.Index('ix_emotions_processed_retention', camera_id, timestamp, postgresql_where=processed_purged_at.is_(None)),
+    )
     
     def __init__(self, camera_id, image_path, result_path, dominant_emotion=None, emotion_scores=None, image_base64=None, processed_image_base64=None, user_id=None):
         self.timestamp = get_vietnam_time()
@@ -221,14 +294,37 @@ class Emotion(db.Model):
         self.image_path = image_path
         self.result_path = result_path
         self.dominant_emotion = dominant_emotion
-        self.emotion_scores = json.dumps(emotion_scores) if emotion_scores else None
+        self.scores = emotion_scores
         self.image_base64 = image_base64
         self.processed_image_base64 = processed_image_base64
         self.user_id = user_id
     
+    @property
+    def scores(self):
+        """Điểm số các cảm xúc dạng dictionary, đọc từ các cột score_*"""
+        scores = {label: getattr(self, f'score_{label}') for label in EMOTION_LABELS}
+        if any(value is not None for value in scores.values()):
+            return {label: value for label, value in scores.items() if value is not None}
+        # Bản ghi cũ chưa được chuyển sang các cột score_*
+        return json.loads(self.emotion_scores) if self.emotion_scores else {}
+    
+    @scores.setter
+    def scores(self, emotion_scores):
+        emotion_scores = emotion_scores or {}
+        for label in EMOTION_LABELS:
+            value = emotion_scores.get(label)
+            setattr(self, f'score_{label}', float(value) if value is not None else None)
+    
+    @classmethod
+    def score_column(cls, label):
+        """Lấy cột điểm số của một cảm xúc, ném ValueError nếu cảm xúc không hợp lệ"""
+        if label not in EMOTION_LABELS:
+            raise ValueError(f'Unknown emotion: {label}')
+        return getattr(cls, f'score_{label}')
+    
     def to_dict(self):
         """Chuyển đổi object thành dictionary"""
-        emotion_scores_dict = json.loads(self.emotion_scores) if self.emotion_scores else {}
+        emotion_scores_dict = self.scores
         return {
             'id': self.id,
             'timestamp': self.timestamp.isoformat() if self.timestamp else None,
@@ -241,6 +337,33 @@ class Emotion(db.Model):
             'processed_image_url': f'/api/processed-image/{self.id}' if self.id else None
         } 
 
+class EmotionRollup(db.Model):
+    """Số lượng cảm xúc và tổng điểm số đã gộp theo camera và khoảng thời gian (phút/giờ/ngày)"""
+    __tablename__ = 'emotion_rollups'
+
+    camera_id = db.Column(db.Integer, db.ForeignKey('cameras.id'), primary_key=True)
+    granularity = db.Column(db.String(10), primary_key=True)  # minute, hour, day
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+    # Số bản ghi có cảm xúc chiếm ưu thế tương ứng
+    count_angry = db.Column(db.Integer, nullable=False, default=0)
+    count_disgust = db.Column(db.Integer, nullable=False, default=0)
+    count_fear = db.Column(db.Integer, nullable=False, default=0)
+    count_happy = db.Column(db.Integer, nullable=False, default=0)
+    count_sad = db.Column(db.Integer, nullable=False, default=0)
+    count_surprise = db.Column(db.Integer, nullable=False, default=0)
+    count_neutral = db.Column(db.Integer, nullable=False, default=0)
+
+    # Tổng điểm số của từng cảm xúc (chia cho total để ra điểm trung bình)
+    sum_angry = db.Column(db.Float, nullable=False, default=0)
+    sum_disgust = db.Column(db.Float, nullable=False, default=0)
+    sum_fear = db.Column(db.Float, nullable=False, default=0)
+    sum_happy = db.Column(db.Float, nullable=False, default=0)
+    sum_sad = db.Column(db.Float, nullable=False, default=0)
+    sum_surprise = db.Column(db.Float, nullable=False, default=0)
+    sum_neutral = db.Column(db.Float, nullable=False, default=0)
+
 class DetectionResult(db.Model):
     """Model lưu kết quả nhận diện khuôn mặt và cảm xúc"""
     __tablename__ = 'detection_results'
@@ -253,6 +376,12 @@ class DetectionResult(db.Model):
     confidence = db.Column(db.Float, nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False, default=get_vietnam_time)
 
+    # Index cho truy vấn theo camera/cảm xúc (được tạo cho database cũ bằng migration trong migrations.py)
+    __table_args__ = (
+        db.Index('ix_detection_results_camera_id_timestamp', camera_id, timestamp.desc()),
+        db.Index('ix_detection_results_emotion_timestamp', emotion, timestamp),
+    )
+
     # Quan hệ với camera
     camera = db.relationship('Camera', backref=db.backref('detection_results', lazy=True))
 
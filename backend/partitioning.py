@@ -0,0 +1,255 @@
+import datetime
+import re
+from sqlalchemy import text
+from sqlalchemy.schema import AddConstraint, CreateIndex
+from models import db, Emotion, DetectionResult
+from storage import processed_path_for, remove_files
+
+# Các bảng có thể phân vùng theo tháng trên cột timestamp
+PARTITIONED_MODELS = {
+    'emotions': Emotion,
+    'detection_results': DetectionResult,
+}
+
+PARTITION_NAME_PATTERN = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+def month_start(value):
+    """Ngày đầu tháng của một thời điểm (bỏ múi giờ, giống cột timestamp)"""
+    return datetime.datetime(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    """Cộng số tháng vào ngày đầu tháng"""
+    index = value.year * 12 + value.month - 1 + months
+    return datetime.datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, start):
+    """Tên phân vùng của một tháng, ví dụ emotions_p202401"""
+    return f'{table}_p{start.year:04d}{start.month:02d}'
+
+
+def is_partitioned(conn, table):
+    """Kiểm tra bảng đã được phân vùng (relkind = 'p') hay chưa"""
+    relkind = conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {'table': table}
+    ).scalar()
+    return relkind == 'p'
+
+
+def list_partitions(conn, table):
+    """
+    Danh sách phân vùng theo tháng của bảng
+
+    Returns:
+        list: [(tên phân vùng, ngày đầu tháng)] sắp xếp theo thời gian, không gồm phân vùng default
+    """
+    rows = conn.execute(text(
+        'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+        'WHERE i.inhparent = to_regclass(:table)'
+    ), {'table': table})
+    partitions = []
+    for (name,) in rows:
+        match = PARTITION_NAME_PATTERN.search(name)
+        if match:
+            partitions.append((name, datetime.datetime(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def create_month_partition(conn, table, start):
+    """Tạo phân vùng cho một tháng nếu chưa có"""
+    conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {partition_name(table, start)} PARTITION OF {table} '
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{add_months(start, 1):%Y-%m-%d}')"
+    ))
+
+
+def enable_partitioning(table, months_ahead=3, engine=None):
+    """
+    Chuyển bảng thường thành bảng phân vùng theo tháng trên cột timestamp
+
+    Dữ liệu cũ được chép sang các phân vùng trong một transaction và bảng bị khóa trong lúc chuyển,
+    nên cần chạy trong thời gian bảo trì. Khóa chính trở thành (id, timestamp) vì PostgreSQL yêu cầu
+    khóa chính chứa cột phân vùng; sequence của id được giữ nguyên.
+    """
+    engine = engine or db.engine
+    model = PARTITIONED_MODELS[table]
+
+    with engine.begin() as conn:
+        if is_partitioned(conn, table):
+            print(f"Bảng {table} đã được phân vùng")
+            return False
+
+        conn.execute(text(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE'))
+        conn.execute(text(f'UPDATE {table} SET "timestamp" = now() WHERE "timestamp" IS NULL'))
+        first, last = conn.execute(text(f'SELECT min("timestamp"), max("timestamp") FROM {table}')).one()
+        sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {'table': table}).scalar()
+
+        legacy = f'{table}_legacy'
+        conn.execute(text(f'ALTER TABLE {table} RENAME TO {legacy}'))
+        if sequence:
+            conn.execute(text(f'ALTER SEQUENCE {sequence} OWNED BY NONE'))
+        conn.execute(text(f'CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE ("timestamp")'))
+        conn.execute(text(f'ALTER TABLE {table} ALTER COLUMN "timestamp" SET NOT NULL'))
+        conn.execute(text(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT'))
+
+        # Tạo phân vùng cho toàn bộ dữ liệu cũ và các tháng sắp tới trước khi chép dữ liệu
+        now = month_start(datetime.datetime.now())
+        start = month_start(first) if first else now
+        end = max(month_start(last) if last else now, now)
+        current = start
+        while current <= add_months(end, months_ahead):
+            create_month_partition(conn, table, current)
+            current = add_months(current, 1)
+
+        conn.execute(text(f'INSERT INTO {table} SELECT * FROM {legacy}'))
+        conn.execute(text(f'DROP TABLE {legacy}'))
+        if sequence:
+            conn.execute(text(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id'))
+
+        # Khóa chính, index và khóa ngoại được tạo trên bảng cha và tự áp dụng cho mọi phân vùng
+        conn.execute(text(f'ALTER TABLE {table} ADD PRIMARY KEY (id, "timestamp")'))
+        for index in model.__table__.indexes:
+            conn.execute(CreateIndex(index))
+        for constraint in model.__table__.foreign_key_constraints:
+            conn.execute(AddConstraint(constraint))
+
+    print(f"Đã phân vùng bảng {table} theo tháng")
+    return True
+
+
+def ensure_partitions(months_ahead=3, engine=None):
+    """
+    Tạo trước phân vùng cho tháng hiện tại và các tháng sắp tới của các bảng đã phân vùng
+
+    Returns:
+        list: Tên các phân vùng được kiểm tra/tạo
+    """
+    engine = engine or db.engine
+    now = month_start(datetime.datetime.now())
+    ensured = []
+    for table in PARTITIONED_MODELS:
+        with engine.begin() as conn:
+            if not is_partitioned(conn, table):
+                continue
+            for offset in range(months_ahead + 1):
+                start = add_months(now, offset)
+                try:
+                    with conn.begin_nested():
+                        create_month_partition(conn, table, start)
+                    ensured.append(partition_name(table, start))
+                except Exception as e:
+                    # Thường do phân vùng default đã có dữ liệu của tháng này
+                    print(f"Không thể tạo phân vùng {partition_name(table, start)}: {e}")
+    return ensured
+
+
+def _partition_file_paths(conn, table, name):
+    """Các file ảnh/kết quả thuộc một phân vùng, cần xóa cùng với dữ liệu"""
+    if table == 'emotions':
+        paths = []
+        for image_path, result_path in conn.execute(text(f'SELECT image_path, result_path FROM {name}')):
+            paths.extend([image_path, result_path, processed_path_for(result_path)])
+        return paths
+    return [image_path for (image_path,) in conn.execute(text(f'SELECT image_path FROM {name}'))]
+
+
+def drop_partitions_before(cutoff, delete_files=True, engine=None):
+    """
+    Xóa các phân vùng có toàn bộ dữ liệu cũ hơn cutoff bằng DETACH + DROP (không DELETE từng dòng)
+
+    Args:
+        cutoff (datetime): Phân vùng kết thúc trước hoặc đúng thời điểm này sẽ bị xóa
+        delete_files (bool): Xóa cả file ảnh/kết quả của các bản ghi trong phân vùng
+
+    Returns:
+        dict: Các phân vùng đã xóa, số dòng, số file và số byte giải phóng
+    """
+    engine = engine or db.engine
+    cutoff = cutoff.replace(tzinfo=None)
+    report = {'partitions': [], 'rows_deleted': 0, 'files_deleted': 0, 'bytes_reclaimed': 0}
+
+    for table in PARTITIONED_MODELS:
+        with engine.connect() as conn:
+            if not is_partitioned(conn, table):
+                continue
+            expired = [name for name, start in list_partitions(conn, table) if add_months(start, 1) <= cutoff]
+
+        for name in expired:
+            with engine.begin() as conn:
+                paths = _partition_file_paths(conn, table, name)
+                conn.execute(text(f'ALTER TABLE {table} DETACH PARTITION {name}'))
+                conn.execute(text(f'DROP TABLE {name}'))
+
+            rows = len(paths) // 3 if table == 'emotions' else len(paths)
+            report['partitions'].append(name)
+            report['rows_deleted'] += rows
+            if delete_files:
+                files, reclaimed = remove_files(paths)
+                report['files_deleted'] += files
+                report['bytes_reclaimed'] += reclaimed
+            print(f"Đã xóa phân vùng {name} ({rows} dòng)")
+
+    return report
+
+
+def partition_status(engine=None):
+    """Trạng thái phân vùng của từng bảng"""
+    engine = engine or db.engine
+    status = {}
+    with engine.connect() as conn:
+        for table in PARTITIONED_MODELS:
+            partitioned = is_partitioned(conn, table)
+            status[table] = {
+                'partitioned': partitioned,
+                'partitions': [name for name, _ in list_partitions(conn, table)] if partitioned else [],
+                'default_rows': conn.execute(text(f'SELECT count(*) FROM {table}_default')).scalar() if partitioned else None
+            }
+    return status
+
+
+# Quản lý phân vùng: python partitioning.py enable|maintain|status|drop-before YYYY-MM-DD
+if __name__ == "__main__":
+    import argparse
+    import os
+    from flask import Flask
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Phân vùng bảng emotions và detection_results theo tháng')
+    parser.add_argument('command', choices=['enable', 'maintain', 'status', 'drop-before'])
+    parser.add_argument('cutoff', nargs='?', help='Ngày (YYYY-MM-DD) cho lệnh drop-before')
+    parser.add_argument('--table', choices=list(PARTITIONED_MODELS), default=None, help='Chỉ phân vùng một bảng (lệnh enable)')
+    parser.add_argument('--months-ahead', type=int, default=int(os.getenv('PARTITION_MONTHS_AHEAD', '3')))
+    parser.add_argument('--keep-files', action='store_true', help='Không xóa file ảnh khi drop phân vùng')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+
+    db_user = os.getenv('DB_USER', 'postgres')
+    db_password = os.getenv('DB_PASSWORD', '123456')
+    db_host = os.getenv('DB_HOST', 'localhost')
+    db_port = os.getenv('DB_PORT', '5432')
+    db_name = os.getenv('DB_NAME', 'emotion_detection1.3')
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    with app.app_context():
+        if args.command == 'enable':
+            for table in [args.table] if args.table else PARTITIONED_MODELS:
+                enable_partitioning(table, months_ahead=args.months_ahead)
+        elif args.command == 'maintain':
+            print(f"Phân vùng: {ensure_partitions(months_ahead=args.months_ahead)}")
+        elif args.command == 'drop-before':
+            if not args.cutoff:
+                parser.error('drop-before cần ngày cutoff, ví dụ 2024-01-01')
+            print(drop_partitions_before(datetime.datetime.fromisoformat(args.cutoff), delete_files=not args.keep_files))
+        else:
+            for table, info in partition_status().items():
+                print(f"{table}: partitioned={info['partitioned']} default_rows={info['default_rows']}")
+                for name in info['partitions']:
+                    print(f"  {name}")
@@ -0,0 +1,72 @@
+import threading
+from contextlib import contextmanager
+
+from flask import g, has_app_context
+from sqlalchemy import event
+
+from models import db
+
+
+class QueryCounter:
+    """Đếm số câu lệnh SQL được gửi tới database trong một khoảng thời gian"""
+
+    def __init__(self, record_statements=False):
+        self.count = 0
+        self.statements = []
+        self.record_statements = record_statements
+        self._thread_id = threading.get_ident()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Chỉ đếm truy vấn của thread đang đo, bỏ qua camera handler/scheduler chạy song song
+        if threading.get_ident() != self._thread_id:
+            return
+        self.count += 1
+        if self.record_statements:
+            self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine=None, record_statements=False):
+    """
+    Đếm số câu lệnh SQL chạy bên trong khối with, dùng để phát hiện truy vấn N+1
+
+    Ví dụ:
+        with count_queries(record_statements=True) as counter:
+            client.get('/api/emotions/')
+        assert counter.count <= 3, counter.statements
+
+    Args:
+        engine: SQLAlchemy engine, mặc định là db.engine (cần application context)
+        record_statements (bool): Lưu lại nội dung các câu lệnh
+    """
+    engine = engine or db.engine
+    counter = QueryCounter(record_statements)
+    event.listen(engine, 'before_cursor_execute', counter._before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter._before_cursor_execute)
+
+
+def _count_request_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        g.sql_query_count = g.get('sql_query_count', 0) + 1
+
+
+def init_query_count_header(app, header='X-SQL-Queries'):
+    """
+    Thêm header chứa số câu lệnh SQL của mỗi request (dùng khi phát triển/kiểm thử)
+
+    Chỉ nên bật qua biến môi trường vì mỗi câu lệnh SQL phải đi qua một event listener.
+    """
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _count_request_query)
+
+    @app.before_request
+    def reset_query_count():
+        g.sql_query_count = 0
+
+    @app.after_request
+    def add_query_count_header(response):
+        response.headers[header] = str(g.get('sql_query_count', 0))
+        return response
@@ -0,0 +1,223 @@
+import datetime
+import os
+import threading
+import time
+
+from models import db, get_vietnam_time, Camera, Emotion, DetectionResult, RetentionPolicy
+from storage import processed_path_for, remove_files
+
+
+class RetentionService:
+    """Xóa ảnh và lịch sử cũ theo chính sách của từng camera, chạy theo lô nhỏ ở thread nền"""
+
+    def __init__(self, app, image_days=0, processed_days=0, row_days=0,
+                 batch_size=500, batch_pause=0.5, max_batches=200):
+        """
+        Khởi tạo dịch vụ lưu trữ
+
+        Args:
+            app: Flask app (để tạo application context trong thread nền)
+            image_days (int): Số ngày giữ ảnh gốc mặc định, 0 = giữ mãi
+            processed_days (int): Số ngày giữ ảnh đã xử lý mặc định, 0 = giữ mãi
+            row_days (int): Số ngày giữ bản ghi emotions/detection_results mặc định, 0 = giữ mãi
+            batch_size (int): Số bản ghi mỗi lô
+            batch_pause (float): Thời gian nghỉ giữa các lô (giây) để giới hạn I/O
+            max_batches (int): Số lô tối đa mỗi lần chạy, phần còn lại để lần chạy sau
+        """
+        self.app = app
+        self.defaults = {
+            'image_days': image_days,
+            'processed_days': processed_days,
+            'row_days': row_days,
+        }
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.max_batches = max_batches
+
+        self._run_lock = threading.Lock()
+        self.last_report = None
+        self.totals = {'runs': 0, 'files_deleted': 0, 'bytes_reclaimed': 0, 'rows_deleted': 0}
+
+    def policy_for(self, camera_id, overrides=None):
+        """Chính sách hiệu lực của camera: giá trị riêng nếu có, ngược lại dùng mặc định"""
+        overrides = overrides if overrides is not None else db.session.get(RetentionPolicy, camera_id)
+        policy = dict(self.defaults)
+        if overrides:
+            for key in policy:
+                value = getattr(overrides, key)
+                if value is not None:
+                    policy[key] = value
+        return policy
+
+    def is_running(self):
+        """Kiểm tra có lần dọn dẹp nào đang chạy không"""
+        return self._run_lock.locked()
+
+    def run_in_background(self):
+        """Chạy một lần dọn dẹp ở thread riêng, trả về False nếu đang có lần chạy khác"""
+        if self.is_running():
+            return False
+        thread = threading.Thread(target=self.run, name='retention')
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def run(self):
+        """
+        Chạy một lần dọn dẹp cho tất cả camera
+
+        Returns:
+            dict: Báo cáo lần chạy, None nếu đang có lần chạy khác
+        """
+        if not self._run_lock.acquire(blocking=False):
+            return None
+
+        report = {
+            'started_at': datetime.datetime.now().isoformat(),
+            'finished_at': None,
+            'images_purged': 0,
+            'processed_purged': 0,
+            'rows_deleted': 0,
+            'files_deleted': 0,
+            'bytes_reclaimed': 0,
+            'batches': 0,
+            'complete': True,
+            'error': None
+        }
+        try:
+            with self.app.app_context():
+                try:
+                    self._run(report)
+                except Exception:
+                    db.session.rollback()
+                    raise
+        except Exception as e:
+            report['error'] = str(e)
+            print(f"Lỗi khi dọn dẹp dữ liệu cũ: {e}")
+        finally:
+            report['finished_at'] = datetime.datetime.now().isoformat()
+            self.last_report = report
+            self.totals['runs'] += 1
+            for key in ('files_deleted', 'bytes_reclaimed', 'rows_deleted'):
+                self.totals[key] += report[key]
+            self._run_lock.release()
+
+        return report
+
+    def _run(self, report):
+        now = get_vietnam_time().replace(tzinfo=None)
+        policies = {p.camera_id: p for p in RetentionPolicy.query.all()}
+        camera_ids = [camera_id for (camera_id,) in db.session.query(Camera.id).order_by(Camera.id)]
+        db.session.commit()
+
+        for camera_id in camera_ids:
+            policy = self.policy_for(camera_id, policies.get(camera_id))
+            phases = (
+                ('row_days', self._delete_rows),
+                ('image_days', self._purge_images),
+                ('processed_days', self._purge_processed),
+            )
+            for key, phase in phases:
+                if not policy[key]:
+                    continue
+                cutoff = now - datetime.timedelta(days=policy[key])
+                while True:
+                    if report['batches'] >= self.max_batches:
+                        report['complete'] = False
+                        return
+                    done = phase(camera_id, cutoff, report)
+                    report['batches'] += 1
+                    if done:
+                        break
+                    time.sleep(self.batch_pause)
+
+    def _purge_images(self, camera_id, cutoff, report):
+        """Xóa một lô ảnh gốc cũ (file và cột base64), giữ lại bản ghi. Trả về True khi hết dữ liệu"""
+        rows = db.session.query(Emotion.id, Emotion.image_path) \
+            .filter(Emotion.camera_id == camera_id, Emotion.timestamp < cutoff, Emotion.image_purged_at.is_(None)) \
+            .order_by(Emotion.timestamp).limit(self.batch_size).all()
+        if not rows:
+            return True
+
+        Emotion.query.filter(Emotion.id.in_([row.id for row in rows])).update(
+            {Emotion.image_base64: None, Emotion.image_purged_at: datetime.datetime.now()},
+            synchronize_session=False
+        )
+        db.session.commit()
+
+        self._remove(report, [row.image_path for row in rows])
+        report['images_purged'] += len(rows)
+        return len(rows) < self.batch_size
+
+    def _purge_processed(self, camera_id, cutoff, report):
+        """Xóa một lô ảnh đã xử lý cũ (file và cột base64), giữ lại bản ghi. Trả về True khi hết dữ liệu"""
+        rows = db.session.query(Emotion.id, Emotion.result_path) \
+            .filter(Emotion.camera_id == camera_id, Emotion.timestamp < cutoff, Emotion.processed_purged_at.is_(None)) \
+            .order_by(Emotion.timestamp).limit(self.batch_size).all()
+        if not rows:
+            return True
+
+        Emotion.query.filter(Emotion.id.in_([row.id for row in rows])).update(
+            {Emotion.processed_image_base64: None, Emotion.processed_purged_at: datetime.datetime.now()},
+            synchronize_session=False
+        )
+        db.session.commit()
+
+        self._remove(report, [processed_path_for(row.result_path) for row in rows])
+        report['processed_purged'] += len(rows)
+        return len(rows) < self.batch_size
+
+    def _delete_rows(self, camera_id, cutoff, report):
+        """Xóa một lô bản ghi cũ cùng toàn bộ file liên quan. Trả về True khi hết dữ liệu"""
+        emotions = db.session.query(Emotion.id, Emotion.image_path, Emotion.result_path) \
+            .filter(Emotion.camera_id == camera_id, Emotion.timestamp < cutoff) \
+            .order_by(Emotion.timestamp).limit(self.batch_size).all()
+        detections = db.session.query(DetectionResult.id, DetectionResult.image_path) \
+            .filter(DetectionResult.camera_id == camera_id, DetectionResult.timestamp < cutoff) \
+            .order_by(DetectionResult.timestamp).limit(self.batch_size).all()
+        if not emotions and not detections:
+            return True
+
+        if emotions:
+            Emotion.query.filter(Emotion.id.in_([row.id for row in emotions])).delete(synchronize_session=False)
+        if detections:
+            DetectionResult.query.filter(DetectionResult.id.in_([row.id for row in detections])).delete(synchronize_session=False)
+        db.session.commit()
+
+        paths = [row.image_path for row in detections]
+        for row in emotions:
+            paths.extend([row.image_path, row.result_path, processed_path_for(row.result_path)])
+        self._remove(report, paths)
+        report['rows_deleted'] += len(emotions) + len(detections)
+        return len(emotions) < self.batch_size and len(detections) < self.batch_size
+
+    def _remove(self, report, paths):
+        # Bỏ trùng vì ảnh đã xử lý của camera handler chính là result_path
+        files, reclaimed = remove_files(dict.fromkeys(paths))
+        report['files_deleted'] += files
+        report['bytes_reclaimed'] += reclaimed
+
+    def status(self):
+        """Trạng thái dịch vụ: chính sách mặc định, báo cáo lần chạy gần nhất và tổng cộng"""
+        return {
+            'running': self.is_running(),
+            'defaults': self.defaults,
+            'batch_size': self.batch_size,
+            'batch_pause': self.batch_pause,
+            'max_batches': self.max_batches,
+            'last_run': self.last_report,
+            'totals': dict(self.totals)
+        }
+
+
+def create_retention_service(app):
+    """Tạo dịch vụ lưu trữ từ biến môi trường"""
+    return RetentionService(
+        app,
+        image_days=int(os.getenv('RETENTION_IMAGE_DAYS', '0')),
+        processed_days=int(os.getenv('RETENTION_PROCESSED_DAYS', '0')),
+        row_days=int(os.getenv('RETENTION_ROW_DAYS', '0')),
+        batch_size=int(os.getenv('RETENTION_BATCH_SIZE', '500')),
+        batch_pause=float(os.getenv('RETENTION_BATCH_PAUSE', '0.5')),
+        max_batches=int(os.getenv('RETENTION_MAX_BATCHES', '200'))
+    )
@@ -0,0 +1,87 @@
+import cv2
+import numpy as np
+
+# Diện tích tối thiểu của ROI (tỷ lệ theo diện tích frame): loại đa giác suy biến như các điểm thẳng hàng
+MIN_ROI_AREA = 1e-4
+
+
+def parse_roi_polygon(value):
+    """
+    Kiểm tra và chuẩn hóa vùng quan tâm (ROI) của camera
+
+    Tọa độ là tỷ lệ theo kích thước frame (0-1) để vẫn đúng khi độ phân giải thay đổi
+    (capture_width/capture_height, ảnh do client gửi lên).
+
+    Args:
+        value: Danh sách điểm [[x, y], ...] (ít nhất 3 điểm), None/[] để bỏ ROI
+
+    Returns:
+        list: Danh sách điểm [[x, y], ...] hoặc None
+
+    Raises:
+        ValueError: Dữ liệu không hợp lệ
+    """
+    if not value:
+        return None
+    if not isinstance(value, (list, tuple)) or len(value) < 3:
+        raise ValueError('roi_polygon phải là danh sách ít nhất 3 điểm [x, y]')
+
+    points = []
+    for point in value:
+        if not isinstance(point, (list, tuple)) or len(point) != 2:
+            raise ValueError('Mỗi điểm của roi_polygon phải có dạng [x, y]')
+        try:
+            x, y = float(point[0]), float(point[1])
+        except (TypeError, ValueError):
+            raise ValueError('Mỗi điểm của roi_polygon phải có dạng [x, y]')
+        if not (0.0 <= x <= 1.0 and 0.0 <= y <= 1.0):
+            raise ValueError('Tọa độ roi_polygon phải nằm trong khoảng 0-1 (tỷ lệ theo kích thước frame)')
+        points.append([x, y])
+    if cv2.contourArea(np.array(points, dtype=np.float32)) < MIN_ROI_AREA:
+        raise ValueError('roi_polygon không có diện tích (các điểm thẳng hàng hoặc trùng nhau)')
+    return points
+
+
+class RegionOfInterest:
+    """Vùng quan tâm của camera quy đổi theo kích thước của một frame cụ thể"""
+
+    def __init__(self, polygon, frame_shape):
+        """
+        Args:
+            polygon (list): Danh sách điểm [[x, y], ...] theo tỷ lệ 0-1
+            frame_shape (tuple): frame.shape của frame cần nhận diện
+        """
+        height, width = frame_shape[:2]
+        self.points = np.array(
+            [[round(x * (width - 1)), round(y * (height - 1))] for x, y in polygon],
+            dtype=np.int32
+        )
+        x, y, w, h = cv2.boundingRect(self.points)
+        self.x, self.y = x, y
+        self.width, self.height = w, h
+
+    def crop(self, frame):
+        """Cắt frame theo hình chữ nhật bao quanh ROI (view, không sao chép dữ liệu)"""
+        return frame[self.y:self.y + self.height, self.x:self.x + self.width]
+
+    def contains(self, box):
+        """Tâm khung khuôn mặt (x, y, w, h, tọa độ frame gốc) có nằm trong đa giác ROI hay không"""
+        x, y, w, h = box
+        center = (float(x + w / 2), float(y + h / 2))
+        return cv2.pointPolygonTest(self.points, center, False) >= 0
+
+    def to_frame_boxes(self, boxes):
+        """Đổi khung khuôn mặt phát hiện trên ảnh cắt sang tọa độ frame gốc, bỏ khung nằm ngoài đa giác"""
+        result = []
+        for (x, y, w, h) in boxes:
+            box = (int(x) + self.x, int(y) + self.y, int(w), int(h))
+            if self.contains(box):
+                result.append(box)
+        return result
+
+
+def region_of_interest(polygon, frame):
+    """RegionOfInterest cho frame, None khi camera không cấu hình ROI"""
+    if not polygon:
+        return None
+    return RegionOfInterest(polygon, frame.shape)
@@ -0,0 +1,277 @@
+import datetime
+from sqlalchemy import event, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from models import db, Emotion, EmotionRollup, EMOTION_LABELS, to_vietnam_naive, vietnam_tz
+
+# Các mức gộp được duy trì, tương ứng với tham số của date_trunc trong PostgreSQL
+ROLLUP_GRANULARITIES = ('minute', 'hour', 'day')
+
+# Số bucket tối đa một lần truy vấn /api/stats được trả về
+MAX_SERIES_BUCKETS = 2000
+
+# Bucket rollup luôn tính theo giờ Việt Nam, không phụ thuộc TimeZone của server PostgreSQL
+ROLLUP_TIMEZONE = 'Asia/Ho_Chi_Minh'
+
+_listener_registered = False
+
+
+def truncate_timestamp(timestamp, granularity):
+    """
+    Làm tròn xuống thời điểm bắt đầu của bucket theo giờ Việt Nam (giống bucket_sql của rebuild_rollups)
+
+    datetime có múi giờ (get_vietnam_time, mặc định của Emotion.timestamp) được đổi sang giờ Việt Nam;
+    datetime không có múi giờ được coi là đã ở giờ Việt Nam.
+    """
+    timestamp = to_vietnam_naive(timestamp)
+    if granularity == 'minute':
+        return timestamp.replace(second=0, microsecond=0)
+    if granularity == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f'Unknown granularity: {granularity}')
+
+
+def bucket_sql(granularity):
+    """
+    Biểu thức SQL bucket theo giờ Việt Nam của cột timestamp
+
+    PostgreSQL lưu datetime có múi giờ vào cột timestamp theo TimeZone của session, nên giá trị được đọc
+    lại theo TimeZone đó rồi mới đổi sang giờ Việt Nam.
+    """
+    return f"date_trunc('{granularity}', timezone('{ROLLUP_TIMEZONE}', \"timestamp\"::timestamptz))"
+
+
+def _vietnam_aware(value):
+    """datetime giờ Việt Nam có múi giờ (so sánh với cột timestamp theo thời điểm tuyệt đối)"""
+    return to_vietnam_naive(value).replace(tzinfo=vietnam_tz)
+
+
+def _empty_bucket():
+    bucket = {'total': 0}
+    for label in EMOTION_LABELS:
+        bucket[f'count_{label}'] = 0
+        bucket[f'sum_{label}'] = 0.0
+    return bucket
+
+
+def aggregate_emotions(emotions):
+    """
+    Gộp các bản ghi Emotion mới thành các dòng rollup theo (camera, mức gộp, bucket)
+
+    Returns:
+        list: Các dictionary giá trị cho bảng emotion_rollups
+    """
+    buckets = {}
+    for emotion in emotions:
+        if emotion.camera_id is None:
+            continue
+        timestamp = emotion.timestamp or datetime.datetime.now()
+        scores = emotion.scores
+        for granularity in ROLLUP_GRANULARITIES:
+            key = (emotion.camera_id, granularity, truncate_timestamp(timestamp, granularity))
+            bucket = buckets.setdefault(key, _empty_bucket())
+            bucket['total'] += 1
+            if emotion.dominant_emotion in EMOTION_LABELS:
+                bucket[f'count_{emotion.dominant_emotion}'] += 1
+            for label in EMOTION_LABELS:
+                bucket[f'sum_{label}'] += float(scores.get(label) or 0.0)
+
+    return [
+        dict(camera_id=camera_id, granularity=granularity, bucket_start=bucket_start, **values)
+        for (camera_id, granularity, bucket_start), values in buckets.items()
+    ]
+
+
+def upsert_rollups(connection, rows):
+    """Cộng dồn các dòng rollup bằng một câu INSERT ... ON CONFLICT DO UPDATE"""
+    if not rows:
+        return
+    stmt = insert(EmotionRollup.__table__).values(rows)
+    table = EmotionRollup.__table__
+    counters = ['total'] + [f'count_{label}' for label in EMOTION_LABELS] + [f'sum_{label}' for label in EMOTION_LABELS]
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['camera_id', 'granularity', 'bucket_start'],
+        set_={name: table.c[name] + stmt.excluded[name] for name in counters}
+    )
+    connection.execute(stmt)
+
+
+def _update_rollups_after_flush(session, flush_context):
+    """Cập nhật rollup trong cùng transaction với các bản ghi Emotion vừa được insert"""
+    new_emotions = [obj for obj in session.new if isinstance(obj, Emotion)]
+    if new_emotions:
+        upsert_rollups(session.connection(), aggregate_emotions(new_emotions))
+
+
+def register_rollup_listener():
+    """Đăng ký cập nhật rollup tăng dần mỗi khi session flush bản ghi Emotion mới"""
+    global _listener_registered
+    if _listener_registered:
+        return
+    event.listen(Session, 'after_flush', _update_rollups_after_flush)
+    _listener_registered = True
+
+
+def rebuild_rollups(camera_id=None, start_date=None, end_date=None, engine=None):
+    """
+    Tính lại rollup từ bảng emotions (dùng để backfill hoặc sửa lệch dữ liệu)
+
+    Khoảng thời gian được mở rộng ra biên ngày (giờ Việt Nam) để các bucket không bị tính thiếu.
+
+    Returns:
+        int: Số dòng rollup được tạo lại
+    """
+    engine = engine or db.engine
+    conditions = ['camera_id IS NOT NULL']
+    rollup_conditions = ['camera_id IS NOT NULL']
+    params = {}
+    if camera_id is not None:
+        conditions.append('camera_id = :camera_id')
+        rollup_conditions.append('camera_id = :camera_id')
+        params['camera_id'] = camera_id
+    # bucket_start là giờ Việt Nam không kèm múi giờ; cột timestamp được so sánh với mốc có múi giờ
+    # (toán tử timestamp/timestamptz vẫn dùng được index trên cột timestamp)
+    if start_date:
+        params['start_bucket'] = truncate_timestamp(start_date, 'day')
+        params['start_date'] = _vietnam_aware(params['start_bucket'])
+        conditions.append('"timestamp" >= :start_date')
+        rollup_conditions.append('bucket_start >= :start_bucket')
+    if end_date:
+        params['end_bucket'] = truncate_timestamp(end_date, 'day') + datetime.timedelta(days=1)
+        params['end_date'] = _vietnam_aware(params['end_bucket'])
+        conditions.append('"timestamp" < :end_date')
+        rollup_conditions.append('bucket_start < :end_bucket')
+    where = ' AND '.join(conditions)
+    rollup_where = ' AND '.join(rollup_conditions)
+
+    counts = ', '.join(f"count(*) FILTER (WHERE dominant_emotion = '{label}')" for label in EMOTION_LABELS)
+    sums = ', '.join(f'coalesce(sum(score_{label}), 0)' for label in EMOTION_LABELS)
+    columns = ', '.join(
+        ['camera_id', 'granularity', 'bucket_start', 'total']
+        + [f'count_{label}' for label in EMOTION_LABELS]
+        + [f'sum_{label}' for label in EMOTION_LABELS]
+    )
+
+    rebuilt = 0
+    with engine.begin() as conn:
+        conn.execute(text(f'DELETE FROM emotion_rollups WHERE {rollup_where}'), params)
+        for granularity in ROLLUP_GRANULARITIES:
+            result = conn.execute(text(
+                f'INSERT INTO emotion_rollups ({columns}) '
+                f"SELECT camera_id, '{granularity}', {bucket_sql(granularity)} AS bucket, "
+                f'count(*), {counts}, {sums} '
+                f'FROM emotions WHERE {where} '
+                f'GROUP BY camera_id, bucket'
+            ), params)
+            rebuilt += result.rowcount
+    return rebuilt
+
+
+def _rollup_query(columns, camera_ids, granularity, start_date, end_date):
+    query = db.session.query(*columns).filter(EmotionRollup.granularity == granularity)
+    if camera_ids:
+        query = query.filter(EmotionRollup.camera_id.in_(camera_ids))
+    if start_date:
+        query = query.filter(EmotionRollup.bucket_start >= truncate_timestamp(start_date, granularity))
+    if end_date:
+        query = query.filter(EmotionRollup.bucket_start <= to_vietnam_naive(end_date))
+    return query
+
+
+def _summary(total, counts, sums):
+    return {
+        'total': int(total or 0),
+        'counts': {label: int(value or 0) for label, value in zip(EMOTION_LABELS, counts)},
+        'average': {
+            label: (float(value) / total if total else None)
+            for label, value in zip(EMOTION_LABELS, sums)
+        }
+    }
+
+
+def _aggregate_columns():
+    return (
+        [db.func.sum(EmotionRollup.total)]
+        + [db.func.sum(getattr(EmotionRollup, f'count_{label}')) for label in EMOTION_LABELS]
+        + [db.func.sum(getattr(EmotionRollup, f'sum_{label}')) for label in EMOTION_LABELS]
+    )
+
+
+def query_stats(camera_ids=None, granularity='hour', start_date=None, end_date=None, include_series=True):
+    """
+    Thống kê cảm xúc từ bảng rollup (chi phí theo số bucket, không theo số bản ghi lịch sử)
+
+    Args:
+        camera_ids (list): Danh sách camera, None = tất cả camera
+        granularity (str): minute, hour hoặc day
+        start_date, end_date (datetime): Khoảng thời gian
+        include_series (bool): Có trả về chuỗi thời gian hay không
+
+    Returns:
+        dict: {'distribution': ..., 'series': [...]}
+    """
+    if granularity not in ROLLUP_GRANULARITIES:
+        raise ValueError(f'Unknown granularity: {granularity}')
+
+    n = len(EMOTION_LABELS)
+    # Không lọc theo thời gian thì phân bố đọc từ rollup theo ngày (ít bucket nhất, cùng kết quả)
+    distribution_granularity = granularity if start_date or end_date else 'day'
+    row = _rollup_query(_aggregate_columns(), camera_ids, distribution_granularity, start_date, end_date).one()
+    response = {
+        'granularity': granularity,
+        'distribution': _summary(row[0], row[1:1 + n], row[1 + n:])
+    }
+
+    if include_series:
+        rows = _rollup_query([EmotionRollup.bucket_start] + _aggregate_columns(), camera_ids, granularity, start_date, end_date) \
+            .group_by(EmotionRollup.bucket_start) \
+            .order_by(EmotionRollup.bucket_start.desc()) \
+            .limit(MAX_SERIES_BUCKETS + 1).all()
+        response['truncated'] = len(rows) > MAX_SERIES_BUCKETS
+        response['series'] = [
+            dict(bucket_start=r[0].isoformat(), **_summary(r[1], r[2:2 + n], r[2 + n:]))
+            for r in reversed(rows[:MAX_SERIES_BUCKETS])
+        ]
+
+    return response
+
+
+# Tính lại rollup: python rollups.py rebuild [--camera-id ID] [--start-date ...] [--end-date ...]
+if __name__ == "__main__":
+    import argparse
+    import os
+    from flask import Flask
+    from dotenv import load_dotenv
+    from emotion_queries import parse_date
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Tính lại bảng emotion_rollups từ bảng emotions')
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--camera-id', type=int, default=None)
+    parser.add_argument('--start-date', default=None, help='Ngày bắt đầu (ISO 8601)')
+    parser.add_argument('--end-date', default=None, help='Ngày kết thúc (ISO 8601)')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+
+    db_user = os.getenv('DB_USER', 'postgres')
+    db_password = os.getenv('DB_PASSWORD', '123456')
+    db_host = os.getenv('DB_HOST', 'localhost')
+    db_port = os.getenv('DB_PORT', '5432')
+    db_name = os.getenv('DB_NAME', 'emotion_detection1.3')
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        count = rebuild_rollups(
+            camera_id=args.camera_id,
+            start_date=parse_date(args.start_date, 'start_date'),
+            end_date=parse_date(args.end_date, 'end_date')
+        )
+        print(f"Đã tạo lại {count} dòng rollup")
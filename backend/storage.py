@@ -0,0 +1,60 @@
+import os
+
+
+def processed_path_for(result_path):
+    """Đường dẫn ảnh đã xử lý tương ứng với file kết quả JSON (cùng tên gốc)"""
+    if not result_path:
+        return None
+    return result_path.replace('_result.json', '_processed.jpg')
+
+
+def remove_files(paths):
+    """
+    Xóa danh sách file, bỏ qua file không tồn tại
+
+    Returns:
+        tuple: (số file đã xóa, tổng số byte giải phóng)
+    """
+    removed = 0
+    reclaimed = 0
+    for path in paths:
+        if not path:
+            continue
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            removed += 1
+            reclaimed += size
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            print(f"Error deleting file {path}: {e}")
+    return removed, reclaimed
+
+
+def remove_tree(folder):
+    """
+    Xóa toàn bộ thư mục (từng file rồi tới thư mục con) và thống kê dung lượng giải phóng
+
+    Returns:
+        tuple: (số file đã xóa, tổng số byte giải phóng)
+    """
+    removed = 0
+    reclaimed = 0
+    if not os.path.isdir(folder):
+        return removed, reclaimed
+
+    for root, dirs, files in os.walk(folder, topdown=False):
+        files_removed, bytes_reclaimed = remove_files(os.path.join(root, name) for name in files)
+        removed += files_removed
+        reclaimed += bytes_reclaimed
+        for name in dirs:
+            try:
+                os.rmdir(os.path.join(root, name))
+            except OSError as e:
+                print(f"Error deleting directory {os.path.join(root, name)}: {e}")
+    try:
+        os.rmdir(folder)
+    except OSError as e:
+        print(f"Error deleting directory {folder}: {e}")
+    return removed, reclaimed
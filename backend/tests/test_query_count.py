@@ -0,0 +1,53 @@
+"""
+Kiểm tra số câu lệnh SQL của GET /api/emotions/ (phát hiện truy vấn N+1 khi đọc tên camera)
+
+Chạy: python -m pytest tests (dùng SQLite trong bộ nhớ, không cần PostgreSQL)
+"""
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db, Camera, Emotion
+from emotion_queries import list_emotions
+from query_counter import count_queries
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        cameras = [Camera(name=f'Camera {i}') for i in range(1, 4)]
+        db.session.add_all(cameras)
+        db.session.flush()
+        for i in range(12):
+            db.session.add(Emotion(
+                camera_id=cameras[i % len(cameras)].id,
+                image_path=f'images/{i}.jpg',
+                result_path=f'results/{i}.json',
+                dominant_emotion='happy',
+                emotion_scores={'happy': 0.9, 'neutral': 0.1}
+            ))
+        db.session.commit()
+        db.session.expunge_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def test_get_emotions_query_count(app):
+    with app.app_context():
+        with count_queries(record_statements=True) as counter:
+            emotions = [emotion.to_dict() for emotion in list_emotions()]
+
+    assert len(emotions) == 12
+    assert {emotion['camera_name'] for emotion in emotions} == {'Camera 1', 'Camera 2', 'Camera 3'}
+    # Một truy vấn JOIN duy nhất, không tăng theo số bản ghi hay số camera
+    assert counter.count == 1, counter.statements
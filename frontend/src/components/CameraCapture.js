@@ -45,6 +45,8 @@ const CameraCapture = () => {
   const [loadingCameras, setLoadingCameras] = useState(false);
   const intervalRef = useRef(null);
   const [registeredCameras, setRegisteredCameras] = useState([]);
+  // Camera đã đăng ký (loại webcam) nhận kết quả nhận diện từ webcam của trình duyệt
+  const [webcamCameraId, setWebcamCameraId] = useState(null);
   const [debugInfo, setDebugInfo] = useState(false); // Thêm chế độ debug
   const [captureCount, setCaptureCount] = useState(0); // Đếm số ảnh đã chụp
   const [successCount, setSuccessCount] = useState(0); // Đếm số lần nhận diện thành công
@@ -109,11 +111,17 @@ const CameraCapture = () => {
       try {
         setLoadingCameras(true);
         const response = await apiService.cameras.getAll();
-        setRegisteredCameras(response.data);
+        // GET /api/cameras trả về {cameras, total}
+        const cameras = response.data.cameras || [];
+        setRegisteredCameras(cameras);
+        
+        // Mặc định gửi ảnh webcam cho camera loại webcam đầu tiên
+        const webcamCamera = cameras.find(cam => cam.camera_type === 'webcam');
+        setWebcamCameraId(webcamCamera ? webcamCamera.id : null);
         
         // Tự động thiết lập IP cameras nếu có
-        if (response.data.length > 0) {
-          const ipCameras = response.data.filter(cam => cam.type === 'ipcam');
+        if (cameras.length > 0) {
+          const ipCameras = cameras.filter(cam => cam.type === 'ipcam');
           
           // Thiết lập các IP camera mặc định
           const newSelectedCameras = {...selectedCameras};
@@ -158,19 +166,20 @@ const CameraCapture = () => {
       const startTime = performance.now();
       
       // Chụp từ webcam nếu đang kích hoạt
-      if (activeCameras.webcam && webcamRef.current) {
-        const imageSrc = webcamRef.current.getScreenshot();
+      if (activeCameras.webcam && webcamRef.current && !webcamCameraId) {
+        setError('Chưa chọn camera đã đăng ký cho webcam');
+      } else if (activeCameras.webcam && webcamRef.current) {
+        const canvas = webcamRef.current.getCanvas();
+        const imageBlob = canvas
+          ? await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', 0.92))
+          : null;
         
-        if (!imageSrc) {
+        if (!imageBlob) {
           console.error('Không thể chụp ảnh từ webcam');
         } else {
-          // Gửi ảnh lên server để nhận diện
+          // Gửi ảnh nhị phân lên server để nhận diện (không mã hóa base64)
           try {
-            const response = await apiService.emotions.detect({
-              image: imageSrc,
-              cameraId: 'webcam',
-              cameraName: 'Webcam'
-            });
+            const response = await apiService.emotions.detectBinary(imageBlob, webcamCameraId);
             
             setCameraResults(prev => ({
               ...prev,
@@ -235,7 +244,7 @@ const CameraCapture = () => {
     } finally {
       setLoading(false);
     }
-  }, [activeCameras, selectedCameras, webcamRef, registeredCameras]);
+  }, [activeCameras, selectedCameras, webcamRef, registeredCameras, webcamCameraId]);
 
   // Khởi động/dừng việc chụp ảnh
   const toggleCapture = () => {
@@ -389,6 +398,20 @@ const CameraCapture = () => {
               )}
             </Card.Body>
             <Card.Footer>
+              <Form.Group className="mb-3">
+                <Form.Select
+                  value={webcamCameraId || ''}
+                  onChange={(e) => setWebcamCameraId(e.target.value ? parseInt(e.target.value, 10) : null)}
+                  disabled={isRunning}
+                >
+                  <option value="">Chọn camera lưu kết quả</option>
+                  {registeredCameras.filter(cam => cam.camera_type === 'webcam').map(camera => (
+                    <option key={camera.id} value={camera.id}>
+                      {camera.name}
+                    </option>
+                  ))}
+                </Form.Select>
+              </Form.Group>
               {renderEmotionResult(cameraResults.webcam)}
             </Card.Footer>
           </Card>
@@ -6,6 +6,8 @@ const EmotionHistory = () => {
     const [history, setHistory] = useState([]);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState(null);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
     const [filters, setFilters] = useState({
         camera_id: '',
         start_date: '',
@@ -17,16 +19,21 @@ const EmotionHistory = () => {
         fetchHistory();
     }, []);
 
+    const buildParams = (cursor) => {
+        const params = new URLSearchParams();
+        Object.entries(filters).forEach(([key, value]) => {
+            if (value) params.append(key, value);
+        });
+        if (cursor) params.append('cursor', cursor);
+        return params;
+    };
+
     const fetchHistory = async () => {
         try {
             setLoading(true);
-            const params = new URLSearchParams();
-            Object.entries(filters).forEach(([key, value]) => {
-                if (value) params.append(key, value);
-            });
-
-            const response = await axios.get(`http://localhost:5000/api/emotions?${params}`);
+            const response = await axios.get(`http://localhost:5000/api/emotions?${buildParams()}`);
             setHistory(response.data.emotions || []);
+            setNextCursor(response.data.next_cursor || null);
         } catch (err) {
             setError('Không thể tải lịch sử nhận diện');
             console.error('Error fetching history:', err);
@@ -35,6 +42,21 @@ const EmotionHistory = () => {
         }
     };
 
+    // Tải trang tiếp theo theo cursor
+    const loadMore = async () => {
+        if (!nextCursor) return;
+        try {
+            setLoadingMore(true);
+            const response = await axios.get(`http://localhost:5000/api/emotions?${buildParams(nextCursor)}`);
+            setHistory(prev => [...prev, ...(response.data.emotions || [])]);
+            setNextCursor(response.data.next_cursor || null);
+        } catch (err) {
+            console.error('Error loading more history:', err);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     const handleFilterChange = (e) => {
         const { name, value } = e.target;
         setFilters(prev => ({
@@ -173,6 +195,14 @@ const EmotionHistory = () => {
                     </tbody>
                 </Table>
             )}
+
+            {!loading && nextCursor && (
+                <div className="text-center">
+                    <Button variant="outline-primary" onClick={loadMore} disabled={loadingMore}>
+                        {loadingMore ? 'Đang tải...' : 'Xem thêm'}
+                    </Button>
+                </div>
+            )}
         </Container>
     );
 };
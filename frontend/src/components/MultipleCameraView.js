@@ -84,23 +84,20 @@ const MultipleCameraView = () => {
     fetchCameras();
   }, []);
 
-  // Add WebSocket connection for realtime emotion updates
+  // Nhận kết quả nhận diện realtime qua Server-Sent Events (/api/events)
   useEffect(() => {
-    const ws = new WebSocket('ws://localhost:5000/ws/emotion');
-    
-    ws.onmessage = (event) => {
-      const data = JSON.parse(event.data);
+    const source = apiService.events.subscribe({}, (data) => {
       setEmotionResults(prev => ({
         ...prev,
         [data.camera_id]: {
-          emotion: data.emotion,
-          confidence: data.confidence,
+          emotion: data.dominant_emotion,
+          confidence: data.scores[data.dominant_emotion],
           timestamp: data.timestamp
         }
       }));
-    };
+    });
 
-    return () => ws.close();
+    return () => source.close();
   }, []);
 
   // Start processing a camera
@@ -52,6 +52,8 @@ const apiService = {
   // Camera endpoints
   cameras: {
     getAll: () => api.get('/api/cameras'),
+    // Cảm xúc gần nhất và trạng thái của tất cả camera trong một request
+    getLatestState: () => api.get('/api/cameras/latest-state'),
     getById: (id) => api.get(`/api/cameras/${id}`),
     add: (cameraData) => api.post('/api/cameras', cameraData),
     update: (id, cameraData) => api.put(`/api/cameras/${id}`, cameraData),
@@ -60,12 +62,14 @@ const apiService = {
     startProcess: (id, options = {}) => api.post(`/api/process/${id}`, options),
     stopProcess: (id, options = {}) => api.post(`/api/stop-process/${id}`, options),
     getVideoFeed: (id) => `${API_URL}/api/video-feed/${id}`,
+    getMjpegUrl: (id, params = {}) => `${API_URL}/api/cameras/${id}/stream.mjpg?${new URLSearchParams(params).toString()}`,
     updateSettings: (cameraId, settings) => api.put(`/api/cameras/${cameraId}/settings`, settings),
     getSettings: (cameraId) => api.get(`/api/cameras/${cameraId}/settings`),
     connectIpCam: (cameraId, settings) => api.post(`/api/cameras/${cameraId}/connect`, settings),
     disconnect: (cameraId) => api.post(`/api/cameras/${cameraId}/disconnect`),
     detectFaces: (cameraId, options) => api.post(`/api/cameras/${cameraId}/detect-faces`, options),
     captureRtsp: (cameraId) => api.post(`/api/cameras/rtsp-capture`, { camera_id: cameraId }),
+    getSnapshotUrl: (id, params = {}) => `${API_URL}/api/cameras/${id}/snapshot?${new URLSearchParams(params).toString()}`,
     testConnection: (cameraId) => api.post(`/api/cameras/${cameraId}/test-connection`),
     startCamera: (cameraId) => api.post(`/api/cameras/${cameraId}/start`),
     stopCamera: (cameraId) => api.post(`/api/cameras/${cameraId}/stop`),
@@ -82,14 +86,40 @@ const apiService = {
 
   // Emotion detection results
   emotions: {
+    detect: (data) => api.post('/api/detect-emotion', data),
+    // Gửi ảnh dạng nhị phân (image/jpeg), không cần base64
+    detectBinary: (imageBlob, cameraId) => api.post('/api/detect-emotion', imageBlob, {
+      params: { cameraId },
+      headers: { 'Content-Type': 'image/jpeg' }
+    }),
     getAll: (params) => api.get('/api/results', { params }),
     getImage: (id) => `${API_URL}/api/image/${id}`,
     getProcessedImage: (id) => `${API_URL}/api/processed-image/${id}`,
+    // Link tải lịch sử (csv | parquet) với cùng bộ lọc như /api/emotions
+    exportUrl: (params = {}) => `${API_URL}/api/emotions/export?${new URLSearchParams(params).toString()}`,
   },
   
   // Statistics
   statistics: {
-    get: (params) => api.get('/api/statistics', { params }),
+    get: (params) => api.get('/api/stats', { params }),
+  },
+
+  // Kết quả nhận diện được server đẩy về qua Server-Sent Events (thay cho polling)
+  events: {
+    // onEmotion nhận { id, camera_id, timestamp, dominant_emotion, scores, faces }, trả về EventSource để gọi close()
+    subscribe: ({ cameraIds = [], groupIds = [] } = {}, onEmotion) => {
+      const params = new URLSearchParams();
+      if (cameraIds.length) params.set('camera_id', cameraIds.join(','));
+      if (groupIds.length) params.set('group_id', groupIds.join(','));
+      const source = new EventSource(`${API_URL}/api/events?${params.toString()}`);
+      source.addEventListener('emotion', (event) => onEmotion(JSON.parse(event.data)));
+      return source;
+    },
+  },
+
+  // Tác vụ nền (xóa camera, xóa dữ liệu cảm xúc)
+  jobs: {
+    get: (jobId) => api.get(`/api/jobs/${jobId}`),
   },
 
   // Kiểm tra trạng thái server